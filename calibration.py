@@ -9,21 +9,24 @@ import param
 
 
 def findObjectXYCenterInner(probe, expected_travel_x=0, expected_travel_y=0,
-                            move_x_relative_to_center=0, move_y_relative_to_center=0):
+                            move_x_relative_to_center=0, move_y_relative_to_center=0,
+                            strategy=None):
     """
     Finds center of the hole from inside by X and Y. Shape does not matter.
     Robot is assumed to be already in position to touch walls from inside.
+    strategy is the wall search strategy, 'staged' or 'bisection' (see tools.findWall);
+    probe default if not specified. Same for the other calibration routines.
     """
     
-    center_x = probe.findCenterInner('x', opposite_side_dist=expected_travel_x)
+    center_x = probe.findCenterInner('x', opposite_side_dist=expected_travel_x, strategy=strategy)
     probe.robot.move(x=center_x+move_x_relative_to_center)
-    center_y = probe.findCenterInner('y', opposite_side_dist=expected_travel_y)
+    center_y = probe.findCenterInner('y', opposite_side_dist=expected_travel_y, strategy=strategy)
     probe.robot.move(y=center_y+move_y_relative_to_center)
     
     return center_x, center_y
 
     
-def findXYInnerManyPoints(probe, points, step):
+def findXYInnerManyPoints(probe, points, step, strategy=None):
     
     x_center_list = []
     y_center_list = []
@@ -31,7 +34,7 @@ def findXYInnerManyPoints(probe, points, step):
     start_x, start_y, start_z = probe.robot.getPosition()
     
     for i in range(points):
-        center_x = probe.findCenterInner('x')
+        center_x = probe.findCenterInner('x', strategy=strategy)
         probe.robot.move(x=center_x)
         probe.robot.move_delta(dy=step)
         x_center_list.append(center_x)
@@ -39,7 +42,7 @@ def findXYInnerManyPoints(probe, points, step):
     
     probe.robot.move(start_x, start_y)
     for i in range(points):
-        center_y = probe.findCenterInner('y')
+        center_y = probe.findCenterInner('y', strategy=strategy)
         probe.robot.move(y=center_y)
         probe.robot.move_delta(dx=step)
         y_center_list.append(center_y)
@@ -49,7 +52,7 @@ def findXYInnerManyPoints(probe, points, step):
 
 
 def findXYCenterOuter(probe, raise_height, opposite_side_dist, orthogonal_retraction,
-                      move_x_relative_to_center=0, move_y_relative_to_center=0):
+                      move_x_relative_to_center=0, move_y_relative_to_center=0, strategy=None):
     """
     Finds center of the hole from outside by X and Y. Shape does not matter.
     Robot is assumed to be already in position to touch one of the walls from outside
@@ -58,7 +61,8 @@ def findXYCenterOuter(probe, raise_height, opposite_side_dist, orthogonal_retrac
     start_x, start_y, start_z = probe.robot.getPosition()
     # Finding center by X coordinate
     center_x = probe.findCenterOuter(axis='x', raise_height=raise_height,
-                                     dist_through_obstruct=opposite_side_dist)
+                                     dist_through_obstruct=opposite_side_dist,
+                                     strategy=strategy)
     # Moving up, so robot can get to the position for Y calibration
     probe.robot.move_delta(dz=-raise_height)
     # Moving to the position for Y calibration
@@ -68,7 +72,8 @@ def findXYCenterOuter(probe, raise_height, opposite_side_dist, orthogonal_retrac
     probe.robot.move_delta(dz=raise_height)
     # Finding center by Y coordinate
     center_y = probe.findCenterOuter(axis='y', raise_height=raise_height,
-                                     dist_through_obstruct=opposite_side_dist)
+                                     dist_through_obstruct=opposite_side_dist,
+                                     strategy=strategy)
     return center_x, center_y
 
 
@@ -85,7 +90,8 @@ def calibrateMobileToolHolderOuter(probe, tool_name,
                                    dz_tool_pickup,
                                    calibration_dz=5,
                                    raise_height=10,
-                                   dist_from_wall=10):
+                                   dist_from_wall=10,
+                                   strategy=None):
     """
     Calibrates tool holder and saves results on disc.
     
@@ -117,12 +123,13 @@ def calibrateMobileToolHolderOuter(probe, tool_name,
             height at which to pickup tool relative to calibrated z
         dist_from_wall
             How far from the wall to start calibraiton
+        strategy
+            Wall search strategy, 'staged' or 'bisection'; probe default if not specified.
     """
     # Finding center of the slot where the tool is
     # Using previous floor calibration
-    x, y = param.calcSquareSlotCenterFromVertices(n_x=n_x, n_y=n_y)
-    # Finding coordinates of slot bottom
-    z = param.getSlotZ(n_x=n_x, n_y=n_y)
+    # Finding coordinates of slot bottom as well
+    x, y, z = param.getSlotCenter(n_x=n_x, n_y=n_y)
     
     # Calculating other parameters for calibration
     half_size = holder_size / 2.0
@@ -140,7 +147,8 @@ def calibrateMobileToolHolderOuter(probe, tool_name,
     probe.robot.move(x=start_x, y=start_y, z=start_z, z_first=False)
     x, y = findXYCenterOuter(probe, raise_height=raise_height, 
                              opposite_side_dist=opposite_side_dist,
-                             orthogonal_retraction=orthogonal_retraction)
+                             orthogonal_retraction=orthogonal_retraction,
+                             strategy=strategy)
                              
     # Now calibrating z coordinate
     # Finding coordinates from where to calibrate Z
@@ -151,7 +159,7 @@ def calibrateMobileToolHolderOuter(probe, tool_name,
     # Moving to Z calibration position
     probe.robot.move(x=z_meas_x, y=z_meas_y)
     # Calibrating z
-    z = probe.findWall('z', 1)
+    z = probe.findWall('z', 1, strategy=strategy)
     # Calculating pickup tool coordinate:
     z_pickup = z + dz_tool_pickup
     
@@ -175,9 +183,11 @@ def findXYCenterOuterMultiPoint(probe,
                                 init_dist_to_obj_x, init_dist_to_obj_y,
                                 x_points_list, y_points_list,
                                 z_floor, z_meas, z_retract, safe_z=0,
-                                second_probe=None):
+                                second_probe=None, strategy=None):
     
     ar = probe.robot
+    if strategy is None:
+        strategy = probe.search_strategy
     
     # Finding distance between provided center and the edge of the object
     side_to_center_x = object_size_x / 2.0
@@ -198,7 +208,7 @@ def findXYCenterOuterMultiPoint(probe,
     
     # Measuring X coordinates of the left wall
     left_x_list = tools.findWallManyPoints(probe=probe, axis='x', direction=1, 
-                  touch_coord_list=x_points_list)
+                  touch_coord_list=x_points_list, strategy=strategy)
     
     # Moving to the opposite side by X coordinate
     ar.moveAxisDelta(axis='z', value=-z_retract)
@@ -206,7 +216,7 @@ def findXYCenterOuterMultiPoint(probe,
     
     # Measuring X coordinates of the opposite (right) wall
     right_x_list = tools.findWallManyPoints(probe=probe, axis='x', direction=-1, 
-                  touch_coord_list=x_points_list)
+                  touch_coord_list=x_points_list, strategy=strategy)
     
     # Calculating x_center
     left_x_avg = sum(left_x_list) / (len(left_x_list) * 1.0)
@@ -220,7 +230,7 @@ def findXYCenterOuterMultiPoint(probe,
     
     # Measuring Y coordinate of the upper wall (closer to the homing position)
     upper_y_list = tools.findWallManyPoints(probe=probe, axis='y', direction=1, 
-                  touch_coord_list=y_points_list)
+                  touch_coord_list=y_points_list, strategy=strategy)
     
     # Moving to the opposite side by Y coordinate
     ar.moveAxisDelta(axis='z', value=-z_retract)
@@ -228,7 +238,7 @@ def findXYCenterOuterMultiPoint(probe,
     
     # Measuring Y coordinate of the lower wall (further from the homing position).
     lower_y_list = tools.findWallManyPoints(probe=probe, axis='y', direction=-1, 
-                  touch_coord_list=y_points_list)
+                  touch_coord_list=y_points_list, strategy=strategy)
     
     # Calculating y_center
     upper_y_avg = sum(upper_y_list) / (len(upper_y_list) * 1.0)
@@ -240,7 +250,7 @@ def findXYCenterOuterMultiPoint(probe,
 
 
 # TODO: deltas to settings file
-def calibrateRack(probe, rack, x_calibration_deltaY=0, y_calibration_deltaX=0):
+def calibrateRack(probe, rack, x_calibration_deltaY=0, y_calibration_deltaX=0, strategy=None):
     """
     Calibrates square shaped object from outside.
     Finds X, Y and Z.
@@ -270,7 +280,7 @@ def calibrateRack(probe, rack, x_calibration_deltaY=0, y_calibration_deltaX=0):
     
     # Finding center by X
     center_x = probe.findCenterOuter(axis='x', raise_height=raise_z, 
-        dist_through_obstruct=opposite_x)
+        dist_through_obstruct=opposite_x, strategy=strategy)
     
     # Moving towards Y calibration
     # Up
@@ -281,7 +291,8 @@ def calibrateRack(probe, rack, x_calibration_deltaY=0, y_calibration_deltaX=0):
     ar.moveAxisDelta(axis='z', value=raise_z)
     
     # Finding center by Y
-    center_y = probe.findCenterOuter(axis='y', raise_height=raise_z, dist_through_obstruct=orthogonal_y*2.0)
+    center_y = probe.findCenterOuter(axis='y', raise_height=raise_z, dist_through_obstruct=orthogonal_y*2.0,
+                                     strategy=strategy)
     
     # Moving towards Z calibration
     # Up
@@ -293,7 +304,7 @@ def calibrateRack(probe, rack, x_calibration_deltaY=0, y_calibration_deltaX=0):
     ar.move(z=slot_z-height_from_bottom+calibr_Z_dZ)
     
     # Finding Z height
-    z = probe.findWall(axis='z', direction=1)
+    z = probe.findWall(axis='z', direction=1, strategy=strategy)
     
     # Obtaining calibration data of the probe against stationary probe
     stp_x, stp_y, stp_z = probe.getStalagmyteCoord()
@@ -332,7 +343,7 @@ def calcWellsXY(x_cntr, y_cntr, x_dist_1st_cntr, y_dist_1st_cntr, dist_wells_x,
     return coord_list
 
 
-def calibrateTool(tool, stationary_probe):
+def calibrateTool(tool, stationary_probe, strategy=None):
     """
     Calibrates a tool (docked to the gantry) against stationary touch probe
 
@@ -341,6 +352,8 @@ def calibrateTool(tool, stationary_probe):
             Object of a tool
         stationary_probe
             Object of a stationary touch probe    
+        strategy
+            Wall search strategy, 'staged' or 'bisection'; probe default if not specified.
     """
     
     # Unpacking robot object (for convenience)
@@ -358,7 +371,7 @@ def calibrateTool(tool, stationary_probe):
     
     # Finding center by X
     center_x = stationary_probe.findCenterOuter(axis='x', raise_height=raise_z, 
-        dist_through_obstruct=opposite_x)
+        dist_through_obstruct=opposite_x, strategy=strategy)
     
     # Moving towards Y calibration
     # Up
@@ -369,7 +382,8 @@ def calibrateTool(tool, stationary_probe):
     ar.moveAxisDelta(axis='z', value=raise_z)
     
     # Finding center by Y
-    center_y = stationary_probe.findCenterOuter(axis='y', raise_height=raise_z, dist_through_obstruct=orthogonal_y*2.0)
+    center_y = stationary_probe.findCenterOuter(axis='y', raise_height=raise_z, dist_through_obstruct=orthogonal_y*2.0,
+                                                strategy=strategy)
     
     # Moving towards Z calibration
     # Up
@@ -378,7 +392,7 @@ def calibrateTool(tool, stationary_probe):
     ar.move(x=center_x, y=center_y)
     
     # Finding Z height
-    z = stationary_probe.findWall(axis='z', direction=1)
+    z = stationary_probe.findWall(axis='z', direction=1, strategy=strategy)
 
     # Saving calibration points for mobile_probe, as they will be used for further objects calibrations
     tool.setStalagmyteCoord(center_x, center_y, z)
@@ -386,7 +400,7 @@ def calibrateTool(tool, stationary_probe):
     return center_x, center_y, z    
     
 
-def calibrateToolCustomPoints(tool, stationary_probe):
+def calibrateToolCustomPoints(tool, stationary_probe, strategy=None):
     """
     Calibrates a tool (docked to the gantry) against a stationary touch probe.
     This function uses custom calibration points provided within tool object;
@@ -449,7 +463,7 @@ def calibrateToolCustomPoints(tool, stationary_probe):
     # Finding center by X
     opposite_x = x_Xrear - x_Xfrontal
     center_x = stationary_probe.findCenterOuter(axis='x', raise_height=raise_z, 
-        dist_through_obstruct=opposite_x, step_back_length=tool.step_back_length)
+        dist_through_obstruct=opposite_x, step_back_length=tool.step_back_length, strategy=strategy)
         
     # Moving towards Y calibration
     # Up
@@ -463,7 +477,8 @@ def calibrateToolCustomPoints(tool, stationary_probe):
     # Finding center by Y
     dist_through_obstruct = y_Yrear - y_Yfrontal
     center_y = stationary_probe.findCenterOuter(axis='y', raise_height=raise_z,
-        dist_through_obstruct=dist_through_obstruct, step_back_length=tool.step_back_length)
+        dist_through_obstruct=dist_through_obstruct, step_back_length=tool.step_back_length,
+        strategy=strategy)
     
     # Moving towards Z calibration
     # Up
@@ -473,7 +488,7 @@ def calibrateToolCustomPoints(tool, stationary_probe):
     ar.move(x=center_x+dx_Z, y=center_y+dy_Z)
     
     # Finding Z height
-    z = stationary_probe.findWall(axis='z', direction=1)
+    z = stationary_probe.findWall(axis='z', direction=1, strategy=strategy)
 
     # Saving calibration points for mobile_probe, as they will be used for further objects calibrations
     tool.setStalagmyteCoord(center_x, center_y, z)
@@ -482,7 +497,7 @@ def calibrateToolCustomPoints(tool, stationary_probe):
     
     
     
-def calibrateStationaryProbe(mobile_probe, stationary_probe):
+def calibrateStationaryProbe(mobile_probe, stationary_probe, strategy=None):
     """
     Calibrate stationary probe against mobile probe; 
     to find absolute interaction point between robot gantry and floor.
@@ -494,9 +509,13 @@ def calibrateStationaryProbe(mobile_probe, stationary_probe):
             Object of a mobile touch probe
         stationary_probe
             Object of a stationary touch probe
+        strategy
+            Wall search strategy, 'staged' or 'bisection'; mobile probe default if not specified.
     """
     # Unpacking robot object (for simplicity)
     ar = mobile_probe.robot
+    if strategy is None:
+        strategy = mobile_probe.search_strategy
     
     # Obtaining calibration parameters:
     x_cal, y_cal, z_cal, opposite_x, orthogonal_y, raise_z = stationary_probe.rack.getSimpleCalibrationPoints()
@@ -505,7 +524,8 @@ def calibrateStationaryProbe(mobile_probe, stationary_probe):
     ar.move(x=x_cal, y=y_cal, z=z_cal, z_first=False)
     
     # Finding center by X
-    center_x = tools.findCenterOuterTwoProbes(mobile_probe, stationary_probe, axis='x')
+    center_x = tools.findCenterOuterTwoProbes(mobile_probe, stationary_probe, axis='x', 
+                                              strategy=strategy)
     
     # Moving towards Y calibration
     # Up
@@ -515,7 +535,8 @@ def calibrateStationaryProbe(mobile_probe, stationary_probe):
     # Down
     ar.moveAxisDelta(axis='z', value=raise_z)
     # Finding center by Y
-    center_y = tools.findCenterOuterTwoProbes(mobile_probe, stationary_probe, axis='y')
+    center_y = tools.findCenterOuterTwoProbes(mobile_probe, stationary_probe, axis='y', 
+                                              strategy=strategy)
     
     # Moving towards Z calibration
     # Up
@@ -523,7 +544,8 @@ def calibrateStationaryProbe(mobile_probe, stationary_probe):
     # To the center by XY (which was just discovered)
     ar.move(x=center_x, y=center_y)
     # Finding Z height
-    z = tools.findWall(probe=mobile_probe, axis='z', direction=1, second_probe=stationary_probe)
+    z = tools.findWall(probe=mobile_probe, axis='z', direction=1, second_probe=stationary_probe,
+                       strategy=strategy)
     
     # Saving data for stationary probe
     stationary_probe.rack.updateCenter(x=center_x, y=center_y, z=z, 
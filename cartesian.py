@@ -10,6 +10,7 @@ Sergii Pochekailov
 import re
 import time
 import logging
+import contextlib
 
 # Local parts of ArnieLib imports
 import low_level_comm as llc
@@ -40,9 +41,40 @@ OPEN_TOOL_DELAY = 1 # seconds
 CLOSE_TOOL_DELAY = 3.5 # seconds
 OPEN_TOOL_SERVO_ANGLE = 10
 CLOSE_TOOL_SERVO_ANGLE = 110
+# Maximum time for a docked tool to appear as a serial port
+TOOL_CONNECT_TIMEOUT = 10 # seconds
+# Minimum time for the docker servo to clamp a tool before lifting it
+TOOL_CLAMP_DELAY = 1 # seconds
 
 # Moving G-code command: G0 X<value> Y<value> Z<value> F<value>
 
+# Command streaming
+# Number of G-code commands sent to Marlin ahead, before receiving their "ok".
+# Marlin command buffer (BUFSIZE) holds 4 commands by default.
+STREAMING_CMDS_IN_FLIGHT = 4
+# Marlin acknowledges every command with this line
+ACK_MESSAGE = 'ok\n'
+# Marlin answers this command only after all buffered movements are physically finished.
+FINISH_MOVES_CMD = 'M400'
+
+# Probing
+# Stops all movements at once, dropping the buffered ones. Marlin keeps track of 
+# where the steppers actually stopped, so position is reported correctly afterwards.
+QUICK_STOP_CMD = 'M410'
+# Marlin probe moves; need the touch probe signal wired to the firmware probe pin.
+# Movement stops when the probe is triggered (G38.2) or released (G38.4)
+PROBE_TOWARD_CMD = 'G38.2'
+PROBE_AWAY_CMD = 'G38.4'
+
+# Position tracking
+# Position is kept in the arnie object after homing and every movement, so 
+# it is not requested from the firmware with M114 every time.
+# Every that many position requests, the position is still read from firmware 
+# to check for drift. 0 means never; use verifyPosition() explicitly.
+POSITION_CHECK_INTERVAL = 0
+# Difference between tracked and firmware-reported position (mm) considered as drift.
+POSITION_TOLERANCE = 0.01
+
 
 def axis_index(axis):
     result = axis.upper()
@@ -96,6 +128,8 @@ class arnie(llc.serial_device):
         self.speed_y = speed_y
         self.speed_z = speed_z
         self.welcome_message = welcome_message
+        # Docker operations below check for streamed movements.
+        self._resetStreaming()
         
         # Initializng docker
         self.docker = gripper(docker_port)
@@ -142,7 +176,169 @@ class arnie(llc.serial_device):
         self.speed = [speed_x, speed_y, speed_z]
         self.tools = []
         self.tool_devices = []
+        self._resetStreaming()
+        # Position tracked locally; None while unknown.
+        self.invalidatePosition()
+        self.position_check_interval = POSITION_CHECK_INTERVAL
+        self.position_requests_since_check = 0
+        
+    
+    def _resetStreaming(self):
+        # When max_cmds_in_flight is 0, every movement waits for 
+        # its "ok" before the next one is sent.
+        self.max_cmds_in_flight = 0
+        self.cmds_in_flight = 0
+        self.moves_not_synchronized = False
+    
+    
+    def setStreaming(self, cmds_in_flight=STREAMING_CMDS_IN_FLIGHT):
+        """
+        Enables or disables streaming of movement commands.
+        
+        In streaming mode, movements are sent without waiting for the previous
+        ones to be acknowledged, keeping up to cmds_in_flight commands not acknowledged.
+        The firmware then blends consecutive moves, without stopping the gantry
+        at every segment.
+        Operations that need the gantry to physically stand at position (probing,
+        docking, pipetting) call synchronize() first.
+        
+        Inputs:
+            cmds_in_flight
+                Number of commands sent ahead. 0 disables streaming.
+        """
+        if cmds_in_flight == 0:
+            self.synchronize()
+        logging.info("Arnie setStreaming: %s commands in flight allowed.", cmds_in_flight)
+        self.max_cmds_in_flight = cmds_in_flight
+        
+    
+    @contextlib.contextmanager
+    def streaming(self, cmds_in_flight=STREAMING_CMDS_IN_FLIGHT):
+        """
+        Streams movements inside "with" block; waits for all movements
+        to physically finish when exiting.
+        Example:
+            with ar.streaming():
+                ar.move(x=100, y=100)
+                ar.move(z=300)
+        """
+        previous_cmds_in_flight = self.max_cmds_in_flight
+        self.setStreaming(cmds_in_flight)
+        try:
+            yield self
+        finally:
+            self.synchronize()
+            self.max_cmds_in_flight = previous_cmds_in_flight
+
+    
+    def sendStreamed(self, expression):
+        """
+        Sends G-code command without waiting for it to be acknowledged.
+        If too many commands are already waiting, waits for "ok" of the oldest.
+        """
+        while self.cmds_in_flight >= max(self.max_cmds_in_flight, 1):
+            self._receiveAck()
+        # Input is not flushed, as it contains acknowledgements of previous commands
+        self.write(expression, flush=False)
+        self.cmds_in_flight += 1
+        self.moves_not_synchronized = True
+    
+    
+    def _receiveAck(self):
+        self.readBufferUntilMatch(pattern=ACK_MESSAGE)
+        self.cmds_in_flight -= 1
+    
+    
+    def receivePendingAcks(self):
+        """
+        Waits for acknowledgements of all the streamed commands.
+        Commands are accepted by the firmware, but movements may still go on.
+        """
+        while self.cmds_in_flight > 0:
+            self._receiveAck()
+    
+    
+    def synchronize(self):
+        """
+        Waits until all streamed movements are physically finished.
+        Does nothing if there were no streamed movements since last call.
+        """
+        self.receivePendingAcks()
+        if self.moves_not_synchronized:
+            logging.info("Arnie synchronize: waiting for movements to finish.")
+            self.writeAndWait(FINISH_MOVES_CMD)
+            self.moves_not_synchronized = False
+        
+    
+    def writeAndWait(self, expression, eol=None, confirm_message=ACK_MESSAGE):
+        # Acknowledgements of streamed commands must not be taken 
+        # as the answer for this one.
+        self.receivePendingAcks()
+        return super().writeAndWait(expression, eol=eol, confirm_message=confirm_message)
+
+    
+    def _sendMoveCmd(self, full_cmd, wait=True):
+        """
+        Sends movement G-code, either streaming it or waiting for "ok".
+        """
+        if self.max_cmds_in_flight > 0 or not wait:
+            self.sendStreamed(full_cmd)
+        else:
+            self.writeAndWait(full_cmd)
+            # Marlin acknowledges movement when it is planned, not finished
+            self.moves_not_synchronized = True
+    
+    
+    def quickStop(self):
+        """
+        Stops gantry immediately, wherever it is, discarding all buffered movements.
+        
+        Returns:
+            x, y, z
+                Position at which the gantry stopped, as reported by firmware.
+        """
+        self.sendStreamed(QUICK_STOP_CMD)
+        self.receivePendingAcks()
+        self.moves_not_synchronized = False
+        return self.getPosition(from_firmware=True)
+    
+    
+    def probeMove(self, axis, destination, speed=None, away=False):
+        """
+        Moves along the axis until the firmware probe is triggered, using G38.2.
+        Works only if the touch probe signal is wired to the Marlin probe pin.
         
+        Inputs:
+            axis
+                "X", "Y" or "Z"
+            destination
+                Absolute coordinate at which to give up, if nothing is touched.
+            speed
+                Movement speed. If not specified, library default is used.
+            away
+                If True, moves until the probe is released instead (G38.4).
+        
+        Returns:
+            Coordinate along the axis at which the movement stopped.
+        """
+        axis = self.checkAxis(axis).upper()
+        if speed is None:
+            speed = self.assignSpeedByAxis(axis)
+        cmd = PROBE_AWAY_CMD if away else PROBE_TOWARD_CMD
+        full_cmd = cmd + ' ' + axis + str(destination) + ' F' + str(speed)
+        logging.info("probeMove: G-code command generated: %s", full_cmd)
+        self.writeAndWait(full_cmd)
+        return self.getPosition(from_firmware=True)[axis_index(axis)]
+    
+    
+    def estimateMoveTime(self, distance, speed):
+        """
+        Returns time (s) needed to travel the distance (mm) at speed (mm/min),
+        not counting acceleration.
+        """
+        return abs(distance) / (speed / 60.0)
+    
+
     def home(self, axes='ZXY'):
         """
         Home one of the axes, X, Y or Z.
@@ -161,9 +357,11 @@ class arnie(llc.serial_device):
             else:
                 logging.info("Homing axis %s started", axis)
                 self.writeAndWait(HOMING_CMD + ' ' +axis)
+                # Position after homing is defined by firmware settings.
+                self.getPosition(from_firmware=True)
     
 
-    def moveAxis(self, axis, destination, speed=None):
+    def moveAxis(self, axis, destination, speed=None, wait=True):
         """
         Moves specified axis to a new position with absolute coordinate.
         
@@ -177,6 +375,10 @@ class arnie(llc.serial_device):
             speed
                 Speed at which to perform movement. If not specified, 
                 library default is used.
+            
+            wait
+                If False, returns as soon as the command is sent, 
+                while the gantry is still moving; as in streaming mode.
         """
         
         axis = self.checkAxis(axis)
@@ -191,8 +393,10 @@ class arnie(llc.serial_device):
             logging.info("moveAxis: %s=%s with speed %s", axis, destination, speed)
             logging.info("moveAxis: G-code command generated: %s", full_cmd)
             
-            self.writeAndWait(full_cmd)
+            self._sendMoveCmd(full_cmd, wait=wait)
+            self.tracked_position[axis_index(axis)] = float(destination)
         except:
+            self.invalidatePosition()
             logging.warning("moveAxis: Attempted to move carriage to the new position along the axis %s", axis)
             logging.warning("moveAxis: %s=%s with speed %s", axis, destination, speed)
             logging.warning("moveAxis: G-code command generated: %s", full_cmd)
@@ -214,15 +418,18 @@ class arnie(llc.serial_device):
                 Speed is measured in arbitrary units.
         """
         if speed == None:
-            speed = assignSpeedByAxis('x')
+            speed = self.assignSpeedByAxis('x')
         full_cmd = 'G0 X' + str(x) + ' Y' + str(y) + ' F' + str(speed)
         try:
             logging.info("moveXY: Moving carriage to the new position with coordinates:")
             logging.info("moveXY: X=%s, Y=%s with speed %s", x, y, speed)
             logging.info("moveXY: G-code command generated: %s", full_cmd)
             
-            self.writeAndWait(full_cmd)
+            self._sendMoveCmd(full_cmd)
+            self.tracked_position[0] = float(x)
+            self.tracked_position[1] = float(y)
         except:
+            self.invalidatePosition()
             logging.warning("moveXY: Attempted to move carriage to the new position with coordinates:")
             logging.warning("moveXY: X=%s, Y=%s with speed %s", x, y, speed)
             logging.warning("moveXY: G-code command generated: %s", full_cmd)
@@ -333,28 +540,76 @@ class arnie(llc.serial_device):
         self.moveAxis(axis=axis, destination=new_abs_position, speed=speed)
         
     
-    def openTool(self):
-        """Docker opens to accept a tool"""
+    def openTool(self, delay=None, synchronize=True):
+        """
+        Docker opens to accept a tool
+        
+        Inputs:
+            delay
+                Time to wait for the servo to open, seconds. Default is OPEN_TOOL_DELAY.
+            synchronize
+                If False, does not wait for the gantry to stop before opening.
+        """
         logging.info("Arnie openTool: Opening tool docker to accept a new tool.")
+        if synchronize:
+            self.synchronize()
         self.docker.setServoPosition(OPEN_TOOL_SERVO_ANGLE)
-        time.sleep(OPEN_TOOL_DELAY)
+        if delay is None:
+            delay = OPEN_TOOL_DELAY
+        time.sleep(delay)
+        
         
+    def closeTool(self, delay=None, synchronize=True):
+        """
+        Docker closes, fixing a tool in place
         
-    def closeTool(self):
-        """Docker closes, fixing a tool in place"""        
+        Inputs:
+            delay
+                Time to wait for the servo to close, seconds. Default is CLOSE_TOOL_DELAY.
+            synchronize
+                If False, does not wait for the gantry to stop before closing.
+        """
         logging.info("Arnie closeTool: Closing tool docker, possibly with a new tool.")
+        if synchronize:
+            self.synchronize()
         self.docker.setServoPosition(CLOSE_TOOL_SERVO_ANGLE)
-        time.sleep(CLOSE_TOOL_DELAY)
+        if delay is None:
+            delay = CLOSE_TOOL_DELAY
+        time.sleep(delay)
     
-    def getPosition(self):
+    def invalidatePosition(self):
+        """
+        Forgets tracked position, so the next position request goes to the firmware.
+        Call it when the gantry could have moved not by arnie commands.
         """
-        Requests current position from cartesian robot firmware.
-        Request is done by sending G-code M114.
+        self.tracked_position = [None, None, None]
+    
+    
+    def getPosition(self, from_firmware=False):
+        """
+        Returns current position of the cartesian robot.
+        
+        Position is tracked after homing and every movement, so normally there is 
+        no need to ask the firmware. The firmware is asked (by sending G-code M114)
+        if from_firmware is True, if position is not known yet, 
+        or every position_check_interval requests.
+        In streaming mode, returns position where the gantry will be after 
+        finishing the movements sent.
         
         Returns:
             x, y, z
                 Current coordinates of the cartesian robot relative to homing position, in mm.
         """
+        if not from_firmware and None not in self.tracked_position:
+            self.position_requests_since_check += 1
+            if (self.position_check_interval <= 0 or 
+                    self.position_requests_since_check < self.position_check_interval):
+                x, y, z = self.tracked_position
+                return x, y, z
+            self.verifyPosition()
+            x, y, z = self.tracked_position
+            return x, y, z
+        
         self.writeAndWait("M114")
         msg = self.recent_message
         msg_list = re.split(pattern=' ', string=msg)
@@ -366,9 +621,31 @@ class arnie(llc.serial_device):
         y = float(re.split(pattern="\:", string=y_str)[1])
         z = float(re.split(pattern="\:", string=z_str)[1])
         logging.info("Current cartesian robot coordinates are x=%s, y=%s, z=%s", x, y, z)
+        self.tracked_position = [x, y, z]
+        self.position_requests_since_check = 0
         return x, y, z
     
     
+    def verifyPosition(self, tolerance=POSITION_TOLERANCE):
+        """
+        Compares tracked position with the one reported by firmware.
+        Firmware position is taken as the right one afterwards.
+        
+        Returns:
+            dx, dy, dz
+                Firmware position minus tracked position, in mm.
+                None for the axes whose position was not known.
+        """
+        tracked = list(self.tracked_position)
+        firmware = self.getPosition(from_firmware=True)
+        drift = [None if t is None else f - t for t, f in zip(tracked, firmware)]
+        for axis, d in zip(['X', 'Y', 'Z'], drift):
+            if d is not None and abs(d) > tolerance:
+                logging.warning("Arnie verifyPosition: axis %s drifted by %s mm from tracked position.", 
+                                axis, d)
+        return drift
+    
+    
     def getAxisPosition(self, axis=None):
         """
         Returns only position at provided axis
@@ -412,35 +689,48 @@ class arnie(llc.serial_device):
     def getToolAtCoord(self, x, y, z, z_init=0, speed_xy=None, speed_z=None):
         """
         Get tool positioned at known absolute coordinates x, y, z.
-        """
         
-        # Producing a list of present serial ports BEFORE engaging a new tool
-        initial_ports_list = llc.listSerialPorts()
-        
-        # Moving to the save height, so nothing is kicked by a robot
-        self.move(z=z_init, speed_z=None)
-        # Opening docker
-        self.openTool()
-        # Moving to the tool coordinate
-        self.move(x=x, y=y, z=z, z_first=False, speed_xy=speed_xy, speed_z=SPEED_Z_MOVING_DOWN)
-        # Closing docker (hopefully gripping the tool)
-        self.closeTool()
-        
-        # Obtaining updated list of serial devices. Now a new device should be present there.
-        updated_ports_list = llc.listSerialPorts()
-        # Obtaining newly appeared port
-        new_port = list(set(updated_ports_list) - set(initial_ports_list))[0]
+        Raises RuntimeError if no tool port appears within TOOL_CONNECT_TIMEOUT; 
+        the docker is opened and the robot returns to z_init first.
+        """
+        
+        # Watching for the serial port of the tool to appear. Ports present 
+        # before engaging a new tool are ignored.
+        with llc.port_watcher() as watcher:
+            # Moving to the save height, so nothing is kicked by a robot
+            self.move(z=z_init, speed_z=None)
+            # Opening docker
+            self.openTool()
+            # Moving to the tool coordinate
+            self.move(x=x, y=y, z=z, z_first=False, speed_xy=speed_xy, speed_z=SPEED_Z_MOVING_DOWN)
+            # Closing docker (hopefully gripping the tool). The tool is connected 
+            # once its port appears; no need to wait for the whole CLOSE_TOOL_DELAY.
+            self.closeTool(delay=0)
+            clamp_start = time.time()
+            new_port = watcher.waitForNewPort(timeout=TOOL_CONNECT_TIMEOUT)
+        
+        if new_port is None:
+            # Releasing whatever is in the docker and leaving the tool rack
+            self.openTool()
+            self.move(z=z_init)
+            raise RuntimeError("Arnie getToolAtCoord: no tool connected at %s, %s, %s within %s s." 
+                               % (x, y, z, TOOL_CONNECT_TIMEOUT))
         
         # Connecting to the device
         device = llc.serial_device(new_port)
         
+        # The port may appear before the servo has clamped the tool
+        clamp_remaining = TOOL_CLAMP_DELAY - (time.time() - clamp_start)
+        if clamp_remaining > 0:
+            time.sleep(clamp_remaining)
+        
         self.move(z=z_init)
         
         # After liting a tool, closing the jaws again, to make grip stronger, and to fix 
         # possible non-ideal pickup.
         # Added 3/19/2020, after getting tired with precise calibration of pickup height.
-        self.closeTool()
-        self.closeTool()
+        # Servo is already in closed position, so the next move does not need to wait.
+        self.closeTool(delay=0)
         
         return device
         
@@ -455,9 +745,7 @@ class arnie(llc.serial_device):
         if data_path is None:
             data_path = param.DEFAULT_TOOL_CALIBR_FILE
         
-        if tool_data is None:
-            tool_data = param.loadData('tools.json')
-            
+        # Without tool_data, saved tools are looked up in the tool registry
         if tool_name is not None:
             [x, y, z] = param.getToolDockingPoint(toolname=tool_name, data=tool_data, tool_file=data_path)
         elif (x_n is not None) and (y_n is not None):
@@ -515,16 +803,18 @@ class arnie(llc.serial_device):
         # If unable to get coordinates from the object itself, 
         # trying to find them by the device name using calibration
         # data stored on drive
+        if data_path is None:
+            data_path = param.DEFAULT_TOOL_CALIBR_FILE
         if (not coordinates_obtained) and (tool_name is not None):
             try:
-                [x, y, z] = param.getToolDockingPoint(tool_name)
+                [x, y, z] = param.getToolDockingPoint(toolname=tool_name, data=tool_data, tool_file=data_path)
                 coordinates_obtained = True
             except:
                 pass
         # Trying to get by the slot given it is provided
         elif (not coordinates_obtained) and (x_n is not None) and (y_n is not None):
             try:
-                [x, y, z] = param.getToolDockingPoint(tool_name)
+                [x, y, z] = param.getToolDockingPoint(slot=[x_n, y_n], data=tool_data, tool_file=data_path)
                 coordinates_obtained = True
             except:
                 pass
@@ -635,5 +925,6 @@ class arnie(llc.serial_device):
         
         
     def close(self):
+        self.synchronize()
         self.docker.close()
         super().close()
\ No newline at end of file
@@ -0,0 +1,159 @@
+"""
+Coordinate frames of the deck.
+
+Every frame is placed inside its parent frame by a homogeneous transform;
+the root frame is the robot (deck) coordinate system. Transforms of a frame
+to the deck, and between frames, are calculated once and kept until any
+frame along the way is moved (recalibrated).
+
+Frames used by the library:
+    rack.frame
+        Rack center, as obtained by rack calibration.
+    rack.stalagmyte_frame
+        Point at which the touch probe, used to calibrate the rack, touches the #stalagmyte.
+    toolFrame(tool)
+        Point at which the tool touches the #stalagmyte.
+Moving a point from the probe frame to the tool frame gives gantry coordinates
+at which the tool reaches the point the probe was calibrated at.
+"""
+
+import numpy as np
+
+
+def translation(x, y, z):
+    """
+    Returns homogeneous transform matrix moving points by x, y, z.
+    """
+    matrix = np.identity(4)
+    matrix[:3, 3] = [x, y, z]
+    return matrix
+
+
+def transformPoints(matrix, points):
+    """
+    Applies homogeneous transform to the points.
+
+    Inputs:
+        matrix
+            4x4 homogeneous transform
+        points
+            Array-like of shape (n, 3)
+
+    Returns:
+        numpy array of shape (n, 3)
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+class frame():
+    """
+    Coordinate frame, placed at offset x, y, z in its parent frame.
+    Frame without parent is placed in the deck coordinates.
+    """
+
+    def __init__(self, name, offset=(0, 0, 0), parent=None):
+        self.name = name
+        self.parent = None
+        self.children = []
+        self.offset = tuple(float(c) for c in offset)
+        # Incremented every time the frame, or any of its parents, moves.
+        self.version = 0
+        self._to_deck = None
+        # Transforms relative to other frames: {frame: (self version, other version, matrix)}
+        self._relative = {}
+        if parent is not None:
+            self.setParent(parent)
+
+
+    def __repr__(self):
+        return "frame(%r, offset=%s)" % (self.name, self.offset)
+
+
+    def setParent(self, parent):
+        if self.parent is not None:
+            self.parent.children.remove(self)
+        self.parent = parent
+        if parent is not None:
+            parent.children.append(self)
+        self.invalidate()
+
+
+    def setOffset(self, x, y, z):
+        """
+        Moves the frame within its parent, e.g. after recalibration.
+        Transforms depending on the frame are recalculated at the next request.
+        """
+        offset = (float(x), float(y), float(z))
+        if offset == self.offset:
+            return
+        self.offset = offset
+        self.invalidate()
+
+
+    def invalidate(self):
+        self.version += 1
+        self._to_deck = None
+        for child in self.children:
+            child.invalidate()
+
+
+    def localMatrix(self):
+        return translation(*self.offset)
+
+
+    def toDeck(self):
+        """
+        Returns homogeneous transform from this frame to the deck coordinates.
+        """
+        if self._to_deck is None:
+            matrix = self.localMatrix()
+            if self.parent is not None:
+                matrix = self.parent.toDeck() @ matrix
+            self._to_deck = matrix
+        return self._to_deck
+
+
+    def relativeTo(self, other):
+        """
+        Returns homogeneous transform of the deck points, moving the origin of other
+        frame to the origin of this one.
+        """
+        cached = self._relative.get(other)
+        if cached is not None and cached[0] == self.version and cached[1] == other.version:
+            return cached[2]
+        matrix = self.toDeck() @ np.linalg.inv(other.toDeck())
+        self._relative[other] = (self.version, other.version, matrix)
+        return matrix
+
+
+    def pointsToDeck(self, points):
+        """
+        Converts points of shape (n, 3) given in this frame into deck coordinates.
+        """
+        return transformPoints(self.toDeck(), points)
+
+
+    def pointToDeck(self, x, y, z):
+        return tuple(float(c) for c in self.pointsToDeck([x, y, z])[0])
+
+
+def toolFrame(tool):
+    """
+    Returns frame of the tool calibration point, i.e. where it touches the #stalagmyte.
+    The frame follows tool.getStalagmyteCoord(), which may change with the tool state
+    (tip attached, object gripped).
+
+    Returns None if the tool is not calibrated.
+    """
+    try:
+        x, y, z = tool.getStalagmyteCoord()
+    except:
+        return None
+    try:
+        tool_frame = tool._calibration_frame
+    except AttributeError:
+        tool_frame = frame("tool calibration")
+        tool._calibration_frame = tool_frame
+    tool_frame.setOffset(x, y, z)
+    return tool_frame
@@ -3,6 +3,17 @@ import time
 import re
 import logging
 import sys
+import threading
+import queue
+import struct
+import collections
+import json
+import os
+import concurrent.futures
+import ctypes
+import ctypes.util
+import select
+import serial.tools.list_ports
 
 
 """
@@ -24,8 +35,443 @@ WELCOME_MESSAGE_DELAY = 2   # seconds
 
 # This is the default time to wait for any message to be send by a device.
 # No effect when using readBufferUntilMatch(), or writeAndWait().
+# Since the port is read in background, readAll() returns as soon as the device
+# answered; this is only the upper limit of waiting.
 READALL_DELAY = 0.1 # secodns
 
+# Devices send multi-line answers in bursts. Once the first line of an answer arrived,
+# readAll() keeps collecting lines until nothing new arrives during this time.
+READALL_QUIET_GAP = 0.02 # seconds
+# Same as above, for the welcome message. Some devices (Marlin) print a lot of lines
+# at startup, with pauses between them.
+WELCOME_QUIET_GAP = 0.2 # seconds
+
+# File remembering welcome messages of USB devices seen before, by their USB identity
+# (vendor id, product id and serial number). Devices found there are matched by 
+# matchPortsWithDevices() without opening their ports.
+PORT_CACHE_FILE = "serial_ports.json"
+# Maximum number of ports opened at once by matchPortsWithDevices()
+PORT_PROBE_WORKERS = 8
+
+# port_watcher checks the list of ports at least that often, 
+# even if no change was reported by the system.
+PORT_POLL_INTERVAL = 0.1 # seconds
+# Directory watched for appearing device nodes
+DEVICES_DIR = "/dev"
+# inotify events: IN_ATTRIB, IN_CREATE, IN_DELETE. Attributes change when udev 
+# sets permissions of a new node, after which it can be opened.
+INOTIFY_EVENTS = 0x004 | 0x100 | 0x200
+
+# Ports of devices which are not found by scanning the system ports, 
+# e.g. simulated devices (see simulator.py). listSerialPorts() returns them as well.
+virtual_ports = []
+# Notified every time virtual_ports change.
+ports_changed = threading.Condition()
+
+# Serial traffic trace file format.
+# File starts with TRACE_HEADER, followed by records. Each record is 
+# TRACE_RECORD structure: kind, port number, time (s) since start of recording, 
+# data length; followed by the data.
+TRACE_HEADER = b"ARNIETRACE1\n"
+TRACE_RECORD = struct.Struct("<BHdI")
+# Record kinds
+TRACE_PORT_NAME = 0     # Data is the name of the port, which gets the port number
+TRACE_OPEN = 1
+TRACE_CLOSE = 2
+TRACE_WRITE = 3
+TRACE_READ = 4
+TRACE_PORTS_LIST = 5    # Data is listSerialPorts() output, joined with new lines
+
+# Active trace_recorder and trace_replay; see startRecording() and startReplay()
+recorder = None
+replay = None
+
+
+class port_reader(threading.Thread):
+    """
+    Reads an open serial port in background.
+    
+    Incoming bytes are split into lines, and the lines are put into a queue, 
+    from which serial_device picks them up. This way, functions waiting for an 
+    answer return the moment the answer arrives, instead of sleeping fixed time.
+    """
+    
+    def __init__(self, port, port_name=""):
+        """
+        Inputs:
+            port
+                Opened serial.Serial instance
+            port_name
+                Name of the port, used for logging only.
+        """
+        super().__init__(daemon=True)
+        self.port = port
+        self.port_name = port_name
+        # Complete lines received from the device, including end of line characters
+        self.lines = queue.Queue()
+        # Bytes received after the last end of line
+        self._partial = b""
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        
+        
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                waiting = self.port.in_waiting
+                data = self.port.read(waiting if waiting > 0 else 1)
+            except (OSError, TypeError, ValueError, AttributeError):
+                # Port was closed, or it is not a real port (such as in unit tests)
+                break
+            if not isinstance(data, bytes):
+                break
+            if data:
+                recordTraffic(TRACE_READ, self.port_name, data)
+            self._feed(data)
+        logging.debug("Port %s: Background reader stopped.", self.port_name)
+            
+    
+    def _feed(self, data):
+        """
+        Splits received bytes into lines and puts them into the queue.
+        Empty data means the port read timed out; then an incomplete line, if any, 
+        is passed as it is, as some devices do not end their answers with end of line.
+        """
+        with self._lock:
+            if data:
+                self._partial += data
+                while b"\n" in self._partial:
+                    line, self._partial = self._partial.split(b"\n", 1)
+                    self.lines.put((line + b"\n").decode("utf-8", errors="replace"))
+            elif self._partial:
+                self.lines.put(self._partial.decode("utf-8", errors="replace"))
+                self._partial = b""
+                
+                
+    def clear(self):
+        """
+        Removes everything received so far
+        """
+        with self._lock:
+            self._partial = b""
+            while True:
+                try:
+                    self.lines.get_nowait()
+                except queue.Empty:
+                    break
+    
+    
+    def stop(self, timeout=1):
+        self._stop_event.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+
+class trace_recorder():
+    """
+    Writes serial traffic of all devices into a binary trace file.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_HEADER)
+        self.start_time = time.monotonic()
+        self.port_numbers = {}
+        self._lock = threading.Lock()
+    
+    
+    def record(self, kind, port_name, data=b""):
+        with self._lock:
+            if self.file is None:
+                return
+            timestamp = time.monotonic() - self.start_time
+            if port_name not in self.port_numbers:
+                number = len(self.port_numbers)
+                self.port_numbers[port_name] = number
+                self._write(TRACE_PORT_NAME, number, timestamp, str(port_name).encode())
+            self._write(kind, self.port_numbers[port_name], timestamp, data)
+    
+    
+    def _write(self, kind, number, timestamp, data):
+        self.file.write(TRACE_RECORD.pack(kind, number, timestamp, len(data)))
+        self.file.write(data)
+    
+    
+    def close(self):
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def startRecording(path):
+    """
+    Starts recording traffic of all serial devices into the trace file at path.
+    Returns trace_recorder object.
+    """
+    global recorder
+    stopRecording()
+    recorder = trace_recorder(path)
+    logging.info("Serial traffic recording started: %s", path)
+    return recorder
+
+
+def stopRecording():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        logging.info("Serial traffic recording stopped: %s", recorder.path)
+    recorder = None
+
+
+def recordTraffic(kind, port_name, data=b""):
+    """
+    Records serial traffic event, if recording is on.
+    """
+    if recorder is not None:
+        recorder.record(kind, port_name, data)
+
+
+def readTrace(path):
+    """
+    Reads trace file written by trace_recorder.
+    
+    Returns:
+        List of (kind, port_name, timestamp, data) tuples, in order of recording.
+    """
+    events = []
+    port_names = {}
+    with open(path, 'rb') as f:
+        if f.read(len(TRACE_HEADER)) != TRACE_HEADER:
+            raise ValueError("Not a serial traffic trace file: " + str(path))
+        while True:
+            header = f.read(TRACE_RECORD.size)
+            if len(header) < TRACE_RECORD.size:
+                break
+            kind, number, timestamp, length = TRACE_RECORD.unpack(header)
+            data = f.read(length)
+            if kind == TRACE_PORT_NAME:
+                port_names[number] = data.decode()
+            else:
+                events.append((kind, port_names[number], timestamp, data))
+    return events
+
+
+def summarizeTrace(path):
+    """
+    Splits time of the recorded run into device time (from sending a command 
+    till the last answer to it) and host time (from the last answer till the next command).
+    
+    Returns:
+        Dictionary per port: {'writes': ..., 'reads': ..., 'device_time': ..., 'host_time': ...}
+        and 'total_time' of the recording.
+    """
+    summary = {}
+    last_write = {}
+    last_read = {}
+    total_time = 0.0
+    for kind, port_name, timestamp, data in readTrace(path):
+        total_time = timestamp
+        port = summary.setdefault(port_name, {'writes': 0, 'reads': 0, 
+                                              'device_time': 0.0, 'host_time': 0.0})
+        if kind == TRACE_WRITE:
+            port['writes'] += 1
+            if port_name in last_read:
+                port['host_time'] += timestamp - last_read.pop(port_name)
+            last_write[port_name] = timestamp
+        elif kind == TRACE_READ:
+            port['reads'] += 1
+            if port_name in last_write:
+                previous = last_read.get(port_name, last_write[port_name])
+                port['device_time'] += timestamp - previous
+            last_read[port_name] = timestamp
+        elif kind in (TRACE_OPEN, TRACE_CLOSE):
+            last_write.pop(port_name, None)
+            last_read.pop(port_name, None)
+    summary['total_time'] = total_time
+    return summary
+
+
+class replay_port():
+    """
+    Stands in for serial.Serial, giving back the traffic recorded during 
+    one opening of the port.
+    
+    Recorded answers are released after the recorded write preceding them, 
+    with the recorded delay divided by time_compression.
+    """
+    
+    def __init__(self, port_name, events, time_compression=1.0, timeout=TIMEOUT):
+        self.port_name = port_name
+        self.timeout = timeout
+        self.time_compression = time_compression
+        self.is_open = True
+        # Number of writes which differed from the recorded ones
+        self.mismatches = 0
+        self._events = collections.deque(events)
+        # Released answers: (release time, data)
+        self._pending = collections.deque()
+        self._condition = threading.Condition()
+        # Answers before the first write (welcome message) are timed from opening
+        open_time = 0.0
+        if self._events and self._events[0][0] == TRACE_OPEN:
+            open_time = self._events.popleft()[2]
+        self._release(open_time)
+    
+    
+    def _release(self, reference_time):
+        now = time.monotonic()
+        while self._events and self._events[0][0] == TRACE_READ:
+            kind, port_name, timestamp, data = self._events.popleft()
+            delay = (timestamp - reference_time) / self.time_compression
+            self._pending.append((now + max(delay, 0), data))
+    
+    
+    def write(self, data):
+        with self._condition:
+            while self._events and self._events[0][0] != TRACE_WRITE:
+                self._events.popleft()
+            if not self._events:
+                self.mismatches += 1
+                logging.warning("Replay port %s: unexpected write %s; nothing more was recorded.", 
+                                self.port_name, data)
+                return len(data)
+            kind, port_name, timestamp, recorded = self._events.popleft()
+            if recorded != data:
+                self.mismatches += 1
+                logging.warning("Replay port %s: written %s, while recorded %s.", 
+                                self.port_name, data, recorded)
+            self._release(timestamp)
+            self._condition.notify_all()
+        return len(data)
+    
+    
+    def _availableBytes(self, now):
+        return sum(len(data) for release, data in self._pending if release <= now)
+    
+    
+    @property
+    def in_waiting(self):
+        self._checkOpen()
+        with self._condition:
+            return self._availableBytes(time.monotonic())
+    
+    
+    def read(self, size=1):
+        """
+        Same as serial.Serial.read(): waits until something arrives, or for timeout.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                self._checkOpen()
+                now = time.monotonic()
+                if self._availableBytes(now) > 0 or now >= deadline:
+                    break
+                wait = deadline - now
+                if self._pending:
+                    wait = min(wait, max(self._pending[0][0] - now, 0))
+                self._condition.wait(wait)
+            result = b""
+            while self._pending and self._pending[0][0] <= now and len(result) < size:
+                release, data = self._pending.popleft()
+                taken = data[:size - len(result)]
+                result += taken
+                if len(taken) < len(data):
+                    self._pending.appendleft((release, data[len(taken):]))
+            return result
+    
+    
+    def flushInput(self):
+        with self._condition:
+            now = time.monotonic()
+            while self._pending and self._pending[0][0] <= now:
+                self._pending.popleft()
+    
+    reset_input_buffer = flushInput
+    
+    
+    def _checkOpen(self):
+        if not self.is_open:
+            raise serial.SerialException("Replay port %s is closed" % self.port_name)
+    
+    
+    def close(self):
+        with self._condition:
+            self.is_open = False
+            self._condition.notify_all()
+
+
+class trace_replay():
+    """
+    Replays recorded trace file: every opening of a port gets a replay_port
+    with the traffic of the next recorded opening of that port.
+    """
+    
+    def __init__(self, path, time_compression=1.0):
+        self.path = path
+        self.time_compression = time_compression
+        self.sessions = {}
+        self.ports_lists = collections.deque()
+        current = {}
+        for event in readTrace(path):
+            kind, port_name, timestamp, data = event
+            if kind == TRACE_PORTS_LIST:
+                self.ports_lists.append([p for p in data.decode().split("\n") if p])
+            elif kind == TRACE_OPEN:
+                current[port_name] = [event]
+                self.sessions.setdefault(port_name, collections.deque()).append(current[port_name])
+            elif kind == TRACE_CLOSE:
+                current.pop(port_name, None)
+            elif port_name in current:
+                current[port_name].append(event)
+        self.ports = []
+    
+    
+    def openPort(self, port_name, timeout=TIMEOUT):
+        try:
+            events = self.sessions[port_name].popleft()
+        except (KeyError, IndexError):
+            raise serial.SerialException("Replay: no more recorded openings of port %s" % port_name)
+        port = replay_port(port_name, events, time_compression=self.time_compression, timeout=timeout)
+        self.ports.append(port)
+        return port
+    
+    
+    def listPorts(self):
+        """
+        Returns recorded port lists in order. Once they run out, the last one is repeated, 
+        since port polling may happen more often than during recording.
+        """
+        if len(self.ports_lists) > 1:
+            return self.ports_lists.popleft()
+        if self.ports_lists:
+            return self.ports_lists[0]
+        return []
+    
+    
+    def mismatches(self):
+        return sum(port.mismatches for port in self.ports)
+
+
+def startReplay(path, time_compression=1.0):
+    """
+    Makes all serial devices opened from now on talk to the traffic recorded 
+    in the trace file at path, instead of real ports. Device delays are 
+    divided by time_compression.
+    Returns trace_replay object.
+    """
+    global replay
+    replay = trace_replay(path, time_compression=time_compression)
+    logging.info("Serial traffic replay started: %s", path)
+    return replay
+
+
+def stopReplay():
+    global replay
+    replay = None
+
 
 class serial_device():
     """
@@ -33,7 +479,7 @@ class serial_device():
     be it an Arnie robot, or a tool or anything else
     """
     
-    def __init__(self, port_name, welcome_message="", welcome_message_delay=WELCOME_MESSAGE_DELAY, baudrate=BAUDRATE, timeout=TIMEOUT, eol=END_OF_LINE):
+    def __init__(self, port_name, welcome_message="", welcome_message_delay=WELCOME_MESSAGE_DELAY, baudrate=BAUDRATE, timeout=TIMEOUT, eol=END_OF_LINE, device=None):
         
         """
         Initializes a devise to communicate through the serial port
@@ -60,6 +506,9 @@ class serial_device():
             eol
                 character to pass at the end of a line when sending something to the device.
                 Default is '\r'
+            device
+                Already opened serial_device connected to the same port. Its connection 
+                and welcome message are taken over, instead of opening the port again.
         """
         
         
@@ -80,16 +529,34 @@ class serial_device():
         self.baudrate = baudrate
         self.timeout = timeout
         
+        if device is not None:
+            self.attachDevice(device)
+            return
+        
         self.openSerialPort(port_name, baudrate, timeout)
         
         # Reading welcome message from the device connected
         logging.info("Port %s: Welcome message received:", self.port_name)
-        self.actual_welcome_message = self.readAll(delay=welcome_message_delay)
+        self.actual_welcome_message = self.readAll(delay=welcome_message_delay, quiet_gap=WELCOME_QUIET_GAP)
         
         # Cleaning input buffer from some extra messages
-        self.port.flushInput()
+        self.flushInput()
 
     
+    def attachDevice(self, device):
+        """
+        Takes over the opened connection of another serial_device, e.g. the one 
+        created when a tool was docked. The other object is left without connection.
+        """
+        self.port_name = device.port_name
+        self.port = device.port
+        self.reader = device.reader
+        self.actual_welcome_message = device.actual_welcome_message
+        device.port = None
+        device.reader = None
+        logging.info("Port %s: Connection taken over.", self.port_name)
+    
+    
     def openSerialPort(self, port_name="", baudrate=BAUDRATE, timeout=TIMEOUT):
         """
         Opens serial port
@@ -104,18 +571,49 @@ class serial_device():
         # Make sure port is closed
         #self.close()
         # Opening robot instance
-        self.port = serial.Serial(com_port, baudrate, timeout=timeout)
+        if replay is not None:
+            self.port = replay.openPort(com_port, timeout=timeout)
+        else:
+            self.port = serial.Serial(com_port, baudrate, timeout=timeout)
+        recordTraffic(TRACE_OPEN, self.port_name)
         logging.info("Port %s: Opened.", self.port_name)
         logging.info("Port %s: baudrate=%s.", self.port_name, baudrate)
         logging.info("Port %s: timeout=%s.", self.port_name, timeout)
+        self._startReader()
+        
+    
+    def _startReader(self):
+        """
+        Starts background reading of the currently opened port.
+        """
+        self._stopReader()
+        self.reader = port_reader(self.port, port_name=self.port_name)
+        self.reader.start()
+        
+    
+    def _stopReader(self):
+        try:
+            self.reader.stop(timeout=self.timeout * 2)
+        except AttributeError:
+            pass
+        
+        
+    def flushInput(self):
+        """
+        Cleans everything received from the device so far.
+        """
+        self.port.flushInput()
+        self.reader.clear()
         
         
     def close(self):
         """
         Will try to close Arnie port if it is open
         """
+        self._stopReader()
         try:
             self.port.close()
+            recordTraffic(TRACE_CLOSE, self.port_name)
             logging.info("Port %s: Closed successfully", self.port_name)
         except:
             logging.info("Port %s: Attempted to close, unsuccessfully", self.port_name)
@@ -162,15 +660,18 @@ class serial_device():
         
         return matched
     
-    def write(self, expression, eol=None):
+    def write(self, expression, eol=None, flush=True):
         """
         Sending an expression to a device. Expression is in str format.
         Proper end of line will be sent. If eol specified here, it will be sent
         Otherwise the one specified during initialization will be sent.
+        If flush is False, whatever the device sent before is kept; use it when 
+        answers to previously sent commands are still expected.
         """
         # Cleaning input buffer (so the buffer will contain only response of a device 
         # to the command send within this function)
-        self.port.flushInput()
+        if flush:
+            self.flushInput()
         # Strip all EOL characters for consistency
         expression = expression.strip()
         if eol:
@@ -185,27 +686,44 @@ class serial_device():
         logging.info("Port %s: Sending message: ", self.port_name)
         logging.info(expression)
         # Writing to the device (robot or a tool)
+        recordTraffic(TRACE_WRITE, self.port_name, expr_enc)
         self.port.write(expr_enc)
         
-        
-    # TODO: Inline this function so that people don't circumvent logging by using this function. 
-    def _read(self, number_of_bytes=1):
+    
+    def writeBytes(self, data):
         """
-        Same functionality as Serial.read()
+        Sends bytes to the device as they are, without end of line and 
+        without flushing the input. Used for real time commands, such as GRBL "?".
         """
-        return self.port.read(number_of_bytes).decode("utf-8")
-    
-    def readAll(self, delay=READALL_DELAY):
+        recordTraffic(TRACE_WRITE, self.port_name, data)
+        self.port.write(data)
+        
+        
+    def readAll(self, delay=READALL_DELAY, quiet_gap=READALL_QUIET_GAP):
         """
-        Function will wait until everything that the device send is read
+        Function will wait until everything that the device send is read.
+        
+        Inputs:
+            delay
+                Maximum time to wait for the device to start answering, in seconds.
+                Function returns as soon as the answer arrives.
+            quiet_gap
+                After the first line of the answer arrived, function keeps reading
+                until no new lines arrive for that time, in seconds.
+        
+        Returns:
+            Everything received; empty string if the device did not answer.
         """
-        # Give time for device to respond
-        time.sleep(delay)
-        # Wait forever for device to return something
-        message=self._read()
-        # Continue reading until device output buffer is empty
-        while self.port.inWaiting():
-            message += self._read()
+        message = ""
+        try:
+            # Port timeout is added to give the background reader a chance to pass
+            # a line which device did not finish with end of line.
+            message = self.reader.lines.get(timeout=delay + self.timeout)
+            # Continue reading until device stops sending
+            while True:
+                message += self.reader.lines.get(timeout=quiet_gap)
+        except queue.Empty:
+            pass
         
         logging.info("Port %s: Function readAll(): Received message: ", self.port_name)
         logging.info(message)
@@ -224,7 +742,15 @@ class serial_device():
         
         full_message = ""
         while True:
-            message = self.port.readline().decode("utf-8")
+            try:
+                message = self.reader.lines.get(timeout=self.timeout)
+            except queue.Empty:
+                if self.reader.is_alive():
+                    continue
+                logging.error("Port %s: Function readBufferUntilMatch(): port is no longer read.", self.port_name)
+                logging.error("Port %s: Pattern %s did not occur in message: %s", 
+                              self.port_name, pattern, full_message)
+                return full_message
             full_message += message
             if re.search(pattern=pattern, string=full_message):
                 self.recent_message = full_message
@@ -250,37 +776,255 @@ class serial_device():
 
 
 
-def listSerialPorts():
+def listSerialPorts(usb_only=True):
     """ 
-    Lists serial port names
-
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
-        :returns:
-            A list of the serial ports available on the system
-    """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
-
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
+    Lists serial port names.
+    Ports are taken from the system device list (sysfs on Linux), without opening them.
+    
+    Inputs:
+        usb_only
+            If True (default), only USB serial adapters are listed. All Arnie devices 
+            are connected through USB; that excludes built-in serial ports 
+            and terminals.
+    
+    Returns:
+        A list of the serial ports available on the system, plus virtual ports.
+    """
+    if replay is not None:
+        return replay.listPorts()
+    result = [info.device for info in serial.tools.list_ports.comports() 
+              if (not usb_only) or (info.vid is not None)]
+    result = result + virtual_ports
+    recordTraffic(TRACE_PORTS_LIST, "", "\n".join(result).encode())
     return result
+
+
+def usbIdentities():
+    """
+    Returns dictionary matching port name with the USB identity of the device
+    connected to it: "VID:PID:serial number". 
+    Devices without serial number can't be told apart, and are not listed.
+    """
+    if replay is not None:
+        return {}
+    identities = {}
+    for info in serial.tools.list_ports.comports():
+        if info.vid is not None and info.serial_number:
+            identities[info.device] = "%04X:%04X:%s" % (info.vid, info.pid, info.serial_number)
+    return identities
+
+
+def loadPortCache(path=None):
+    """
+    Loads dictionary of welcome messages of known devices, by USB identity.
+    """
+    if path is None:
+        path = PORT_CACHE_FILE
+    try:
+        with open(path, 'r') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logging.error("Serial ports cache %s is damaged; ignoring it.", path)
+        return {}
+
+
+def savePortCache(cache, path=None):
+    if path is None:
+        path = PORT_CACHE_FILE
+    with open(path, 'w') as f:
+        f.write(json.dumps(cache, indent=1))
+
+
+def clearPortCache(path=None):
+    """
+    Forgets all known devices, e.g. after re-flashing a device firmware.
+    """
+    if path is None:
+        path = PORT_CACHE_FILE
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def readWelcomeMessage(port_name):
+    """
+    Opens the port, reads welcome message of the device and closes the port.
+    Returns empty string if the port can't be opened.
+    """
+    try:
+        s = serial_device(port_name)
+    except (OSError, serial.SerialException):
+        logging.error("Port %s: could not be opened to read welcome message.", port_name)
+        return ""
+    message = s.actual_welcome_message
+    s.close()
+    return message
+
+
+def _findPattern(welcome_message, patterns_list):
+    """
+    Returns the pattern from patterns_list found in the welcome message, or None.
+    Same as serial_device.findDeviceInList(), if several patterns match, the last one is taken.
+    """
+    found = None
+    for pattern in patterns_list:
+        if re.search(pattern=pattern, string=welcome_message):
+            found = pattern
+    return found
+
+
+def registerVirtualPort(port_name):
+    """
+    Makes port listed by listSerialPorts(), as if the device was just connected.
+    """
+    with ports_changed:
+        if port_name not in virtual_ports:
+            virtual_ports.append(port_name)
+        ports_changed.notify_all()
+
+
+def unregisterVirtualPort(port_name):
+    """
+    Removes port from listSerialPorts() output, as if the device was disconnected.
+    """
+    with ports_changed:
+        if port_name in virtual_ports:
+            virtual_ports.remove(port_name)
+        ports_changed.notify_all()
+
+
+def _openInotify(path):
+    """
+    Starts watching the path for created, deleted and changed files.
+    Returns inotify file descriptor, or None if not supported by the system.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, path.encode(), INOTIFY_EVENTS) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class port_watcher():
+    """
+    Reports serial ports appearing in the system, e.g. when a tool is docked.
     
+    Ports present when the watcher starts are known; waitForNewPort() returns 
+    the first port appeared after that, as soon as it can be opened.
+    On Linux, device nodes appearing in /dev wake the watcher up immediately. 
+    Otherwise, and for virtual ports, the list of ports is checked every PORT_POLL_INTERVAL.
     
-def matchPortsWithDevices(ports_list, device_matchline_dict):
+    Usage:
+        with port_watcher() as watcher:
+            ... connect the device ...
+            port = watcher.waitForNewPort(timeout=5)
+    """
+    
+    def __init__(self, poll_interval=PORT_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.known_ports = set()
+        self._inotify_fd = None
+        self._thread = None
+        # Pipe waking up the inotify thread when the watcher stops
+        self._wakeup = None
+    
+    
+    def start(self):
+        self.known_ports = set(listSerialPorts())
+        self._inotify_fd = _openInotify(DEVICES_DIR)
+        if self._inotify_fd is not None:
+            self._wakeup = os.pipe()
+            self._thread = threading.Thread(target=self._watchInotify, daemon=True)
+            self._thread.start()
+        else:
+            logging.info("port_watcher: system notifications unavailable, polling ports.")
+        return self
+    
+    
+    def _watchInotify(self):
+        while True:
+            readable, _, _ = select.select([self._inotify_fd, self._wakeup[0]], [], [])
+            if self._wakeup[0] in readable:
+                return
+            try:
+                os.read(self._inotify_fd, 4096)
+            except OSError:
+                pass
+            with ports_changed:
+                ports_changed.notify_all()
+    
+    
+    def stop(self):
+        if self._thread is not None:
+            os.write(self._wakeup[1], b"x")
+            self._thread.join()
+            self._thread = None
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
+    
+    
+    def __enter__(self):
+        return self.start()
+    
+    
+    def __exit__(self, *args):
+        self.stop()
+    
+    
+    def _newPorts(self):
+        new_ports = []
+        for port in listSerialPorts():
+            if port in self.known_ports:
+                continue
+            # udev sets permissions shortly after the node appears
+            if os.path.exists(port) and not os.access(port, os.R_OK | os.W_OK):
+                continue
+            new_ports.append(port)
+        return new_ports
+    
+    
+    def waitForNewPort(self, timeout=None):
+        """
+        Waits until a new serial port appears.
+        
+        Inputs:
+            timeout
+                Maximum waiting time, seconds. None means wait forever.
+        
+        Returns:
+            Name of the new port, or None if nothing appeared in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with ports_changed:
+                new_ports = self._newPorts()
+                if new_ports:
+                    self.known_ports.add(new_ports[0])
+                    logging.info("port_watcher: new port %s", new_ports[0])
+                    return new_ports[0]
+                wait = self.poll_interval
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = min(wait, remaining)
+                ports_changed.wait(wait)
+    
+    
+def matchPortsWithDevices(ports_list, device_matchline_dict, use_cache=True):
     """
     Matches port number with a device name for that port.
     
@@ -291,6 +1035,9 @@ def matchPortsWithDevices(ports_list, device_matchline_dict):
         device_matchline_dict
             Dictionary matching device name with the pattern that occurrs in its welcome message
             Example: {'Arnie': 'Marlin', 'Pipettor_1000': 'Servo', ...}
+        use_cache
+            If True (default), USB devices whose welcome messages were read before
+            (see PORT_CACHE_FILE) are matched without opening their ports.
     
     Returns:
         device_port_dict
@@ -301,25 +1048,40 @@ def matchPortsWithDevices(ports_list, device_matchline_dict):
     patterns_list = list(device_matchline_dict.values())
     device_port_dict = {}
     
+    # Devices seen before are recognized by their USB identity, 
+    # other ports are opened to read welcome messages, all at once.
+    identities = usbIdentities() if use_cache else {}
+    cache = loadPortCache() if identities else {}
+    welcome_messages = {}
+    ports_to_probe = []
     for port in ports_list:
-        s = serial_device(port)
-        # Finds index of a proper pattern, then calls that pattern out of pattern_list
-        # When serial_device is something that is not in patterns_list, 
-        # s.findDeviceInList will return None. Current device is ignored, and 
-        # function continues to the next device.
-        try:    
-            correct_pattern = patterns_list[s.findDeviceInList(patterns_list)]
-        except:
-            logging.error("matchPortsWithDevices(): could not execute finiding device in list.")
-            logging.error("matchPortsWithDevices(): Provided patterns_list: %s", patterns_list)
-            logging.error(s.findDeviceInList(patterns_list))
-            # Assigning blank value, so later correct_pattern won't pass check on expected value.
-            correct_pattern = ""
-            #return
+        cached_message = cache.get(identities.get(port))
+        if cached_message is not None and _findPattern(cached_message, patterns_list) is not None:
+            logging.info("matchPortsWithDevices(): port %s is a known device.", port)
+            welcome_messages[port] = cached_message
+        else:
+            ports_to_probe.append(port)
+    
+    if ports_to_probe:
+        workers = min(PORT_PROBE_WORKERS, len(ports_to_probe))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            messages = list(executor.map(readWelcomeMessage, ports_to_probe))
+        cache_updated = False
+        for port, message in zip(ports_to_probe, messages):
+            welcome_messages[port] = message
+            if message and port in identities:
+                cache[identities[port]] = message
+                cache_updated = True
+        if cache_updated:
+            savePortCache(cache)
+    
+    for port in ports_list:
+        correct_pattern = _findPattern(welcome_messages[port], patterns_list)
+        if correct_pattern is None:
+            logging.info("matchPortsWithDevices(): no device matched on port %s.", port)
+            continue
         for key, value in device_matchline_dict.items():
             if correct_pattern == value:
                 device_port_dict[key] = port
-        # Closing port after matching.
-        s.close()
                 
-    return device_port_dict
\ No newline at end of file
+    return device_port_dict
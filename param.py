@@ -9,9 +9,276 @@ from shutil import copyfile
 import re
 from datetime import datetime
 import logging
+import configparser
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from types import MappingProxyType
+from collections.abc import Mapping
 
 DEFAULT_FLOOR_CALIBR_FILE = "floor.json"
 DEFAULT_TOOL_CALIBR_FILE = "tools.json"
+# Database with saved state of racks and tools, see deck_store
+DEFAULT_DECK_STORE_FILE = "deck.sqlite"
+# Kinds of items kept in the deck store. Tools calibration data (tools.json)
+# are kept under the name of the file they used to be stored in.
+STORE_RACK = "rack"
+STORE_TOOL = "tool"
+# Directory with config files of racks, tools and samples types
+CONFIGS_DIR = "configs"
+
+
+class config_section(Mapping):
+    """
+    Read-only section of config_data. Option names are case-insensitive,
+    as with configparser.
+    """
+    
+    def __init__(self, options, optionxform):
+        self._options = dict(options)
+        self._optionxform = optionxform
+    
+    
+    def __getitem__(self, option):
+        return self._options[self._optionxform(option)]
+    
+    
+    def __contains__(self, option):
+        return isinstance(option, str) and self._optionxform(option) in self._options
+    
+    
+    def __iter__(self):
+        return iter(self._options)
+    
+    
+    def __len__(self):
+        return len(self._options)
+    
+    
+    def __repr__(self):
+        return "config_section(%r)" % self._options
+
+
+class config_data():
+    """
+    Read-only contents of an .ini config file. Shared by all objects of the same type.
+    
+    Sections are accessed same as with configparser: config['geometry']['z_box_height'].
+    Missing section or option raises KeyError. Values are strings; typed values 
+    are returned by getFloat(), getInt() and getStr().
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        parser = configparser.ConfigParser()
+        parser.read(path)
+        self.sections = MappingProxyType({name: config_section(parser[name], parser.optionxform) 
+                                          for name in parser.sections()})
+    
+    
+    def __getitem__(self, section):
+        return self.sections[section]
+    
+    
+    def __contains__(self, section):
+        return section in self.sections
+    
+    
+    def _get(self, convert, section, option, default):
+        try:
+            return convert(self.sections[section][option])
+        except KeyError:
+            if default is None:
+                raise
+            return default
+    
+    
+    def getFloat(self, section, option, default=None):
+        return self._get(float, section, option, default)
+    
+    
+    def getInt(self, section, option, default=None):
+        return self._get(int, section, option, default)
+    
+    
+    def getStr(self, section, option, default=None):
+        return self._get(str, section, option, default)
+
+
+def freezeData(data):
+    """
+    Returns read-only copy of the data loaded from JSON: dictionaries become 
+    read-only mappings, lists become tuples.
+    """
+    if isinstance(data, dict):
+        return MappingProxyType({key: freezeData(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return tuple(freezeData(value) for value in data)
+    return data
+
+
+class config_registry():
+    """
+    Parsed config files of racks, tools and samples types, read once per process.
+    All objects of the same type share the same config object.
+    
+    Inputs:
+        directory
+            Directory with config files.
+        check_modified
+            If True, files are checked for modification at every request, 
+            and read again if modified. Useful while adjusting configs.
+    """
+    
+    def __init__(self, directory=CONFIGS_DIR, check_modified=False):
+        self.directory = directory
+        self.check_modified = check_modified
+        # {path: (file modification time, parsed contents)}
+        self._cache = {}
+    
+    
+    def _fileStamp(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    
+    def _get(self, path, loader):
+        cached = self._cache.get(path)
+        if cached is not None:
+            if not self.check_modified or cached[0] == self._fileStamp(path):
+                return cached[1]
+        stamp = self._fileStamp(path)
+        value = loader(path)
+        self._cache[path] = (stamp, value)
+        return value
+    
+    
+    def getConfig(self, config_type):
+        """
+        Returns config_data of configs/<config_type>.ini
+        """
+        return self._get(os.path.join(self.directory, config_type + '.ini'), config_data)
+    
+    
+    def getParams(self, file_name):
+        """
+        Returns read-only contents of JSON file in configs directory.
+        """
+        return self._get(os.path.join(self.directory, file_name), self._loadParams)
+    
+    
+    def _loadParams(self, path):
+        with open(path, 'r') as f:
+            return freezeData(json.loads(f.read()))
+    
+    
+    def clear(self):
+        self._cache = {}
+
+
+# Configs of the current process
+configs = config_registry()
+
+
+def getConfig(config_type):
+    """
+    Returns shared read-only config of a rack, tool or sample type; see config_data.
+    """
+    return configs.getConfig(config_type)
+
+
+def getParams(file_name):
+    """
+    Returns shared read-only contents of JSON parameters file from configs directory.
+    """
+    return configs.getParams(file_name)
+
+
+class floor_model():
+    """
+    Floor calibration data, read from the file once and kept in memory.
+    Slot centers and Z coordinates are calculated at loading, so a slot 
+    lookup only checks whether the file was modified since.
+    
+    Use getFloor() to obtain the model shared by all modules.
+    """
+    
+    def __init__(self, path=DEFAULT_FLOOR_CALIBR_FILE):
+        self.path = path
+        # Raw slots data, as stored in the file; slots[n_x][n_y]
+        self.slots = None
+        # [x, y, z] of every slot center; centers[n_x][n_y]
+        self.centers = None
+        # File modification time and size the data were loaded with
+        self._file_stamp = None
+    
+    
+    def _fileStamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+    
+    
+    def load(self):
+        """
+        Reads the file. Called automatically when the file changes.
+        """
+        self._file_stamp = self._fileStamp()
+        floor_data = loadData(self.path)
+        if floor_data is None:
+            logging.error("floor_model: floor calibration file %s not found.", self.path)
+            self.slots = None
+            self.centers = None
+            return
+        self.slots = floor_data['slots']
+        self.centers = [[calcSlotCenter(slot) for slot in column] for column in self.slots]
+    
+    
+    def refresh(self):
+        """
+        Reloads the data if the file was modified since loading.
+        """
+        if self.slots is None or self._fileStamp() != self._file_stamp:
+            self.load()
+    
+    
+    def getSlot(self, n_x, n_y):
+        """
+        Returns calibration data of the slot, see getSlotCalibrationData()
+        """
+        self.refresh()
+        if self.slots is None:
+            return None
+        return self.slots[n_x][n_y]
+    
+    
+    def getSlotCenter(self, n_x, n_y):
+        """
+        Returns [x, y, z] of the slot center, z being the slot floor.
+        """
+        self.refresh()
+        if self.centers is None:
+            return None
+        return self.centers[n_x][n_y]
+
+
+# Floor models by file path, shared by all modules
+floors = {}
+
+
+def getFloor(floor_calibr_file=DEFAULT_FLOOR_CALIBR_FILE):
+    """
+    Returns floor_model for the given file, loading it at first request.
+    """
+    if floor_calibr_file not in floors:
+        floors[floor_calibr_file] = floor_model(floor_calibr_file)
+    return floors[floor_calibr_file]
+
 
 def getSlotCalibrationData(n_x, n_y, 
                   slots_data=None, 
@@ -45,10 +312,8 @@ def getSlotCalibrationData(n_x, n_y,
     """
     
     if slots_data is None:
-        # Opening data from default storage
-        # If file does not exist, function exits
-        floor_data = loadData(floor_calibr_file)
-        slots_data = floor_data['slots']
+        # Using data from default storage, kept in memory
+        return getFloor(floor_calibr_file).getSlot(n_x, n_y)
     
     return slots_data[n_x][n_y]
     
@@ -80,6 +345,177 @@ def loadData(path):
     filehandler.close()
     return result
 
+
+class deck_store():
+    """
+    SQLite database with saved state of racks and tools, replacing a JSON file per item.
+    
+    Every item is identified by its kind (STORE_RACK, STORE_TOOL, ...) and name, and
+    indexed by type and slot. Saving an item replaces its current data and adds
+    a record to the history, instead of rewriting the whole file and keeping backups.
+    Several saves may be grouped into one transaction with batch().
+    
+    Use getDeckStore() to obtain the store shared by all modules.
+    """
+    
+    def __init__(self, path=DEFAULT_DECK_STORE_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        # Depth of nested batch() blocks
+        self.batch_level = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                kind TEXT NOT NULL, name TEXT NOT NULL, type TEXT, 
+                n_x INTEGER, n_y INTEGER, data TEXT NOT NULL, modified REAL NOT NULL,
+                PRIMARY KEY (kind, name));
+            CREATE INDEX IF NOT EXISTS items_type ON items (kind, type);
+            CREATE INDEX IF NOT EXISTS items_slot ON items (n_x, n_y);
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                kind TEXT NOT NULL, name TEXT NOT NULL, data TEXT, modified REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS history_item ON history (kind, name);
+            """)
+    
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
+    
+    
+    @contextmanager
+    def batch(self):
+        """
+        Groups several saves into one transaction:
+            with store.batch():
+                rack_1.save()
+                rack_2.save()
+        Nothing is saved if an exception is raised inside the block.
+        """
+        with self.lock:
+            if self.batch_level == 0:
+                self.connection.execute("BEGIN")
+            self.batch_level += 1
+            try:
+                yield self
+            except:
+                self.batch_level -= 1
+                if self.batch_level == 0:
+                    self.connection.execute("ROLLBACK")
+                raise
+            self.batch_level -= 1
+            if self.batch_level == 0:
+                self.connection.execute("COMMIT")
+    
+    
+    def save(self, kind, name, data):
+        """
+        Saves data (dictionary) of the item, keeping the previous data in history.
+        """
+        text = json.dumps(data)
+        item_type = data.get('type')
+        n_x = data.get('n_x')
+        n_y = data.get('n_y')
+        now = time.time()
+        with self.batch():
+            self.connection.execute(
+                "INSERT INTO items (kind, name, type, n_x, n_y, data, modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (kind, name) DO UPDATE SET type = excluded.type, n_x = excluded.n_x, "
+                "n_y = excluded.n_y, data = excluded.data, modified = excluded.modified",
+                (kind, name, item_type, n_x, n_y, text, now))
+            self.connection.execute(
+                "INSERT INTO history (kind, name, data, modified) VALUES (?, ?, ?, ?)",
+                (kind, name, text, now))
+    
+    
+    def delete(self, kind, name):
+        with self.batch():
+            self.connection.execute("DELETE FROM items WHERE kind = ? AND name = ?", (kind, name))
+            self.connection.execute(
+                "INSERT INTO history (kind, name, data, modified) VALUES (?, ?, NULL, ?)",
+                (kind, name, time.time()))
+    
+    
+    def load(self, kind, name):
+        """
+        Returns saved data of the item, or None if the item was never saved.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM items WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+    
+    
+    def find(self, kind=None, item_type=None, slot=None):
+        """
+        Returns list of saved data of the items with given kind, type and slot (n_x, n_y), 
+        in the order they were first saved. Criteria that are not provided are not checked.
+        """
+        conditions = []
+        values = []
+        if kind is not None:
+            conditions.append("kind = ?")
+            values.append(kind)
+        if item_type is not None:
+            conditions.append("type = ?")
+            values.append(item_type)
+        if slot is not None:
+            conditions.append("n_x = ? AND n_y = ?")
+            values += [slot[0], slot[1]]
+        query = "SELECT data FROM items"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            rows = self.connection.execute(query + " ORDER BY rowid", values).fetchall()
+        return [json.loads(row[0]) for row in rows]
+    
+    
+    def history(self, kind, name, limit=None):
+        """
+        Returns list of (time, data) of the previous saves of the item, newest first.
+        Data are None where the item was deleted. Time is as returned by time.time().
+        """
+        query = "SELECT modified, data FROM history WHERE kind = ? AND name = ? ORDER BY id DESC"
+        values = [kind, name]
+        if limit is not None:
+            query += " LIMIT ?"
+            values.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, values).fetchall()
+        return [(modified, None if data is None else json.loads(data)) for modified, data in rows]
+
+
+# Deck stores by file path, shared by all modules
+deck_stores = {}
+
+
+def getDeckStore(path=None):
+    """
+    Returns deck_store for the given file (DEFAULT_DECK_STORE_FILE if not provided), 
+    opening it at first request.
+    """
+    if path is None:
+        path = DEFAULT_DECK_STORE_FILE
+    if path not in deck_stores:
+        deck_stores[path] = deck_store(path)
+    return deck_stores[path]
+
+
+def loadItem(kind, name, legacy_path=None):
+    """
+    Returns saved data of the item from the deck store. 
+    Items saved before the deck store was introduced are read from their JSON file.
+    """
+    data = getDeckStore().load(kind, name)
+    if data is None and legacy_path is not None:
+        data = loadData(legacy_path)
+    return data
+
     
 def calcSquareSlotCenterFromVertices(n_x, n_y, 
                                    slots_data=None, 
@@ -95,9 +531,8 @@ def calcSquareSlotCenterFromVertices(n_x, n_y,
     'floor_z': 604.1,
     'RB': [316.36, 122.35]}
     """
-    slot = getSlotCalibrationData(n_x, n_y, 
-                                  slots_data=slots_data, floor_calibr_file=floor_calibr_file)
-    return [(slot['LT'][0] + slot['RB'][0]) / 2, (slot['LT'][1] + slot['RB'][1]) / 2]
+    x, y, z = getSlotCenter(n_x, n_y, slots_data=slots_data, floor_calibr_file=floor_calibr_file)
+    return [x, y]
     
 
 def getSlotZ(n_x, n_y, 
@@ -114,19 +549,195 @@ def getSlotZ(n_x, n_y,
     'floor_z': 604.1,
     'RB': [316.36, 122.35]}
     """    
-    slot = getSlotCalibrationData(n_x, n_y, 
-                                  slots_data=slots_data, floor_calibr_file=floor_calibr_file)
+    if slots_data is None:
+        return getFloor(floor_calibr_file).getSlotCenter(n_x, n_y)[2]
+    slot = getSlotCalibrationData(n_x, n_y, slots_data=slots_data)
     return slot['floor_z']
 
 
+def getSlotCenter(n_x, n_y, 
+                  slots_data=None, 
+                  floor_calibr_file=DEFAULT_FLOOR_CALIBR_FILE):
+    """
+    Returns [x, y, z] of the slot center: X and Y from the slot vertices, 
+    Z of the slot floor. Same as calcSquareSlotCenterFromVertices() and getSlotZ() together.
+    """
+    if slots_data is None:
+        return getFloor(floor_calibr_file).getSlotCenter(n_x, n_y)
+    slot = getSlotCalibrationData(n_x, n_y, slots_data=slots_data)
+    return calcSlotCenter(slot)
+
+
+def calcSlotCenter(slot):
+    """
+    Returns [x, y, z] of the slot center from slot calibration data 
+    (see calcSquareSlotCenterFromVertices()).
+    """
+    return [(slot['LT'][0] + slot['RB'][0]) / 2, 
+            (slot['LT'][1] + slot['RB'][1]) / 2, 
+            slot['floor_z']]
+
+
 # Functions handling communications with tools
 # ------------------------------------------------------------------------------------------------
     
+def loadToolsData(tool_file=DEFAULT_TOOL_CALIBR_FILE):
+    """
+    Returns list of tools calibration data (docking position, endpoint, slot).
+    Data are kept in the deck store under the kind tool_file; if there are none,
+    they are read from tool_file itself, as saved before the deck store was introduced.
+    """
+    data = getDeckStore().find(kind=tool_file)
+    if not data:
+        data = loadData(tool_file)
+    if data is None:
+        return []
+    return data
+
+
+def saveToolsData(data, tool_file=DEFAULT_TOOL_CALIBR_FILE):
+    """
+    Saves list of tools calibration data into the deck store. 
+    Only the tools which data changed are written, in one transaction.
+    """
+    getToolRegistry(tool_file).saveAll(data)
+
+
+def toolKey(tool):
+    """
+    Returns the name under which the tool data are kept in the deck store: 
+    the tool name (type), or the slot (n_x, n_y) for the tools without one.
+    """
+    if tool.get('type') is not None:
+        return tool['type']
+    if 'n_x' in tool and 'n_y' in tool:
+        return "slot %s, %s" % (tool['n_x'], tool['n_y'])
+    raise ValueError("Tool data have neither type nor slot: %s" % tool)
+
+
+class tool_registry():
+    """
+    Tools calibration data (docking position, endpoint, slot), loaded once and 
+    indexed by tool name (type) and by slot (n_x, n_y).
+    Saving a tool through the registry updates both the indexes and the deck store.
+    
+    Use getToolRegistry() to obtain the registry shared by all modules.
+    """
+    
+    def __init__(self, tool_file=DEFAULT_TOOL_CALIBR_FILE, store=None):
+        self.tool_file = tool_file
+        if store is None:
+            store = getDeckStore()
+        self.store = store
+        self.tools = []
+        self.by_name = {}
+        self.by_slot = {}
+        # Data as written in the store, by toolKey()
+        self.saved = {}
+        self.load()
+    
+    
+    def load(self):
+        data = self.store.find(kind=self.tool_file)
+        self.saved = {toolKey(tool): json.dumps(tool, sort_keys=True) for tool in data}
+        if not data:
+            # Saved before the deck store was introduced
+            data = loadData(self.tool_file) or []
+        self.tools = data
+        self._index()
+    
+    
+    def _index(self):
+        # If several tools have the same name or slot, the first one is used
+        self.by_name = {}
+        self.by_slot = {}
+        for tool in self.tools:
+            if 'type' in tool:
+                self.by_name.setdefault(tool['type'], tool)
+            if 'n_x' in tool and 'n_y' in tool:
+                self.by_slot.setdefault((tool['n_x'], tool['n_y']), tool)
+    
+    
+    def getByName(self, name):
+        return self.by_name.get(name)
+    
+    
+    def getBySlot(self, x, y):
+        return self.by_slot.get((x, y))
+    
+    
+    def find(self, toolname=None, slot=None):
+        """
+        Returns data of the tool with given name, or placed in given slot (n_x, n_y).
+        None if there is no such tool.
+        """
+        if toolname is not None:
+            return self.getByName(toolname)
+        if slot is not None:
+            return self.getBySlot(slot[0], slot[1])
+        return None
+    
+    
+    def save(self, new_tool_data, toolname=None, slot=None):
+        """
+        Replaces data of the tool found by name or slot, or adds a new tool.
+        """
+        tools = list(self.tools)
+        tool_data = self.find(toolname, slot)
+        if tool_data is not None:
+            logging.debug("tool_registry: replacing saved data: %s", tool_data)
+            index = next(i for i, tool in enumerate(tools) if tool is tool_data)
+            tools[index] = new_tool_data
+        else:
+            logging.debug("tool_registry: adding the tool.")
+            tools.append(new_tool_data)
+        self.saveAll(tools)
+    
+    
+    def saveAll(self, data):
+        """
+        Replaces all the tools with data (list of tools data). Only the tools 
+        which data changed since the last load or save are written to the store.
+        Raises ValueError, saving nothing, if two tools have the same toolKey().
+        """
+        texts = {}
+        for tool in data:
+            name = toolKey(tool)
+            if name in texts:
+                raise ValueError("Tool %s is listed twice in %s" % (name, self.tool_file))
+            texts[name] = json.dumps(tool, sort_keys=True)
+        with self.store.batch():
+            for name in self.saved.keys() - texts.keys():
+                self.store.delete(self.tool_file, name)
+            for tool in data:
+                name = toolKey(tool)
+                if self.saved.get(name) != texts[name]:
+                    self.store.save(self.tool_file, name, tool)
+        self.saved = texts
+        self.tools = list(data)
+        self._index()
+
+
+# Tool registries by tool file, shared by all modules
+tool_registries = {}
+
+
+def getToolRegistry(tool_file=DEFAULT_TOOL_CALIBR_FILE):
+    """
+    Returns tool_registry for the given tools file, loading it at first request.
+    """
+    registry = tool_registries.get(tool_file)
+    if registry is None or registry.store is not getDeckStore():
+        registry = tool_registry(tool_file)
+        tool_registries[tool_file] = registry
+    return registry
+
+
 def getToolByName(name, data=None, tool_file=DEFAULT_TOOL_CALIBR_FILE):
 
     # If custom data are not provided, use those from standard file
     if data is None:
-        data = loadData(tool_file)
+        return getToolRegistry(tool_file).getByName(name)
     
     for tool in data:
         try:
@@ -141,7 +752,7 @@ def getToolBySlot(x, y, data=None, tool_file=DEFAULT_TOOL_CALIBR_FILE):
     
     # If custom data are not provided, use those from standard file
     if data is None:
-        data = loadData(tool_file)
+        return getToolRegistry(tool_file).getBySlot(x, y)
 
     for tool in data:
         try:
@@ -153,24 +764,22 @@ def getToolBySlot(x, y, data=None, tool_file=DEFAULT_TOOL_CALIBR_FILE):
         except:
             pass
 
+
+def _findTool(toolname, slot, data, tool_file):
+    if toolname is not None:
+        return getToolByName(toolname, data, tool_file)
+    elif slot is not None:
+        return getToolBySlot(slot[0], slot[1], data, tool_file)
+
     
 def getToolDockingPoint(toolname=None, slot=None, data=None, tool_file=DEFAULT_TOOL_CALIBR_FILE):
     """
     Will try to load docking coordinates saved in the file; 
     if not successful, will try to calculate from provided data.
     """
-    
-    # If custom data are not provided, use those from standard file
-    if data is None:
-        data = loadData(tool_file)
-
-    if toolname is not None:
-        tool_data = getToolByName(toolname, data)
-    elif slot is not None:
-        tool_data = getToolBySlot(slot[0], slot[1], data)
-    else:
+    if toolname is None and slot is None:
         return
-    
+    tool_data = _findTool(toolname, slot, data, tool_file)
     return tool_data['position']
     
 
@@ -181,14 +790,10 @@ def saveTool(new_tool_data, toolname=None, slot=None, data=None, tool_file=DEFAU
     logging.debug("Called param.saveTool")
     # If custom data are not provided, use those from standard file
     if data is None:
-        data = loadData(tool_file)
+        getToolRegistry(tool_file).save(new_tool_data, toolname, slot)
+        return
         
-    if toolname is not None:
-        tool_data = getToolByName(toolname, data)
-    elif slot is not None:
-        tool_data = getToolBySlot(slot[0], slot[1], data)
-    else:
-        tool_data = None
+    tool_data = _findTool(toolname, slot, data, tool_file)
     
     if tool_data is not None:
         logging.debug("saveTool: found data in file: %s", tool_data)
@@ -199,7 +804,7 @@ def saveTool(new_tool_data, toolname=None, slot=None, data=None, tool_file=DEFAU
         data.append(new_tool_data)
         
     
-    replaceFile(tool_file, data)
+    saveToolsData(data, tool_file)
     
 # Functions to handle tool endpoints
 # --------------------------------------------------------------------------------------------
@@ -209,18 +814,9 @@ def getToolEndPoint(toolname=None, slot=None, data=None, tool_file=DEFAULT_TOOL_
     Obtain coordinates of interactions between tool endpoint and 
     stationary probe "stalagmite"
     """
-    
-    # If custom data are not provided, use those from standard file
-    if data is None:
-        data = loadData(tool_file)
-        
-    if toolname is not None:
-        tool_data = getToolByName(toolname, data)
-    elif slot is not None:
-        tool_data = getToolBySlot(slot[0], slot[1], data)
-    else:
+    if toolname is None and slot is None:
         return
-        
+    tool_data = _findTool(toolname, slot, data, tool_file)
     return tool_data['tip']
     
 
@@ -229,17 +825,14 @@ def saveToolEndPoint(x, y, z,
     """
     Save coordinates at which tool endpoint and stationary probe interact.
     """
-    
-    # If custom data are not provided, use those from standard file
+    if toolname is None and slot is None:
+        return
+    tool_data = _findTool(toolname, slot, data, tool_file)
     if data is None:
-        data = loadData(tool_file)
-        
-    if toolname is not None:
-        tool_data = getToolByName(toolname, data)
-    elif slot is not None:
-        tool_data = getToolBySlot(slot[0], slot[1], data)
-    else:
+        new_tool_data = dict(tool_data)
+        new_tool_data['tip'] = [x, y, z]
+        getToolRegistry(tool_file).save(new_tool_data, toolname, slot)
         return
         
     tool_data['tip'] = [x, y, z]
-    replaceFile(tool_file, data)
\ No newline at end of file
+    saveToolsData(data, tool_file)
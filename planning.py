@@ -0,0 +1,436 @@
+"""
+Planning of gantry travel.
+
+distributeLiquid() visits destinations in the given order, returning to the
+origin sample to refill the tip every time the next destination needs more
+liquid than the tip holds. planDistribution() finds visiting order with shorter
+travel: nearest neighbour route is improved by 2-opt, split into refill trips,
+and every trip is improved by 2-opt again. Trips follow the same refill rule as
+distributeLiquid(), so the predicted travel is what the gantry will do.
+
+planRefills() also chooses which destinations are dispensed from one uptake,
+so that mixed volumes need fewer refills; distributeLiquid() executes such plan
+when it is given as refill_plan.
+"""
+
+import numpy as np
+
+
+def distanceMatrix(points):
+    """
+    Returns matrix of euclidean distances between all the points of shape (n, 2).
+    """
+    points = np.asarray(points, dtype=float)
+    return np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=-1))
+
+
+def nearestNeighbourOrder(distances, start, nodes):
+    """
+    Orders nodes, so that every next one is the closest to the previous;
+    the first one is the closest to start.
+
+    Inputs:
+        distances
+            Matrix of distances between the points
+        start
+            Index of the starting point
+        nodes
+            Indices of the points to visit
+    """
+    remaining = list(nodes)
+    order = []
+    current = start
+    while remaining:
+        k = int(np.argmin(distances[current, remaining]))
+        current = remaining.pop(k)
+        order.append(current)
+    return order
+
+
+def twoOpt(order, distances, start, end=None, max_passes=100):
+    """
+    Improves visiting order by 2-opt moves: a part of the route is reversed
+    while it makes the route shorter.
+
+    Inputs:
+        order
+            Indices of the points to visit
+        distances
+            Matrix of distances between the points
+        start
+            Index of the point the route starts from; not moved.
+        end
+            Index of the point the route ends at; if None, the route ends
+            at whichever point of order is the last.
+        max_passes
+            Maximum number of passes over the route.
+
+    Returns:
+        Reordered list of indices
+    """
+    route = np.array([start] + list(order) + ([] if end is None else [end]))
+    n = len(route)
+    # Positions route[1:last] may be moved
+    last = n if end is None else n - 1
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, last - 1):
+            j = np.arange(i + 1, last)
+            a, b, c = route[i - 1], route[i], route[j]
+            # Reversing route[i:j+1] replaces edges a-b and c-d with a-c and b-d
+            gain = distances[a, b] - distances[a, c]
+            has_next = j + 1 < n
+            d = route[np.minimum(j + 1, n - 1)]
+            gain = gain + np.where(has_next, distances[c, d] - distances[b, d], 0)
+            k = int(np.argmax(gain))
+            if gain[k] > 1e-9:
+                route[i:j[k] + 1] = route[i:j[k] + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return [int(node) for node in route[1:last]]
+
+
+def refillGroups(volumes, max_volume):
+    """
+    Splits destinations into trips between refills of the tip, as distributeLiquid() does:
+    the tip is refilled with the remaining volume, up to max_volume, when it holds
+    less than the next destination needs.
+
+    Inputs:
+        volumes
+            Volumes to dispense, in the order of visiting
+        max_volume
+            Maximum volume the tip holds
+
+    Returns:
+        List of trips, every trip is a list of positions in volumes.
+    """
+    groups = []
+    vol_in_tip = 0
+    remaining_vol = sum(volumes)
+    for position, volume in enumerate(volumes):
+        if volume > max_volume:
+            raise ValueError("refillGroups: volume %s does not fit into the tip of %s." % (volume, max_volume))
+        if vol_in_tip < volume:
+            vol_in_tip = min(remaining_vol, max_volume)
+            groups.append([])
+        groups[-1].append(position)
+        vol_in_tip -= volume
+        remaining_vol -= volume
+    return groups
+
+
+class distribution_plan():
+    """
+    Order of visiting destinations for distributeLiquid(), with the predicted travel.
+
+    Attributes:
+        order
+            Indices of the destinations, in order of visiting
+        groups
+            Trips between refills; lists of indices of the destinations
+        length
+            Predicted XY travel of the gantry from the first arrival to the origin, mm
+        original_length
+            The same for the destinations visited in the given order
+    """
+
+    def __init__(self, order, groups, length, original_length):
+        self.order = order
+        self.groups = groups
+        self.length = length
+        self.original_length = original_length
+
+
+    @property
+    def savings(self):
+        """
+        Travel saved compared with the given order, mm.
+        """
+        return self.original_length - self.length
+
+
+def _routeLength(distances, origin, order, volumes, max_volume):
+    groups = [[order[k] for k in group] for group in refillGroups([volumes[i] for i in order], max_volume)]
+    length = 0
+    for n, group in enumerate(groups):
+        route = [origin] + group
+        if n < len(groups) - 1:
+            route.append(origin)
+        length += distances[route[:-1], route[1:]].sum()
+    return float(length), groups
+
+
+def planDistribution(origin, points, volumes, max_volume, max_passes=100):
+    """
+    Finds order of visiting the destinations with shorter gantry travel.
+
+    Inputs:
+        origin
+            x, y of the sample liquid is taken from
+        points
+            x, y of the destinations, array-like of shape (n, 2)
+        volumes
+            Volume to dispense into every destination
+        max_volume
+            Maximum volume the tip holds
+        max_passes
+            Maximum number of 2-opt passes over every route
+
+    Returns:
+        distribution_plan; keeps the given order if no shorter route is found.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    volumes = list(volumes)
+    if len(volumes) != len(points):
+        raise ValueError("planDistribution: %s volumes for %s destinations." % (len(volumes), len(points)))
+    n = len(points)
+    # Origin is the last point
+    distances = distanceMatrix(np.vstack([points, [origin]]))
+    original_order = list(range(n))
+    original_length, original_groups = _routeLength(distances, n, original_order, volumes, max_volume)
+
+    order = nearestNeighbourOrder(distances, n, original_order)
+    order = twoOpt(order, distances, n, max_passes=max_passes)
+    groups = [[order[k] for k in group] for group in refillGroups([volumes[i] for i in order], max_volume)]
+    order = []
+    for k, group in enumerate(groups):
+        end = n if k < len(groups) - 1 else None
+        order += twoOpt(group, distances, n, end=end, max_passes=max_passes)
+    # Reordering inside a trip may move refills; the length is calculated for the actual trips
+    length, groups = _routeLength(distances, n, order, volumes, max_volume)
+
+    if length >= original_length:
+        return distribution_plan(original_order, original_groups, original_length, original_length)
+    return distribution_plan(order, groups, length, original_length)
+
+
+# Rough durations of the distributeLiquid() steps, used to estimate the plan duration, s.
+# Refill: approach to the origin, blow-out, touching the wall, uptake and slack compensation.
+REFILL_DURATION = 20.0
+# Lowering the tip into a destination, dispensing and raising the tip
+DISPENSE_DURATION = 4.0
+# Gantry XY travel speed, mm/s (cartesian.SPEED_X is in mm/min)
+TRAVEL_SPEED = 8000 / 60.0
+
+
+def splitRoute(order, volumes, capacity, distances, origin, refill_cost):
+    """
+    Splits visiting order into trips, consecutive parts of order, which fit capacity.
+    The split minimizes the travel plus refill_cost for every trip; trips but the last 
+    one return to the origin.
+
+    Inputs:
+        order
+            Indices of the destinations, in order of visiting
+        volumes
+            Volume of every destination
+        capacity
+            Maximum volume of a trip
+        distances
+            Matrix of distances between the points
+        origin
+            Index of the origin point
+        refill_cost
+            Cost of a refill, in the units of distance
+
+    Returns:
+        List of trips, every trip is a list of indices of the destinations.
+    """
+    n = len(order)
+    if n == 0:
+        return []
+    # best[k] - cost of the trips over order[:k], returning to the origin
+    best = [0.0] + [np.inf] * n
+    previous = [0] * (n + 1)
+    final_cost, final_start = np.inf, 0
+    for i in range(n):
+        if best[i] == np.inf:
+            continue
+        load = 0
+        travel = 0
+        for j in range(i, n):
+            load += volumes[order[j]]
+            if load > capacity + 1e-9:
+                break
+            if j == i:
+                travel = distances[origin, order[j]]
+            else:
+                travel += distances[order[j - 1], order[j]]
+            cost = best[i] + refill_cost + travel
+            closed_cost = cost + distances[order[j], origin]
+            if closed_cost < best[j + 1]:
+                best[j + 1] = closed_cost
+                previous[j + 1] = i
+            if j == n - 1 and cost < final_cost:
+                final_cost, final_start = cost, i
+    trips = [list(order[final_start:])]
+    k = final_start
+    while k > 0:
+        trips.append(list(order[previous[k]:k]))
+        k = previous[k]
+    return trips[::-1]
+
+
+def _relocate(trips, volumes, capacity, distances, origin, refill_cost, max_passes):
+    """
+    Moves destinations into other trips while it saves travel or refills.
+    Trips are treated as returning to the origin.
+    """
+    trips = [list(trip) for trip in trips]
+    loads = [sum(volumes[i] for i in trip) for trip in trips]
+    for _ in range(max_passes):
+        improved = False
+        for t in range(len(trips)):
+            for x in list(trips[t]):
+                trip = trips[t]
+                pos = trip.index(x)
+                before = trip[pos - 1] if pos > 0 else origin
+                after = trip[pos + 1] if pos < len(trip) - 1 else origin
+                gain = distances[before, x] + distances[x, after] - distances[before, after]
+                if len(trip) == 1:
+                    gain += refill_cost
+                best_cost, best_trip, best_pos = gain - 1e-9, None, None
+                for u, other in enumerate(trips):
+                    if u == t or not other or loads[u] + volumes[x] > capacity + 1e-9:
+                        continue
+                    route = np.array([origin] + other + [origin])
+                    costs = distances[route[:-1], x] + distances[x, route[1:]] - distances[route[:-1], route[1:]]
+                    k = int(np.argmin(costs))
+                    if costs[k] < best_cost:
+                        best_cost, best_trip, best_pos = costs[k], u, k
+                if best_trip is None:
+                    continue
+                trip.remove(x)
+                trips[best_trip].insert(best_pos, x)
+                loads[t] -= volumes[x]
+                loads[best_trip] += volumes[x]
+                improved = True
+        if not improved:
+            break
+    return [trip for trip in trips if trip]
+
+
+def _tripsTravel(distances, origin, trips):
+    travel = 0
+    for n, trip in enumerate(trips):
+        route = [origin] + list(trip)
+        if n < len(trips) - 1:
+            route.append(origin)
+        travel += distances[route[:-1], route[1:]].sum()
+    return float(travel)
+
+
+class refill_plan():
+    """
+    Destinations of distributeLiquid() split into batches, each dispensed from one uptake.
+
+    Attributes:
+        batches
+            Lists of indices of the destinations, in order of execution
+        batch_volumes
+            Volume to uptake for every batch, without slack compensation
+        travel
+            Predicted XY travel of the gantry, mm
+        duration
+            Estimated duration, s
+        original_refills, original_travel, original_duration
+            The same for the destinations dispensed in the given order,
+            refilling when the tip does not hold enough for the next one.
+    """
+
+    def __init__(self, batches, volumes, travel, original_batches, original_travel):
+        self.batches = batches
+        self.batch_volumes = [sum(volumes[i] for i in batch) for batch in batches]
+        self.travel = travel
+        self.duration = self.estimateDuration(len(batches), len(volumes), travel)
+        self.original_refills = len(original_batches)
+        self.original_travel = original_travel
+        self.original_duration = self.estimateDuration(len(original_batches), len(volumes), original_travel)
+
+
+    @staticmethod
+    def estimateDuration(refills, dispenses, travel):
+        return refills * REFILL_DURATION + dispenses * DISPENSE_DURATION + travel / TRAVEL_SPEED
+
+
+    @property
+    def refills(self):
+        return len(self.batches)
+
+
+    def report(self):
+        """
+        Returns text description of the plan.
+        """
+        lines = []
+        for n, (batch, volume) in enumerate(zip(self.batches, self.batch_volumes)):
+            lines.append("%3d: %8.1f uL to %s" % (n + 1, volume, ', '.join(str(i) for i in batch)))
+        lines.append("Refills: %d, travel: %.0f mm, estimated duration: %.0f s" % 
+                     (self.refills, self.travel, self.duration))
+        lines.append("In the given order: refills: %d, travel: %.0f mm, estimated duration: %.0f s" %
+                     (self.original_refills, self.original_travel, self.original_duration))
+        return '\n'.join(lines)
+
+
+def planRefills(origin, points, volumes, capacity, original_capacity=None, max_passes=100):
+    """
+    Splits destinations into batches dispensed from one uptake each, minimizing
+    estimated duration: refills and travel together.
+
+    Destinations are ordered into a route (see planDistribution()), the route is split 
+    into batches optimally, destinations are moved between batches while it saves
+    a refill or travel, and every batch is ordered by 2-opt.
+
+    Inputs:
+        origin
+            x, y of the sample liquid is taken from
+        points
+            x, y of the destinations, array-like of shape (n, 2)
+        volumes
+            Volume to dispense into every destination
+        capacity
+            Maximum volume of a batch
+        original_capacity
+            Volume the tip is refilled with, when dispensing in the given order;
+            used for comparison only. Default is capacity.
+        max_passes
+            Maximum number of passes of the route improvements
+
+    Returns:
+        refill_plan
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    volumes = list(volumes)
+    if len(volumes) != len(points):
+        raise ValueError("planRefills: %s volumes for %s destinations." % (len(volumes), len(points)))
+    for volume in volumes:
+        if volume > capacity:
+            raise ValueError("planRefills: volume %s does not fit into the tip of %s." % (volume, capacity))
+    if original_capacity is None:
+        original_capacity = capacity
+    n = len(points)
+    # Origin is the last point
+    distances = distanceMatrix(np.vstack([points, [origin]]))
+    refill_cost = REFILL_DURATION * TRAVEL_SPEED
+
+    original_batches = refillGroups(volumes, original_capacity)
+    original_travel = _tripsTravel(distances, n, original_batches)
+
+    order = nearestNeighbourOrder(distances, n, range(n))
+    order = twoOpt(order, distances, n, max_passes=max_passes)
+    trips = splitRoute(order, volumes, capacity, distances, n, refill_cost)
+    trips = _relocate(trips, volumes, capacity, distances, n, refill_cost, max_passes)
+    trips = [twoOpt(trip, distances, n, end=n, max_passes=max_passes) for trip in trips]
+    if trips:
+        # The last batch does not return to the origin; the longest way back is saved
+        last = max(range(len(trips)), key=lambda t: distances[trips[t][-1], n])
+        trips.append(twoOpt(trips.pop(last), distances, n, max_passes=max_passes))
+    travel = _tripsTravel(distances, n, trips)
+
+    plan = refill_plan(trips, volumes, travel, original_batches, original_travel)
+    # Batches of the given order are only valid if they fit capacity
+    if original_capacity <= capacity and plan.original_duration <= plan.duration:
+        return refill_plan(original_batches, volumes, original_travel, original_batches, original_travel)
+    return plan
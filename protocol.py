@@ -0,0 +1,343 @@
+"""
+Protocol execution graph.
+
+Protocol steps are not executed right away, but recorded as actions.
+Every action holds resources: the devices it uses, such as the gantry,
+a pipettor, a gripper or the docker. An action runs after the previous action
+holding any of its resources, and after the actions given in its "after" list.
+This makes a directed acyclic graph (DAG) of actions.
+
+protocol.run() executes the actions whose dependencies are finished and whose
+resources are free concurrently, so the devices that do not depend on each other
+work at the same time: e.g. the pipettor homes while the gantry travels.
+After the run, criticalPath() and report() show which chain of actions
+determined the total time.
+
+Example:
+    prot = protocol.protocol(ar)
+    prot.pickUpTip(p1000, tips, 0, 0)
+    prot.uptakeLiquid(p1000, tube1, 500)
+    prot.dispenseLiquid(p1000, tube2, 500)
+    prot.run()
+    print(prot.report())
+"""
+
+import logging
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class action():
+    """
+    Function call recorded into the protocol.
+    """
+
+    def __init__(self, name, function, args=(), kwargs=None, resources=(), depends_on=(), estimate=0):
+        """
+        Inputs:
+            name
+                Name shown in the report
+            function, args, kwargs
+                Called as function(*args, **kwargs) when the action runs.
+            resources
+                Devices used by the action; no other action uses them at the same time.
+            depends_on
+                Actions which must be finished before this one starts.
+            estimate
+                Expected duration, seconds. Used by protocol.criticalPath()
+                until the action is executed.
+        """
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.resources = frozenset(resources)
+        self.depends_on = list(depends_on)
+        self.estimate = estimate
+        # Seconds from the start of protocol.run()
+        self.start_time = None
+        self.finish_time = None
+        self.result = None
+        self.error = None
+
+
+    def __repr__(self):
+        return "action(%r)" % self.name
+
+
+    @property
+    def finished(self):
+        return self.finish_time is not None and self.error is None
+
+
+    @property
+    def duration(self):
+        """
+        Measured duration if the action was executed, estimate otherwise.
+        """
+        if self.finish_time is None:
+            return self.estimate
+        return self.finish_time - self.start_time
+
+
+    def execute(self, t0):
+        self.error = None
+        self.start_time = time.perf_counter() - t0
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.finish_time = time.perf_counter() - t0
+        return self.result
+
+
+def _withoutGantrySync(tool, function):
+    """
+    Wraps tool method, so the tool does not wait for the gantry to stop;
+    the order of tool and gantry movements is given by the protocol graph instead.
+    """
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        tool.synchronize_gantry = False
+        try:
+            return function(*args, **kwargs)
+        finally:
+            tool.synchronize_gantry = True
+    return run
+
+
+class protocol():
+    """
+    Records protocol steps into a graph of actions, and executes them.
+    """
+
+    def __init__(self, robot):
+        """
+        Inputs:
+            robot
+                Instance of Arnie cartesian robot. The robot itself stands for
+                the gantry resource, robot.docker for the docker.
+        """
+        self.robot = robot
+        self.actions = []
+        # Last recorded action holding each resource
+        self._last_action = {}
+        self.run_time = None
+
+
+    def resourceName(self, resource):
+        if resource is self.robot:
+            return 'gantry'
+        if resource is getattr(self.robot, 'docker', None):
+            return 'docker'
+        return getattr(resource, 'tool_name', None) or str(resource)
+
+
+    def add(self, function, args=(), kwargs=None, resources=(), after=(), name=None, estimate=0):
+        """
+        Records function call as an action.
+
+        Inputs:
+            function, args, kwargs
+                Called as function(*args, **kwargs) when the action runs.
+            resources
+                Devices used by the action: the robot (gantry), robot.docker or tool objects.
+            after
+                Actions of this protocol which must finish before this one starts,
+                in addition to the previous actions holding the same resources.
+            name
+                Name shown in the report; function name by default.
+            estimate
+                Expected duration, seconds; see action.
+
+        Returns:
+            Recorded action; may be passed as "after" to the next actions.
+        """
+        depends_on = []
+        for a in after:
+            if a not in self.actions:
+                raise ValueError("protocol.add: action %r does not belong to the protocol." % a)
+            depends_on.append(a)
+        for resource in resources:
+            previous = self._last_action.get(resource)
+            if previous is not None and previous not in depends_on:
+                depends_on.append(previous)
+        if name is None:
+            name = getattr(function, '__name__', str(function))
+        new_action = action(name, function, args=args, kwargs=kwargs, resources=resources,
+                            depends_on=depends_on, estimate=estimate)
+        for resource in new_action.resources:
+            self._last_action[resource] = new_action
+        self.actions.append(new_action)
+        return new_action
+
+
+    # Protocol steps
+    # Tool steps moving the gantry hold both the tool and the gantry.
+
+    def move(self, x=None, y=None, z=None, after=(), name=None, **kwargs):
+        kwargs.update(x=x, y=y, z=z)
+        return self.add(self.robot.move, kwargs=kwargs, resources=[self.robot],
+                        after=after, name=name)
+
+
+    def openTool(self, delay=None, after=(), name=None):
+        """
+        Opens the docker while the gantry may still move; e.g. while travelling to the tool rack.
+        """
+        return self.add(self.robot.openTool, kwargs={'delay': delay, 'synchronize': False},
+                        resources=[self.robot.docker], after=after, name=name)
+
+
+    def closeTool(self, delay=None, after=(), name=None):
+        return self.add(self.robot.closeTool, kwargs={'delay': delay, 'synchronize': False},
+                        resources=[self.robot.docker], after=after, name=name)
+
+
+    def pickUpTip(self, pipettor, rack, column=None, row=None, after=(), name=None, **kwargs):
+        """
+        Picks up tip from the given position; if column and row are not given,
+        rack must be racks.tip_pool, and the next tip is taken from it.
+        """
+        if column is None and row is None:
+            function = rack.pickUpNextTip
+            args = (pipettor, )
+        else:
+            function = pipettor.pickUpTip
+            args = (rack, column, row)
+        return self.add(function, args=args, kwargs=kwargs, resources=[self.robot, pipettor],
+                        after=after, name=name or 'pickUpTip')
+
+
+    def uptakeLiquid(self, pipettor, sample, volume, after=(), name=None, **kwargs):
+        return self.add(pipettor.uptakeLiquid, args=(sample, volume), kwargs=kwargs,
+                        resources=[self.robot, pipettor], after=after, name=name)
+
+
+    def dispenseLiquid(self, pipettor, sample, volume, after=(), name=None, **kwargs):
+        return self.add(pipettor.dispenseLiquid, args=(sample, volume), kwargs=kwargs,
+                        resources=[self.robot, pipettor], after=after, name=name)
+
+
+    def homePipettor(self, pipettor, after=(), name=None, **kwargs):
+        """
+        Homes the pipettor plunger, not waiting for the gantry.
+        """
+        return self.add(_withoutGantrySync(pipettor, pipettor.home), kwargs=kwargs,
+                        resources=[pipettor], after=after, name=name or 'homePipettor')
+
+
+    def movePlungerToVol(self, pipettor, volume, after=(), name=None):
+        """
+        Moves the plunger, not waiting for the gantry; the tip must not be in the liquid.
+        """
+        return self.add(_withoutGantrySync(pipettor, pipettor.movePlungerToVol), args=(volume, ),
+                        resources=[pipettor], after=after, name=name)
+
+
+    def grabSample(self, gripper, sample, after=(), name=None, **kwargs):
+        return self.add(gripper.grabSample, args=(sample, ), kwargs=kwargs,
+                        resources=[self.robot, gripper], after=after, name=name)
+
+
+    def placeSample(self, gripper, rack, column, row, after=(), name=None, **kwargs):
+        return self.add(gripper.placeSample, args=(rack, column, row), kwargs=kwargs,
+                        resources=[self.robot, gripper], after=after, name=name)
+
+
+    def operateGripper(self, gripper, angle, after=(), name=None, **kwargs):
+        """
+        Moves the gripper jaws, not waiting for the gantry.
+        """
+        return self.add(_withoutGantrySync(gripper, gripper.operateGripper), args=(angle, ),
+                        kwargs=kwargs, resources=[gripper], after=after, name=name)
+
+
+    def run(self):
+        """
+        Executes the actions not executed yet. An action starts as soon as all
+        the actions it depends on are finished, and its resources are free.
+
+        If an action fails, no more actions are started; the exception is raised
+        when the running ones are finished. Calling run() again continues from
+        the failed action.
+
+        Returns:
+            Time the run took, seconds
+        """
+        pending = [a for a in self.actions if not a.finished]
+        busy = set()
+        running = {}
+        error = None
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+            while pending or running:
+                if error is None:
+                    for a in list(pending):
+                        if a.resources & busy:
+                            continue
+                        if not all(d.finished for d in a.depends_on):
+                            continue
+                        pending.remove(a)
+                        busy |= a.resources
+                        logging.info("protocol: starting %s", a.name)
+                        running[executor.submit(a.execute, t0)] = a
+                if not running:
+                    break
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    a = running.pop(future)
+                    busy -= a.resources
+                    if future.exception() is not None:
+                        logging.error("protocol: %s failed: %s", a.name, future.exception())
+                        if error is None:
+                            error = future.exception()
+        self.run_time = time.perf_counter() - t0
+        if error is not None:
+            raise error
+        return self.run_time
+
+
+    def criticalPath(self):
+        """
+        Finds the longest chain of dependent actions, which determines the protocol time.
+        Measured durations are used for executed actions, estimates for the rest.
+
+        Returns:
+            List of actions, in order of execution.
+        """
+        # Actions are recorded after the ones they depend on
+        longest = {}
+        previous = {}
+        for a in self.actions:
+            before = max(a.depends_on, key=longest.get, default=None)
+            longest[a] = a.duration + (longest[before] if before is not None else 0)
+            previous[a] = before
+        path = []
+        a = max(self.actions, key=longest.get, default=None)
+        while a is not None:
+            path.append(a)
+            a = previous[a]
+        return path[::-1]
+
+
+    def report(self):
+        """
+        Returns text table of the actions: start, duration and resources;
+        actions of the critical path are marked with *.
+        """
+        critical = set(self.criticalPath())
+        lines = ["  %-30s %8s %8s  %s" % ('action', 'start', 'duration', 'resources')]
+        for a in self.actions:
+            start = '-' if a.start_time is None else '%.2f' % a.start_time
+            resources = ', '.join(sorted(self.resourceName(r) for r in a.resources))
+            lines.append("%s %-30s %8s %8.2f  %s" % ('*' if a in critical else ' ',
+                                                   a.name, start, a.duration, resources))
+        critical_time = sum(a.duration for a in critical)
+        total = '-' if self.run_time is None else '%.2f' % self.run_time
+        lines.append("Total time: %s s; critical path: %.2f s; sequential: %.2f s" %
+                     (total, critical_time, sum(a.duration for a in self.actions)))
+        return '\n'.join(lines)
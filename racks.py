@@ -1,7 +1,9 @@
-import configparser
 import param # TODO: Remove
 import logging
 import json
+import os
+import numpy as np
+import frames
 
 class rack():
     def __init__(self, rack_name, x_slot=None, y_slot=None, rack_type=None, rack_data=None):
@@ -36,8 +38,19 @@ class rack():
         # x_n, y_n - position (well) in the rack
         self.samples_dict = {}
         
+        # Wells X, Y coordinates, see calcWellsGrid()
+        self.invalidateWellsGrid()
+        
+        # Rack center, and #stalagmyte as touched by the probe used for rack calibration.
+        # See frames.py
+        self.frame = frames.frame(rack_name)
+        self.stalagmyte_frame = frames.frame(rack_name + ' stalagmyte')
+        
         # Attempting to read data from HD
         if self.rack_data is None:
+            self.rack_data = param.getDeckStore().load(param.STORE_RACK, rack_name)
+        if self.rack_data is None:
+            # Saved before the deck store was introduced
             self.rack_data = self.openFileWithRackParameters(rack_name+'.json')
         
         # Populating dictionary with current rack properties
@@ -56,13 +69,7 @@ class rack():
             self.rack_data['type'] = rack_type
         
             # Using provided or saved rack type, load rack properties from config file
-            config = configparser.ConfigParser()
-            config_path = 'configs/' + rack_type + '.ini'
-            
-            #print (config_path)
-            config.read(config_path)
-            
-            #print (config_path)
+            config = param.getConfig(rack_type)
             
             self.z_height = float(config['geometry']['z_box_height'])
             self.max_height = float(config['geometry']['z_max_height'])
@@ -132,6 +139,7 @@ class rack():
     def overwriteSlot(self, x, y):
         self.rack_data['n_x'] = x
         self.rack_data['n_y'] = y
+        self.invalidateWellsGrid()
     
 # TODO: Make a separate class to handle floor, get rid of param altogether.
     def getSavedSlotCenter(self):
@@ -142,8 +150,7 @@ class rack():
         x_slot = self.rack_data['n_x']
         y_slot = self.rack_data['n_y']
         
-        x, y = param.calcSquareSlotCenterFromVertices(x_slot, y_slot)
-        z = param.getSlotZ(x_slot, y_slot)
+        x, y, z = param.getSlotCenter(x_slot, y_slot)
         
         return x, y, z
     
@@ -159,6 +166,8 @@ class rack():
         
     def updateCalibratedRackCenter(self, x, y, z):
         self.rack_data['position'] = [x, y, z]
+        self.invalidateWellsGrid()
+        self.frame.setOffset(x, y, z)
 
     def getStalagmyteCalibration(self):
         [x, y, z] = self.rack_data['pos_stalagmyte']
@@ -166,6 +175,7 @@ class rack():
         
     def updateStalagmyteCalibration(self, x, y, z):
         self.rack_data['pos_stalagmyte'] = [x, y, z]
+        self.stalagmyte_frame.setOffset(x, y, z)
     
     
     def getHeightFromFloor(self):
@@ -219,67 +229,105 @@ class rack():
             return self.getRelativeZCalibrationPoint()
     
     
-    def calcWellsPositions(self):
-        
+    def invalidateWellsGrid(self):
+        """
+        Makes wells coordinates to be calculated again at the next request.
+        """
+        self._wells_grid = None
+        self._wells_grid_center = None
+    
+    
+    def calcWellsGrid(self):
+        """
+        Returns numpy array of shape (columns, rows, 2) with X, Y coordinates of every well.
+        The array is calculated once, and again only after the rack center changes.
+        Do not modify the returned array.
+        """
         [x, y, z] = self.getCalibratedRackCenter()
         
-        coord_1st_x = x - self.dist_cntr_to_1st_col
-        coord_1st_y = y - self.dist_cntr_to_1st_row
-        
-        coord_list = []
-        coord_added_x = 0
+        if self._wells_grid is None or self._wells_grid_center != (x, y):
+            coord_1st_x = x - self.dist_cntr_to_1st_col
+            coord_1st_y = y - self.dist_cntr_to_1st_row
+            grid = np.empty((self.columns, self.rows, 2))
+            grid[:, :, 0] = (coord_1st_x + np.arange(self.columns) * self.dist_between_cols)[:, np.newaxis]
+            grid[:, :, 1] = (coord_1st_y + np.arange(self.rows) * self.dist_between_rows)[np.newaxis, :]
+            self._wells_grid = grid
+            self._wells_grid_center = (x, y)
         
-        for i in range(self.columns):
-            coord_i = coord_1st_x + coord_added_x
-            coord_added_x += self.dist_between_cols
-            
-            coord_list_y = []
-            coord_added_y = 0
-            for j in range(self.rows):
-                coord_j = coord_1st_y + coord_added_y
-                coord_list_y.append((coord_i, coord_j))
-                coord_added_y += self.dist_between_rows
-            coord_list.append(coord_list_y)
-        
-        return coord_list
+        return self._wells_grid
+    
+    
+    def calcWellsPositions(self):
+        """
+        Returns X, Y coordinates of all wells as a list of columns, 
+        each containing (x, y) for every row.
+        """
+        return [[tuple(well) for well in column] for column in self.calcWellsGrid().tolist()]
         
     
     def calcWellXY(self, well_col, well_row):
-        coord_list = self.calcWellsPositions()
-        return coord_list[well_col][well_row][0], coord_list[well_col][well_row][1]
+        x, y = self.calcWellsGrid()[well_col, well_row]
+        return float(x), float(y)
+    
+    
+    def _updateFrames(self):
+        """
+        Places rack frames according to rack_data, which may be loaded 
+        from the file or modified directly.
+        """
+        [x, y, z] = self.getCalibratedRackCenter()
+        self.frame.setOffset(x, y, z)
+        try:
+            [x, y, z] = self.rack_data['pos_stalagmyte']
+        except KeyError:
+            return False
+        self.stalagmyte_frame.setOffset(x, y, z)
+        return True
+    
+    
+    def toolTransform(self, tool=None):
+        """
+        Returns homogeneous transform from rack coordinates to the gantry 
+        coordinates, at which the tool reaches the points.
+        
+        Tool correction is used if both the rack and the tool have #stalagmyte calibration.
+        """
+        has_stalagmyte = self._updateFrames()
+        tool_frame = frames.toolFrame(tool) if has_stalagmyte else None
+        if tool_frame is None:
+            return self.frame.toDeck()
+        return tool_frame.relativeTo(self.stalagmyte_frame) @ self.frame.toDeck()
     
-    # TODO: This function, and calcRackCenterFullCalibration uses too much of the same code
     def calcWorkingPosition(self, well_col, well_row, tool=None):
         
         #print (self.rack_data)
-        x, y = self.calcWellXY(well_col, well_row)
-        x_slot, y_slot, z_calibr = self.getCalibratedRackCenter()
-        z = z_calibr + self.z_working_height
-
-        # Checking whether stalagmyte data are present in the rack object:
-        try:
-            self.rack_data['pos_stalagmyte']
-            use_stalagmyte = True
-        except:
-            use_stalagmyte = False
-            
-        if use_stalagmyte:
-            try:
-                tool_stal_x, tool_stal_y, tool_stal_z = tool.getStalagmyteCoord()
-            except:
-                [tool_stal_x, tool_stal_y, tool_stal_z] =  self.rack_data['pos_stalagmyte']
-            
-            [tp_stal_x, tp_stal_y, tp_stal_z] = self.rack_data['pos_stalagmyte']
-            
-            dx = tp_stal_x - tool_stal_x
-            dy = tp_stal_y - tool_stal_y
-            dz = tp_stal_z - tool_stal_z
-        else:
-            dx = 0
-            dy = 0
-            dz = 0
+        x, y, z = self.calcWorkingPositions([(well_col, well_row)], tool=tool)[0]
+        return float(x), float(y), float(z)
+    
+    
+    def calcWorkingPositions(self, wells=None, tool=None):
+        """
+        Same as calcWorkingPosition(), for many wells at once.
+        
+        Inputs:
+            wells
+                List of (well_col, well_row), or numpy array of shape (n, 2).
+                If not provided, all wells of the rack, column by column.
+            tool
+                Tool object, for which to correct coordinates. 
         
-        return x - dx, y - dy, z - dz
+        Returns:
+            numpy array of shape (n, 3), X, Y, Z for every well.
+        """
+        if wells is None:
+            wells = np.indices((self.columns, self.rows)).reshape(2, -1).T
+        wells = np.asarray(wells, dtype=int).reshape(-1, 2)
+        transform = self.toolTransform(tool)
+        # Wells in rack coordinates
+        points = np.empty((len(wells), 3))
+        points[:, :2] = self.calcWellsGrid()[wells[:, 0], wells[:, 1]] - self.frame.offset[:2]
+        points[:, 2] = self.z_working_height
+        return frames.transformPoints(transform, points)
     
     
     def calcRackCenterFullCalibration(self, tool):
@@ -287,11 +335,8 @@ class rack():
         Given calibrated tool object, calculates X, Y, Z coordinates of the rack center,
         that takes into account both tool and rack calibrations.
         """
-        [x, y, z] = self.getCalibratedRackCenter()
-        z = z + self.z_working_height
-        try:
-            tool_stal_x, tool_stal_y, tool_stal_z = tool.getStalagmyteCoord()
-        except:
+        self._updateFrames()
+        if frames.toolFrame(tool) is None:
             # If function was unable to get stalagmyte coordinates from tool
             # (will happen, for instance, whent the tool was not calibrated),
             # print error message
@@ -299,13 +344,10 @@ class rack():
             print ("The tool was likely not calibrated")
             print ("Perform tool calibration using tool.calibrateTool() and repeat")
             return
-        [tp_stal_x, tp_stal_y, tp_stal_z] = self.rack_data['pos_stalagmyte']
-        
-        dx = tp_stal_x - tool_stal_x
-        dy = tp_stal_y - tool_stal_y
-        dz = tp_stal_z - tool_stal_z
-        
-        return x - dx, y - dy, z - dz
+        # Requires #stalagmyte calibration of the rack
+        self.getStalagmyteCalibration()
+        x, y, z = frames.transformPoints(self.toolTransform(tool), [0, 0, self.z_working_height])[0]
+        return float(x), float(y), float(z)
     
     
     def calcAbsoluteTopZ(self):
@@ -319,10 +361,10 @@ class rack():
 
     
     def save(self):
-        rack_name = self.rack_data['name']
-        f = open(rack_name+'.json', 'w')
-        f.write(json.dumps(self.rack_data))
-        f.close()
+        """
+        Saves rack data into the deck store, see param.deck_store
+        """
+        param.getDeckStore().save(param.STORE_RACK, self.rack_data['name'], self.rack_data)
         
     # ==================================================
     # Gripping functions
@@ -438,9 +480,7 @@ class stackable(rack):
         y_slot = self.rack_data['n_y']
         self.top_item.overwriteSlot(x_slot, y_slot)
         # Setting new height from the floor. It is equal to the current heigth + heigth of the top item (from config)
-        config = configparser.ConfigParser()
-        config_path = 'configs/' + self.top_item.rack_data['type'] + '.ini'
-        config.read(config_path)
+        config = param.getConfig(self.top_item.rack_data['type'])
         top_item_z_height_from_config = float(config['geometry']['z_box_height'])
         self.top_item.z_height = self.getHeightFromFloor() + top_item_z_height_from_config
         
@@ -470,8 +510,7 @@ class stackable(rack):
             x_slot = self.rack_data['n_x']
             y_slot = self.rack_data['n_y']
             
-            x, y = param.calcSquareSlotCenterFromVertices(x_slot, y_slot)
-            z = param.getSlotZ(x_slot, y_slot)
+            x, y, z = param.getSlotCenter(x_slot, y_slot)
         
         return x, y, z
 
@@ -482,22 +521,19 @@ class stackable(rack):
         if self.bottom_item:
            # TODO: Stackable racks need to have 2 variables: distance from floor to the rack top, and 
            # distance from the bottom of the rack to its top (latter one is from config)
-           config = configparser.ConfigParser()
-           config_path = 'configs/' + self.rack_data['type'] + '.ini'
-           config.read(config_path)
+           config = param.getConfig(self.rack_data['type'])
            height_from_config = float(config['geometry']['z_box_height'])
            z = z + height_from_config
            self.bottom_item.updateCenter(x, y, z, x_btm_touch, y_btm_touch, z_btm_touch)
 
 
     def save(self):
-        rack_name = self.rack_data['name']
-        f = open(rack_name+'.json', 'w')
-        f.write(json.dumps(self.rack_data))
-        f.close()
-        if self.bottom_item:
-            # Saving also settings of the bottom rack
-            self.bottom_item.save()
+        # The whole stack is saved in one transaction
+        with param.getDeckStore().batch():
+            super().save()
+            if self.bottom_item:
+                # Saving also settings of the bottom rack
+                self.bottom_item.save()
 
         
     
@@ -533,15 +569,138 @@ class stack(object):
         
     
 
+# Entries of consumables journal, after which the rack is saved
+JOURNAL_CHECKPOINT_ENTRIES = 1000
+
+
 class consumables(rack):
     """
     Handles racks with consumables, such as pipette tips
-    """            
+    
+    Availability of the items is kept as a bitset, one bit per well, column by column:
+    bit number column * rows + row is set if the well holds a ready item.
+    Changes are appended to the journal file rack_name.journal, instead of rewriting
+    the rack data every time. The rack is saved at checkpoints: on save(),
+    checkpoint(), or after JOURNAL_CHECKPOINT_ENTRIES journal entries.
+    """
+    
+    def __init__(self, rack_name, x_slot=None, y_slot=None, rack_type=None, rack_data=None):
+        from_disk = rack_data is None
+        super().__init__(rack_name, x_slot, y_slot, rack_type, rack_data)
+        self.journal_path = rack_name + '.journal'
+        self.journal = None
+        self.journal_entries = 0
+        self.ready_bits = self._itemsToBits(self.rack_data.get('ready_items_list', []))
+        if from_disk:
+            self._replayJournal()
+    
+    
+    def _itemsToBits(self, coord_list):
+        bits = 0
+        for col, row in coord_list:
+            if 0 <= col < self.columns and 0 <= row < self.rows:
+                bits |= 1 << (col * self.rows + row)
+        return bits
+    
+    
+    def _bitsToItems(self, bits):
+        items = []
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            items.append(divmod(index, self.rows))
+            bits ^= lowest
+        return items
+    
+    
+    def _allBits(self):
+        return (1 << (self.columns * self.rows)) - 1
+    
+    
+    def _replayJournal(self):
+        """
+        Applies changes, written into the journal after the last checkpoint.
+        """
+        try:
+            f = open(self.journal_path, 'r')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line may be incomplete, if the process was interrupted while writing
+                    logging.warning("consumables: skipping damaged entry of %s", self.journal_path)
+                    continue
+                self.ready_bits = int(entry['ready'], 16)
+                self.journal_entries += 1
+    
+    
+    def _writeJournal(self):
+        """
+        Appends current availability of the items to the journal.
+        """
+        self.journal_entries += 1
+        if self.journal_entries > JOURNAL_CHECKPOINT_ENTRIES:
+            self.checkpoint()
+            return
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+        self.journal.write(json.dumps({'ready': '%x' % self.ready_bits}) + '\n')
+        self.journal.flush()
+    
+    
+    def _setReadyBits(self, bits):
+        if bits != self.ready_bits:
+            self.ready_bits = bits
+            self._writeJournal()
+    
+    
+    def checkpoint(self):
+        """
+        Saves the rack and starts a new journal.
+        """
+        self.save()
+    
+    
+    def save(self):
+        self.rack_data['ready_items_list'] = self.getReadyItemsList()
+        super().save()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.journal_entries:
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self.journal_entries = 0
+    
+    
     def getReadyItemsList(self):
-        try: 
-            return self.rack_data['ready_items_list']
-        except:
-            return []
+        """
+        Returns list of positions of ready items, column by column.
+        Example: [(0, 0), (0, 1), (3, 4), ...]
+        """
+        return self._bitsToItems(self.ready_bits)
+    
+    
+    def countReadyItems(self):
+        return bin(self.ready_bits).count('1')
+    
+    
+    def isReady(self, col, row):
+        return bool(self.ready_bits >> (col * self.rows + row) & 1)
+    
+    
+    def getReadyMask(self):
+        """
+        Returns numpy bool array of shape (columns, rows), True for the wells with ready items.
+        """
+        n = self.columns * self.rows
+        data = np.frombuffer(self.ready_bits.to_bytes((n + 7) // 8, 'little'), dtype=np.uint8)
+        return np.unpackbits(data, bitorder='little')[:n].astype(bool).reshape(self.columns, self.rows)
             
             
     def setItemsAsReady(self, coord_list):
@@ -552,28 +711,62 @@ class consumables(rack):
                 List of positins for consumable items. 
                 Example: [(0, 0), (0, 1), (3, 4), ...]
         """
-        present_items = self.getReadyItemsList()
-        present_items = present_items + coord_list
-        self.rack_data['ready_items_list'] = present_items
-        self.save()
+        self._setReadyBits(self.ready_bits | self._itemsToBits(coord_list))
         
         
     def removeConsumableItems(self, coord_list):
-        present_items = self.getReadyItemsList()
-        for item in coord_list:
-            try:
-                present_items.remove(item)
-            except:
-                pass
-        self.rack_data['ready_items_list'] = present_items
-        self.save()
+        self._setReadyBits(self.ready_bits & ~self._itemsToBits(coord_list))
         
     
     def getNextConsumable(self, discard=True):
-        ready_items = self.getReadyItemsList()
-        item = ready_items[0]
-        self.removeConsumableItems([item])
-        return item
+        """
+        Returns position of the first ready item, column by column, and marks it as used.
+        Returns None if the rack is empty.
+        """
+        items = self.reserveConsumables(1)
+        if not items:
+            return None
+        return items[0]
+    
+    
+    def reserveConsumables(self, n, whole_column=False):
+        """
+        Takes several ready items at once, marking them as used.
+        
+        Inputs:
+            n
+                Number of items
+            whole_column
+                If True, n items in adjacent rows of the same column are taken 
+                (e.g. for multichannel pipettor). First suitable column is used.
+        Returns:
+            List of positions of taken items; empty list if there are not enough ready items.
+        """
+        bits = self.ready_bits
+        if whole_column:
+            block = (1 << n) - 1
+            taken = 0
+            for col in range(self.columns):
+                column_bits = bits >> (col * self.rows) & ((1 << self.rows) - 1)
+                for row in range(self.rows - n + 1):
+                    if column_bits >> row & block == block:
+                        taken = block << (col * self.rows + row)
+                        break
+                if taken:
+                    break
+        else:
+            taken = 0
+            remaining = bits
+            for i in range(n):
+                lowest = remaining & -remaining
+                taken |= lowest
+                remaining ^= lowest
+        if n <= 0 or bin(taken).count('1') != n:
+            logging.error("consumables.reserveConsumables: rack %s has no %d ready items%s.",
+                          self.rack_data['name'], n, ' in a column' if whole_column else '')
+            return []
+        self._setReadyBits(bits & ~taken)
+        return self._bitsToItems(taken)
     
     
     def replaceConsumables(self):
@@ -581,9 +774,167 @@ class consumables(rack):
         Replentish consumables, making all the possible wells for given rack filled with
         ready to use consumables. Real world analog is replacing the rack of tips at the same spot
         """
-        coord_list = []
-        for i in range(self.columns):
-            for j in range (self.rows):
-                coord_list.append((i, j))
-        self.rack_data['ready_items_list'] = []
-        self.setItemsAsReady(coord_list)
\ No newline at end of file
+        self._setReadyBits(self._allBits())
+
+
+
+class tip_pool():
+    """
+    Handles all consumables racks with the same type of items (e.g. p200 tips) on the deck.
+    Hands out the items from any of the racks, nearest to the given position first,
+    so a protocol does not stop when a single rack runs out.
+    
+    Items are referred to as (rack, column, row).
+    """
+    
+    def __init__(self, tip_type, racks_list=()):
+        self.tip_type = tip_type
+        self.racks = []
+        for r in racks_list:
+            self.addRack(r)
+    
+    
+    def addRack(self, rack):
+        if rack.rack_data.get('type') != self.tip_type:
+            logging.error("tip_pool: rack %s is of type %s, not %s.", 
+                          rack.rack_data['name'], rack.rack_data.get('type'), self.tip_type)
+            return
+        if 'position' not in rack.rack_data:
+            # Coordinates of the items are needed to choose the nearest one
+            logging.error("tip_pool: rack %s is not calibrated.", rack.rack_data['name'])
+            return
+        if rack not in self.racks:
+            self.racks.append(rack)
+    
+    
+    def loadRacks(self):
+        """
+        Adds all calibrated racks of the pool type, saved with consumables in the deck store.
+        """
+        for rack_data in param.getDeckStore().find(param.STORE_RACK, item_type=self.tip_type):
+            if 'ready_items_list' not in rack_data or 'position' not in rack_data:
+                continue
+            name = rack_data['name']
+            if any(r.rack_data['name'] == name for r in self.racks):
+                continue
+            self.addRack(consumables(rack_name=name))
+    
+    
+    def countRemaining(self):
+        """
+        Returns number of ready items in all racks of the pool.
+        """
+        return sum(r.countReadyItems() for r in self.racks)
+    
+    
+    def countRemainingByRack(self):
+        """
+        Returns dictionary {rack name: number of ready items}
+        """
+        return {r.rack_data['name']: r.countReadyItems() for r in self.racks}
+    
+    
+    def _readyItems(self):
+        """
+        Returns ready items of all racks:
+            list of (rack, columns, rows) of the items,
+            numpy array of shape (n, 2) with X, Y of every item,
+            numpy array with index of the rack (in the list above) for every item.
+        """
+        racks_items = []
+        xy = []
+        owners = []
+        for r in self.racks:
+            columns, rows = np.nonzero(r.getReadyMask())
+            if not len(columns):
+                continue
+            owners.append(np.full(len(columns), len(racks_items)))
+            racks_items.append((r, columns, rows))
+            xy.append(r.calcWellsGrid()[columns, rows])
+        if not racks_items:
+            return [], np.empty((0, 2)), np.empty(0, dtype=int)
+        return racks_items, np.concatenate(xy), np.concatenate(owners)
+    
+    
+    def reserveTips(self, destinations):
+        """
+        Takes items for a planned list of operations, marking them as used.
+        
+        Inputs:
+            destinations
+                List of X, Y (or X, Y, Z) coordinates, where the gantry goes before 
+                picking up every item, or None. For every destination the nearest ready
+                item is taken; without destination, next item of the first non-empty rack.
+        Returns:
+            List of (rack, column, row), one item per destination.
+            Empty list if there are not enough ready items; nothing is taken then.
+        """
+        destinations = list(destinations)
+        racks_items, xy, owners = self._readyItems()
+        if len(xy) < len(destinations):
+            logging.error("tip_pool: %d items of type %s requested, %d remain.", 
+                          len(destinations), self.tip_type, len(xy))
+            return []
+        available = np.ones(len(xy), dtype=bool)
+        taken = []
+        for destination in destinations:
+            if destination is None:
+                # Items are listed rack by rack, column by column
+                index = int(np.argmax(available))
+            else:
+                distance = np.hypot(xy[:, 0] - destination[0], xy[:, 1] - destination[1])
+                index = int(np.argmin(np.where(available, distance, np.inf)))
+            available[index] = False
+            taken.append(index)
+        
+        result = []
+        for index in taken:
+            r, columns, rows = racks_items[owners[index]]
+            position = index - int(np.searchsorted(owners, owners[index]))
+            result.append((r, int(columns[position]), int(rows[position])))
+        # One journal entry per rack
+        for r, columns, rows in racks_items:
+            items = [(col, row) for (rack_, col, row) in result if rack_ is r]
+            if items:
+                r.removeConsumableItems(items)
+        return result
+    
+    
+    def releaseTips(self, items):
+        """
+        Returns reserved, but not used items to their racks.
+        Inputs:
+            items
+                List of (rack, column, row), as returned by reserveTips()
+        """
+        for r in self.racks:
+            coord_list = [(col, row) for (rack_, col, row) in items if rack_ is r]
+            if coord_list:
+                r.setItemsAsReady(coord_list)
+    
+    
+    def getNextTip(self, position=None):
+        """
+        Takes ready item nearest to the position (X, Y or X, Y, Z).
+        Returns (rack, column, row), or None if the pool is empty.
+        """
+        items = self.reserveTips([position])
+        if not items:
+            return None
+        return items[0]
+    
+    
+    def pickUpNextTip(self, tool, position=None, **kwargs):
+        """
+        Picks up the ready item nearest to the position, or to the current gantry position.
+        Other arguments are passed to tool.pickUpTip()
+        Returns (rack, column, row), or None if the pool is empty.
+        """
+        if position is None:
+            position = tool.robot.getPosition()
+        item = self.getNextTip(position)
+        if item is None:
+            return None
+        r, column, row = item
+        tool.pickUpTip(r, column, row, **kwargs)
+        return item
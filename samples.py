@@ -1,6 +1,140 @@
-import configparser
 import logging
-import json
+import numpy as np
+import param
+
+
+
+# Methods of interpolation between the points of volume vs depth dependence
+INTERPOLATION_LINEAR = 'linear'
+# Piecewise cubic Hermite spline that keeps the curve monotone between the points
+INTERPOLATION_MONOTONE = 'monotone'
+# Number of points used to tabulate inverse of the spline between two points of the dependence
+INVERSE_POINTS_PER_SEGMENT = 64
+
+
+class interpolation_table():
+    """
+    Function given by a table of points, sorted by x once on creation.
+    Between the points values are interpolated; outside of the table they are
+    extrapolated linearly, using the first or the last pair of points.
+    Accepts single values as well as arrays.
+    """
+    
+    def __init__(self, x, y, method=INTERPOLATION_LINEAR):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        x, index = np.unique(x, return_index=True)
+        self.x = x
+        self.y = y[index]
+        self.method = method
+        # Slopes of the segments between the points
+        self.slopes = np.diff(self.y) / np.diff(self.x)
+        if method == INTERPOLATION_MONOTONE:
+            self.derivatives = self._monotoneDerivatives()
+        elif method != INTERPOLATION_LINEAR:
+            raise ValueError("Unknown interpolation method: " + str(method))
+    
+    def _monotoneDerivatives(self):
+        """
+        Derivatives at the points for the monotone (Fritsch-Carlson) spline.
+        """
+        h = np.diff(self.x)
+        delta = self.slopes
+        d = np.zeros(len(self.x))
+        if len(delta) == 1:
+            d[:] = delta[0]
+            return d
+        # Inner points: weighted harmonic mean of the neighbouring slopes,
+        # zero at local extremums.
+        w1 = 2 * h[1:] + h[:-1]
+        w2 = h[1:] + 2 * h[:-1]
+        same_sign = delta[:-1] * delta[1:] > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inner = (w1 + w2) / (w1 / delta[:-1] + w2 / delta[1:])
+        d[1:-1] = np.where(same_sign, inner, 0)
+        d[0] = self._endDerivative(h[0], h[1], delta[0], delta[1])
+        d[-1] = self._endDerivative(h[-1], h[-2], delta[-1], delta[-2])
+        return d
+    
+    @staticmethod
+    def _endDerivative(h0, h1, delta0, delta1):
+        d = ((2 * h0 + h1) * delta0 - h0 * delta1) / (h0 + h1)
+        if np.sign(d) != np.sign(delta0):
+            return 0.
+        if np.sign(delta0) != np.sign(delta1) and abs(d) > abs(3 * delta0):
+            return 3 * delta0
+        return d
+    
+    def __call__(self, x):
+        scalar = np.ndim(x) == 0
+        x = np.asarray(x, dtype=float)
+        # Segment of every value; values outside of the table use the end segments.
+        k = np.clip(np.searchsorted(self.x, x, side='right') - 1, 0, len(self.slopes) - 1)
+        x_k = self.x[k]
+        y = self.y[k] + (x - x_k) * self.slopes[k]
+        if self.method == INTERPOLATION_MONOTONE:
+            inside = (x >= self.x[0]) & (x <= self.x[-1])
+            h = self.x[k + 1] - x_k
+            t = (x - x_k) / h
+            spline = ((2 * t**3 - 3 * t**2 + 1) * self.y[k]
+                      + (t**3 - 2 * t**2 + t) * h * self.derivatives[k]
+                      + (-2 * t**3 + 3 * t**2) * self.y[k + 1]
+                      + (t**3 - t**2) * h * self.derivatives[k + 1])
+            y = np.where(inside, spline, y)
+        if scalar:
+            return float(y)
+        return y
+
+
+class volume_curve():
+    """
+    Dependence of depth (distance from the top of the sample) on the volume of liquid,
+    compiled from the volume_vs_z dictionary of the sample parameters.
+    """
+    
+    def __init__(self, vol_vs_z_dict, method=INTERPOLATION_LINEAR):
+        volumes = [float(v) for v in vol_vs_z_dict.keys()]
+        depths = [float(z) for z in vol_vs_z_dict.values()]
+        self.depth = interpolation_table(volumes, depths, method)
+        if method == INTERPOLATION_LINEAR:
+            self.volume = interpolation_table(depths, volumes)
+        else:
+            # Inverse of the spline, tabulated densely between the points
+            x = self.depth.x
+            dense_volumes = np.concatenate([np.linspace(x[k], x[k + 1], INVERSE_POINTS_PER_SEGMENT, endpoint=False)
+                                            for k in range(len(x) - 1)] + [x[-1:]])
+            self.volume = interpolation_table(self.depth(dense_volumes), dense_volumes)
+        self.max_volume = self.depth.x[-1]
+
+
+# Compiled curves: {id(vol_vs_z_dict): (vol_vs_z_dict, {method: volume_curve})}
+volume_curves = {}
+
+
+def getVolumeCurve(params, method=None):
+    """
+    Returns volume vs depth curve for the sample parameters, compiled once per sample type.
+    
+    Inputs:
+        params
+            Sample parameters, containing volume_vs_z dictionary.
+        method
+            INTERPOLATION_LINEAR or INTERPOLATION_MONOTONE. If not provided, 
+            taken from "volume_interpolation" parameter, linear by default.
+    """
+    vol_vs_z_dict = params['volume_vs_z']
+    if method is None:
+        method = params.get('volume_interpolation', INTERPOLATION_LINEAR)
+    # Parameters are shared by all samples of the type, so the same dictionary
+    # is used as the key. Keeping the reference keeps its id valid.
+    entry = volume_curves.get(id(vol_vs_z_dict))
+    if entry is None or entry[0] is not vol_vs_z_dict:
+        entry = (vol_vs_z_dict, {})
+        volume_curves[id(vol_vs_z_dict)] = entry
+    curves = entry[1]
+    if method not in curves:
+        curves[method] = volume_curve(vol_vs_z_dict, method)
+    return curves[method]
 
 
 class sample():
@@ -28,18 +162,14 @@ class sample():
         else:
             self.removeCap()
         
-        # Populating with saved settings
-        config = configparser.ConfigParser()
-        config_path = 'configs/' + sample_type + '.ini'
-        config.read(config_path)
+        # Populating with saved settings, shared by all samples of the type
+        config = param.getConfig(sample_type)
         
         # Loading properties
             
-        # Loading parameters dictionary
+        # Loading parameters dictionary (read-only)
         params_path = str(config['properties']['params'])
-        filehandler = open('configs/'+params_path, 'r')
-        self.params = json.loads(filehandler.read())
-        filehandler.close()
+        self.params = param.getParams(params_path)
         
         # Sample length
         try:
@@ -91,50 +221,35 @@ class sample():
         return z
 
 
+    def getVolumeCurve(self):
+        """
+        Returns compiled volume vs depth dependence of the sample; see volume_curve.
+        """
+        return getVolumeCurve(self.params)
+
+
     def getDepthFromVolume(self, volume):
         """
         Calculates distance from the top of the sample to the 
         position of certain volume.
+        Volume may be a number or an array of volumes.
         """
-        # Dictionary that stores dependence of volume vs height
-        # Ultimately provided in settings file
-        vol_vs_z_dict = self.params['volume_vs_z']
-        # Filling temporary dictionary of the dependence of standard volumes vs 
-        # standard_vol - volume difference.
-        diff_dict = {}
-        for key in vol_vs_z_dict.keys():
-            standard_vol = float(key)
-            diff = abs(standard_vol - volume)
-            diff_dict[key] = diff
-        # Getting closest standard volume to the provided volume
-        standard_vol_1 = min(diff_dict, key=diff_dict.get)
-        # Removing the standard volume from the dV dictionary
-        diff_dict.pop(standard_vol_1, None)
-        # Getting second closest standard volume 
-        # After removing closest standard volume, same function will provide second closest.
-        standard_vol_2 = min(diff_dict, key=diff_dict.get)
-        # Getting Z levels associated with standard volumes
-        standard_z_1 = vol_vs_z_dict[standard_vol_1]
-        standard_z_2 = vol_vs_z_dict[standard_vol_2]
-        # Using obtained points, calculating arguments of linear function, that
-        # includes those points
-        p = [float(standard_vol_1), standard_z_1]
-        q = [float(standard_vol_2), standard_z_2]
-        
-        a = q[1] - p[1]
-        b = p[0] - q[0]
-        c = a * (p[0]) + b * (p[1])
-        
-        # Using obtained linear function, calculating Z relative to the top of the tube
-        z_tube_insert = (c - a * volume) / b
-        
-        return z_tube_insert
+        return self.getVolumeCurve().depth(volume)
+
+
+    def getVolumeFromDepth(self, depth):
+        """
+        Calculates volume of liquid which reaches given distance from the top of the sample.
+        Depth may be a number or an array of depths.
+        """
+        return self.getVolumeCurve().volume(depth)
 
 
     def sampleVolToZ(self, volume, tool):
         """
         Calculates Z at which the end of the tool will be at 
-        the level of the sample which corresponds to provided volume
+        the level of the sample which corresponds to provided volume.
+        Volume may be a number or an array of volumes.
         """
         # TODO: Factor out z_sample_0 calc
         rack = self.sample_data['rack']
@@ -225,10 +340,7 @@ class sample():
         Obtains this data from volume vs z dictionary, that is provided in 
         config json file samplename_params.json
         """
-        vol_vs_z_dict = self.params['volume_vs_z']
-        vols_list = [float(x) for x in vol_vs_z_dict.keys()]
-        max_vol = max(vols_list)
-        return max_vol
+        return float(self.getVolumeCurve().max_volume)
     
     def setSampleEngagedPosition(self, dz):
         self.sample_engaged_dz = dz
@@ -274,10 +386,83 @@ class sample():
         return self.capped
         
 
+class well(sample):
+    """
+    Well of a plate. The well holds no state of its own: volume, cap and engaged
+    position are stored in arrays of the plate, while geometry and parameters are
+    shared by all wells of the plate. Obtain wells with plate.getSample().
+    """
+    
+    def __init__(self, plate, column, row):
+        self.plate = plate
+        self.column = column
+        self.row = row
+    
+    @property
+    def sample_data(self):
+        well_type = self.plate.well_type
+        return {'sample_name': self.plate.plate_name + '_col_' + str(self.column) + '_row_' + str(self.row),
+                'sample_type': well_type.sample_data['sample_type'],
+                'rack': self.plate.plate_data.get('rack'),
+                'x_well': self.column,
+                'y_well': self.row,
+            }
+    
+    @property
+    def params(self):
+        return self.plate.well_type.params
+    
+    @property
+    def length(self):
+        return self.plate.well_type.length
+    
+    @property
+    def inner_diameter(self):
+        return self.plate.well_type.inner_diameter
+    
+    @property
+    def volume(self):
+        return float(self.plate.volumes[self.column, self.row])
+    
+    @volume.setter
+    def volume(self, volume):
+        self.plate.volumes[self.column, self.row] = volume
+    
+    @property
+    def capped(self):
+        return bool(self.plate.capped[self.column, self.row])
+    
+    @capped.setter
+    def capped(self, capped):
+        self.plate.capped[self.column, self.row] = capped
+    
+    @property
+    def sample_engaged_dz(self):
+        dz = self.plate.engaged_dz[self.column, self.row]
+        if np.isnan(dz):
+            return None
+        return float(dz)
+    
+    @sample_engaged_dz.setter
+    def sample_engaged_dz(self, dz):
+        if dz is None:
+            dz = np.nan
+        self.plate.engaged_dz[self.column, self.row] = dz
+    
+    def place(self, rack, x_well=None, y_well=None):
+        """
+        Wells are moved together with their plate; see plate.place()
+        """
+        self.plate.place(rack)
+
+
 class plate():
     """
     Handles plates. Plate may be a real "plate", such as 96-well plate, or the other
     type of sample array. For example, 8-PCR tube stripe is also considered a plate.
+    
+    State of the wells (volume, cap, engaged position) is kept in arrays of shape
+    (columns, rows): plate.volumes, plate.capped, plate.engaged_dz (NaN if not engaged).
     """
     
     #TODO: Sometimes plates are smaller than corresponding racks. Need capability to shift
@@ -290,11 +475,10 @@ class plate():
         There should be a config files placed in configs/%plate_type%.ini and configs/%plate_type%_well.ini
         """
         
+        self.plate_name = plate_name
         self.plate_data = {}
         # Reading parameters for config file
-        config = configparser.ConfigParser()
-        config_path = 'configs/' + plate_type + '.ini'
-        config.read(config_path)
+        config = param.getConfig(plate_type)
         
         self.columns = int(config['wells']['columns'])
         self.rows = int(config['wells']['rows'])
@@ -303,29 +487,41 @@ class plate():
         self.dist_cntr_to_1st_col = float(config['wells']['distance_center_to_1st_column'])
         self.dist_cntr_to_1st_row = float(config['wells']['distance_center_to_1st_row'])
 
-        self.samples_list = self._initSamples(plate_name, plate_type)
+        # Geometry and parameters, shared by all wells
+        self.well_type = sample(sample_name=plate_name + '_well', sample_type=plate_type + '_well')
+        self._initSamples()
         # Use length of an individual well as a length of the plate
-        self.length = self._getZeroSample().length
-        
-    def _initSamples(self, plate_name, plate_type):
-        samples_list = []
-        for col in range(self.columns):
-            for row in range(self.rows):
-                s_name = plate_name + '_col_' + str(col) + '_row_' + str(row)
-                s = sample(sample_name=s_name, sample_type=plate_type+'_well')
-                # Setting a position of a sample
-                s.sample_data['x_well'] = col
-                s.sample_data['y_well'] = row
-                samples_list.append(s)
-        return samples_list
+        self.length = self.well_type.length
+        
+    def _initSamples(self):
+        shape = (self.columns, self.rows)
+        self.volumes = np.zeros(shape)
+        self.capped = np.zeros(shape, dtype=bool)
+        self.engaged_dz = np.full(shape, np.nan)
+        # Well objects are created on request
+        self._wells = np.empty(shape, dtype=object)
+    
+    @property
+    def samples_list(self):
+        """
+        All wells of the plate, column by column.
+        """
+        return [self.getSample(col, row) for col in range(self.columns) for row in range(self.rows)]
     
     def _getZeroSample(self):
         return self.getSample(0, 0)
     
     def getSample(self, column, row):
-        for s in self.samples_list:
-            if (s.sample_data['x_well'] == column) and (s.sample_data['y_well'] == row):
-                return s
+        """
+        Returns well at given column and row; None if there is no such well.
+        """
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            return None
+        s = self._wells[column, row]
+        if s is None:
+            s = well(self, column, row)
+            self._wells[column, row] = s
+        return s
             
     def getSamples(self, col_row_list):
         """
@@ -337,22 +533,87 @@ class plate():
         Returns:
             List of sample objects
         """
-        samples_to_return_list = []
-        for col_row in col_row_list:
-            col = col_row[0]
-            row = col_row[1]
-            s = self.getSample(col, row)
-            samples_to_return_list.append(s)
-        return samples_to_return_list
+        return [self.getSample(col, row) for col, row in col_row_list]
     
     def getAllSamples(self):
         return self.samples_list
     
+    def _maskToWells(self, mask):
+        """
+        Converts mask to column and row indexes of the selected wells.
+        Mask is an array of shape (rows, columns), i.e. laid out as a picture of the plate;
+        wells with non-zero mask values are selected, row by row.
+        """
+        mask = np.asarray(mask)
+        if mask.shape != (self.rows, self.columns):
+            raise ValueError("Mask of shape %s does not match plate with %d rows and %d columns"
+                             % (mask.shape, self.rows, self.columns))
+        rows, columns = np.nonzero(mask)
+        return columns, rows
+    
+    def getSamplesByMask(self, mask):
+        """
+        Returns wells selected by the mask.
+        Inputs:
+            mask
+                Array of shape (rows, columns), laid out as a picture of the plate.
+                Wells with non-zero values are selected.
+        Returns:
+            List of wells, row by row
+        """
+        columns, rows = self._maskToWells(mask)
+        return [self.getSample(col, row) for col, row in zip(columns.tolist(), rows.tolist())]
+    
+    def setVolumes(self, volume, mask=None):
+        """
+        Specifies volume of liquid in the wells.
+        Inputs:
+            volume
+                Volume for all the selected wells, or array of shape (rows, columns) with volume of every well.
+            mask
+                Array of shape (rows, columns); see getSamplesByMask(). All wells if not provided.
+        """
+        volume = np.asarray(volume, dtype=float)
+        if volume.ndim == 2:
+            volume = volume.T
+        if mask is None:
+            self.volumes[:, :] = volume
+            return
+        columns, rows = self._maskToWells(mask)
+        if volume.ndim == 2:
+            volume = volume[columns, rows]
+        self.volumes[columns, rows] = volume
+    
+    def getVolumes(self):
+        """
+        Returns volumes of all wells as array of shape (rows, columns), laid out as a picture of the plate.
+        """
+        return self.volumes.T.copy()
+    
+    def volumesToZ(self, tool, volumes=None):
+        """
+        Calculates Z at which the end of the tool will be at the level of given volume, for every well.
+        Inputs:
+            tool
+                Tool object, for which to calculate Z.
+            volumes
+                Array of shape (rows, columns) with volume for every well, or single volume for all wells.
+                Current volumes of the wells if not provided.
+        Returns:
+            Array of shape (rows, columns), laid out as a picture of the plate.
+        """
+        rack = self.plate_data['rack']
+        if volumes is None:
+            volumes = self.volumes
+        else:
+            volumes = np.asarray(volumes, dtype=float).T
+        z_rack = rack.calcWorkingPositions(tool=tool)[:, 2].reshape(self.columns, self.rows)
+        z_sample_0 = z_rack - self.getSampleHeightAboveRack()
+        z = z_sample_0 + self.well_type.getDepthFromVolume(volumes)
+        return z.T
+    
     def place(self, rack):
         self.plate_data['rack'] = rack
-        sample_list = self.getAllSamples()
-        for s in sample_list:
-            s.sample_data['rack'] = rack
 
             
     def getSampleCenterXY(self, tool):
@@ -448,4 +709,4 @@ class plate():
         
         
     def disengage(self):
-        self._getZeroSample().sample_engaged_dz = None
\ No newline at end of file
+        self._getZeroSample().disengage()
\ No newline at end of file
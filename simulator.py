@@ -0,0 +1,866 @@
+"""
+Simulated Arnie deck.
+
+Emulates the devices Arnie consists of, each on its own pseudo-terminal,
+so cartesian, tools and calibration modules can run without hardware:
+    - cartesian robot (Marlin): G0/G1, G28, M114, M400, M410, G38.2-G38.5
+    - docker servo
+    - pipettors (GRBL): $H, $X, $110=, ? status, M3/M5, G0 X, G4
+    - touch probes: d
+    - mobile gripper: P on/off, G0 <angle>
+Movements take time according to feedrate and acceleration, so protocols
+can be benchmarked offline. Commands received by every device are counted.
+Touch probes are triggered by contact with boxes of the deck model.
+
+Works on Linux and Mac only, as it needs pseudo-terminals.
+
+Example:
+    import simulator, cartesian, tools
+    deck = simulator.deck_model()
+    deck.addBox('rack', x=100, y=100, z=300, size_x=80, size_y=120, height=50)
+    deck.addTool(simulator.touch_probe_emulator(dock_position=[20, 30, 250]))
+    with simulator.simulator(deck, time_scale=0.1) as sim:
+        ar = cartesian.arnie(sim.cartesian_port, sim.docker_port)
+        ...
+        ar.close()
+        print(sim.stats())
+
+Part of ArnieLib.
+"""
+
+import os
+import tty
+import math
+import time
+import heapq
+import select
+import logging
+import itertools
+import threading
+
+# Local parts of ArnieLib imports
+import low_level_comm as llc
+
+
+# Constants
+# ===============================
+
+# Time (s) between port opening and device sending its welcome message.
+# Real devices reboot when the port is opened.
+BOOT_DELAY = 0.02
+# USB round trip latency (s), added to every response.
+LINK_LATENCY = 0.001
+# Commands not terminated by end of line (mobile gripper) are taken as complete
+# when no new data arrived during this time (s).
+INPUT_IDLE_GAP = 0.01
+# How often (s) closed ports are checked for being opened.
+OPEN_CHECK_INTERVAL = 0.005
+# Longest time (s) the simulator thread sleeps, so it can be stopped.
+MAX_SLEEP = 0.05
+
+# Marlin
+MARLIN_WELCOME = "start\necho:Marlin 2.0.5.3\necho: Last Updated: 2020-03-31 | Author: (Arnie)\n"
+MAX_FEEDRATE = [250, 250, 100]  # mm/s, for X, Y, Z
+ACCELERATION = 1000  # mm/s^2
+HOMING_FEEDRATE = [50, 50, 20]  # mm/s
+# Homing bumps the endstop twice; time (s) it takes, on top of the travel.
+HOMING_BUMP_TIME = 0.5
+STEPS_PER_MM = 80
+# Number of movements Marlin keeps in its planner.
+# New movement is acknowledged only when there is a free place.
+PLANNER_BUFFER_SIZE = 16
+# Gantry position at power up
+START_POSITION = [0.0, 0.0, 0.0]
+# Distance (mm) between points checked for contact during G38 probe moves
+PROBE_MOVE_RESOLUTION = 0.01
+
+# Docker
+DOCKER_WELCOME = "Arnie's universal dock controller\n"
+# Servo angles above this one mean closed docker
+DOCKER_CLOSED_ANGLE = 60
+# Tool is picked up if the gantry is that close (mm) to the tool docking point
+DOCK_TOLERANCE = 2
+
+# GRBL pipettor
+GRBL_WELCOME = "\r\nGrbl 1.1h-Servo ['$' for help]\r\n[MSG:'$H'|'$X' to unlock]\r\n"
+GRBL_MAX_RATE = 500  # mm/min; $110
+GRBL_ACCELERATION = 50  # mm/s^2
+GRBL_HOMING_RATE = 300  # mm/min
+
+# Touch probes
+MOBILE_PROBE_WELCOME = "mobile touch probe\r\n"
+STATIONARY_PROBE_WELCOME = "stationary touch probe\r\n"
+# Probe is triggered when its tip is that close (mm) to an obstacle
+PROBE_TIP_RADIUS = 1
+
+# Mobile gripper
+GRIPPER_WELCOME = "mobile gripper\r\n"
+
+
+def moveDuration(distance, speed, acceleration):
+    """
+    Time (s) needed to travel the distance (mm), starting and finishing at rest.
+    Speed (mm/s) is reached with constant acceleration (mm/s^2), if there is enough distance.
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    if distance >= speed ** 2 / acceleration:
+        return distance / speed + speed / acceleration
+    return 2 * math.sqrt(distance / acceleration)
+
+
+def travelledDistance(distance, speed, acceleration, t):
+    """
+    Distance (mm) travelled after time t (s) since start of the movement
+    described in moveDuration().
+    """
+    total = moveDuration(distance, speed, acceleration)
+    if t >= total:
+        return distance
+    if t <= 0:
+        return 0.0
+    if distance >= speed ** 2 / acceleration:
+        t_acc = speed / acceleration
+    else:
+        t_acc = total / 2.0
+    if t < t_acc:
+        return 0.5 * acceleration * t ** 2
+    if t > total - t_acc:
+        return distance - 0.5 * acceleration * (total - t) ** 2
+    return 0.5 * acceleration * t_acc ** 2 + speed * (t - t_acc)
+
+
+class move_segment():
+    """
+    Straight movement from start to end point, beginning at start_time.
+    Durations are multiplied by time_scale.
+    """
+    def __init__(self, start_time, start, end, speed, acceleration, time_scale=1.0):
+        self.start_time = start_time
+        self.start = list(start)
+        self.end = list(end)
+        self.length = math.dist(self.start, self.end)
+        self.speed = speed
+        self.acceleration = acceleration
+        self.time_scale = time_scale
+        self.duration = moveDuration(self.length, speed, acceleration) * time_scale
+        self.end_time = start_time + self.duration
+
+    def positionAt(self, t):
+        if t <= self.start_time:
+            return list(self.start)
+        if t >= self.end_time or self.length == 0:
+            return list(self.end)
+        travelled = travelledDistance(self.length, self.speed, self.acceleration,
+                                      (t - self.start_time) / self.time_scale)
+        fraction = travelled / self.length
+        return [a + (b - a) * fraction for a, b in zip(self.start, self.end)]
+
+
+class box():
+    """
+    Rectangular obstacle on the deck, such as a rack.
+    Robot coordinates are used, so z grows downwards and z is the top of the box.
+    """
+    def __init__(self, name, x, y, z, size_x, size_y, height):
+        self.name = name
+        self.x_min = x - size_x / 2.0
+        self.x_max = x + size_x / 2.0
+        self.y_min = y - size_y / 2.0
+        self.y_max = y + size_y / 2.0
+        self.z_min = z
+        self.z_max = z + height
+
+    def distance(self, point):
+        """
+        Distance from the point to the box; 0 if the point is inside.
+        """
+        x, y, z = point
+        dx = max(self.x_min - x, 0, x - self.x_max)
+        dy = max(self.y_min - y, 0, y - self.y_max)
+        dz = max(self.z_min - z, 0, z - self.z_max)
+        return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+class deck_model():
+    """
+    Geometry of the deck: obstacles, tools and stationary probes.
+    """
+    def __init__(self):
+        self.boxes = []
+        self.tools = []
+        self.stationary_probes = []
+
+    def addBox(self, name, x, y, z, size_x, size_y, height):
+        """
+        Adds an obstacle centered at x, y, with its top at z. Returns box object.
+        """
+        obstacle = box(name, x, y, z, size_x, size_y, height)
+        self.boxes.append(obstacle)
+        return obstacle
+
+    def addTool(self, tool):
+        """
+        Adds mobile tool emulator, waiting at its docking point.
+        """
+        self.tools.append(tool)
+        return tool
+
+    def addStationaryProbe(self, x, y, z, size=10, height=30, name='stationary_probe',
+                           welcome_message=STATIONARY_PROBE_WELCOME):
+        """
+        Adds stationary touch probe: a box on the deck, which reports being touched.
+        """
+        obstacle = self.addBox(name, x, y, z, size, size, height)
+        probe = stationary_probe_emulator(obstacle, name=name, welcome_message=welcome_message)
+        self.stationary_probes.append(probe)
+        return probe
+
+    def isTouchingAnything(self, point, radius=PROBE_TIP_RADIUS):
+        for obstacle in self.boxes:
+            if obstacle.distance(point) <= radius:
+                return True
+        return False
+
+
+class emulated_device():
+    """
+    Device on a pseudo-terminal.
+    Children handle commands by overriding handleCommand().
+    """
+    name = "device"
+    welcome_message = ""
+    # GRBL answers empty lines; most devices ignore them.
+    ignore_empty_lines = True
+
+    def __init__(self, name=None, welcome_message=None):
+        if name is not None:
+            self.name = name
+        if welcome_message is not None:
+            self.welcome_message = welcome_message
+        self.sim = None
+        self.master_fd = None
+        self.port_name = None
+        self.is_open = False
+        self.input_buffer = b''
+        self.last_input_time = 0.0
+        # Commands are processed one after another;
+        # next one is not processed until this time.
+        self.busy_until = 0.0
+        self.resetStats()
+
+    def resetStats(self):
+        self.commands_received = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def stats(self):
+        return {'port': self.port_name,
+                'commands': self.commands_received,
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent}
+
+    def createPort(self):
+        master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)
+        self.port_name = os.ttyname(slave_fd)
+        # Slave end is closed, so the master end shows whether the port is opened by a host.
+        os.close(slave_fd)
+        self.master_fd = master_fd
+
+    def closePort(self):
+        if self.master_fd is not None:
+            os.close(self.master_fd)
+            self.master_fd = None
+
+    def onOpen(self, now):
+        """
+        Called when a host opened the port.
+        """
+        self.input_buffer = b''
+        self.busy_until = now
+        self.reply(self.welcome_message, now + BOOT_DELAY)
+
+    def onClose(self, now):
+        self.input_buffer = b''
+
+    def feed(self, data, now):
+        """
+        Receives bytes from the host, splitting them into commands.
+        """
+        self.bytes_received += len(data)
+        self.input_buffer += data.replace(b'\n', b'\r')
+        self.last_input_time = now
+        while b'\r' in self.input_buffer:
+            line, self.input_buffer = self.input_buffer.split(b'\r', 1)
+            self._command(line, now)
+
+    def flushIdleInput(self, now):
+        """
+        Takes unterminated input as a command, if nothing was received for a while.
+        """
+        if self.input_buffer and now - self.last_input_time >= INPUT_IDLE_GAP:
+            line = self.input_buffer
+            self.input_buffer = b''
+            self._command(line, now)
+
+    def _command(self, line, now):
+        cmd = line.decode(errors='replace').strip()
+        if cmd == "" and self.ignore_empty_lines:
+            return
+        self.commands_received += 1
+        t = max(now, self.busy_until)
+        self.handleCommand(cmd, t)
+
+    def handleCommand(self, cmd, t):
+        """
+        Processes command at time t. Override in children.
+        """
+        pass
+
+    def reply(self, text, t):
+        self.sim.schedule(self, t + LINK_LATENCY, text)
+
+    def scaled(self, duration):
+        return duration * self.sim.time_scale
+
+
+class marlin_emulator(emulated_device):
+    """
+    Cartesian robot controller.
+    Movements are planned one after another, and acknowledged as soon as
+    there is a place in the planner, as Marlin does.
+    """
+    name = "marlin"
+    welcome_message = MARLIN_WELCOME
+
+    def __init__(self, name=None, welcome_message=None, start_position=START_POSITION):
+        super().__init__(name=name, welcome_message=welcome_message)
+        # Position after finishing all planned movements
+        self.position = list(start_position)
+        self.segments = []
+        self.feedrate = MAX_FEEDRATE[0]
+
+    def resetStats(self):
+        super().resetStats()
+        self.moves_received = 0
+        self.motion_time = 0.0
+
+    def stats(self):
+        result = super().stats()
+        result['moves'] = self.moves_received
+        result['motion_time'] = self.motion_time
+        return result
+
+    def motionEnd(self):
+        if self.segments:
+            return self.segments[-1].end_time
+        return 0.0
+
+    def positionAt(self, t):
+        """
+        Actual gantry position at time t.
+        """
+        for segment in self.segments:
+            if t < segment.end_time:
+                return segment.positionAt(t)
+        return list(self.position)
+
+    def _plan(self, target, speed, t, acceleration=ACCELERATION):
+        start_time = max(t, self.motionEnd())
+        segment = move_segment(start_time, self.position, target, speed, acceleration,
+                               self.sim.time_scale)
+        self.segments.append(segment)
+        self.position = list(target)
+        self.motion_time += segment.duration
+        return segment
+
+    def _limitSpeed(self, target, speed):
+        length = math.dist(self.position, target)
+        for i in range(3):
+            delta = abs(target[i] - self.position[i])
+            if delta > 0:
+                speed = min(speed, MAX_FEEDRATE[i] * length / delta)
+        return speed
+
+    def _parseTarget(self, words):
+        target = list(self.position)
+        for word in words:
+            letter, value = word[0], word[1:]
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+            if letter in 'XYZ':
+                target['XYZ'.index(letter)] = value
+            elif letter == 'F':
+                self.feedrate = value / 60.0
+        return target
+
+    def handleCommand(self, cmd, t):
+        # Forgetting finished movements
+        self.segments = [s for s in self.segments if s.end_time > t]
+        words = cmd.upper().split()
+        code = words[0]
+        if code in ('G0', 'G1'):
+            self._move(words[1:], t)
+        elif code == 'G28':
+            self._home(words[1:], t)
+        elif code == 'M114':
+            self._reportPosition(t)
+        elif code == 'M400':
+            self._finishMoves(t)
+        elif code == 'M410':
+            self._quickStop(t)
+        elif code in ('G38.2', 'G38.3', 'G38.4', 'G38.5'):
+            self._probeMove(code, words[1:], t)
+        else:
+            self.reply("ok\n", t)
+
+    def _move(self, words, t):
+        self.moves_received += 1
+        target = self._parseTarget(words)
+        # Waiting for a place in the planner
+        if len(self.segments) >= PLANNER_BUFFER_SIZE:
+            t = self.segments[len(self.segments) - PLANNER_BUFFER_SIZE].end_time
+            self.busy_until = t
+        self._plan(target, self._limitSpeed(target, self.feedrate), t)
+        self.reply("ok\n", t)
+
+    def _home(self, words, t):
+        axes = [word[0] for word in words if word[0] in 'XYZ']
+        if not axes:
+            axes = ['Z', 'X', 'Y']
+        for axis in axes:
+            i = 'XYZ'.index(axis)
+            target = list(self.position)
+            target[i] = 0.0
+            self._plan(target, HOMING_FEEDRATE[i], t)
+        # Homing is finished before the next command is processed
+        self.busy_until = self.motionEnd() + self.scaled(HOMING_BUMP_TIME)
+        self.reply("ok\n", self.busy_until)
+
+    def _reportPosition(self, t):
+        x, y, z = self.position
+        self.reply("X:%.2f Y:%.2f Z:%.2f E:0.00 Count X:%d Y:%d Z:%d\nok\n" % (
+            x, y, z, x * STEPS_PER_MM, y * STEPS_PER_MM, z * STEPS_PER_MM), t)
+
+    def _finishMoves(self, t):
+        self.busy_until = max(t, self.motionEnd())
+        self.reply("ok\n", self.busy_until)
+
+    def _quickStop(self, t):
+        self.position = self.positionAt(t)
+        self.segments = []
+        self.reply("ok\n", t)
+
+    def _probeMove(self, code, words, t):
+        """
+        Moves toward the target until probe is triggered (G38.2, G38.3)
+        or released (G38.4, G38.5).
+        """
+        t = max(t, self.motionEnd())
+        target = self._parseTarget(words)
+        stop_when_triggered = code in ('G38.2', 'G38.3')
+        length = math.dist(self.position, target)
+        points = max(int(length / PROBE_MOVE_RESOLUTION), 1)
+        stop = None
+        for i in range(points + 1):
+            point = [a + (b - a) * i / points for a, b in zip(self.position, target)]
+            if self.sim.isFirmwareProbeTriggered(point) == stop_when_triggered:
+                stop = point
+                break
+        if stop is None:
+            stop = target
+        self._plan(stop, self._limitSpeed(stop, self.feedrate), t)
+        self.busy_until = self.motionEnd()
+        message = "ok\n"
+        if stop is target and code in ('G38.2', 'G38.4'):
+            message = "Error:Failed to reach target\n" + message
+        self.reply(message, self.busy_until)
+
+
+class docker_emulator(emulated_device):
+    """
+    Docker servo. Closing it picks up a tool at the current gantry position;
+    opening releases the attached tool.
+    """
+    name = "docker"
+    welcome_message = DOCKER_WELCOME
+    angle = None
+
+    def handleCommand(self, cmd, t):
+        try:
+            self.angle = float(cmd)
+        except ValueError:
+            return
+        if self.angle >= DOCKER_CLOSED_ANGLE:
+            self.sim.dockTool(t)
+        else:
+            self.sim.undockTool(t)
+
+
+class tool_emulator(emulated_device):
+    """
+    Mobile tool, waiting at its docking point until picked up.
+
+    Inputs:
+        dock_position
+            Gantry coordinates x, y, z at which the tool is picked up.
+        tip_offset
+            Position of the tool tip relative to gantry coordinates, dx, dy, dz.
+    """
+    def __init__(self, dock_position, tip_offset=(0, 0, 0), name=None, welcome_message=None):
+        super().__init__(name=name, welcome_message=welcome_message)
+        self.dock_position = list(dock_position)
+        self.tip_offset = list(tip_offset)
+
+
+class touch_probe_emulator(tool_emulator):
+    """
+    Mobile touch probe. Answers "1" to "d" if its tip touches anything on the deck.
+    """
+    name = "mobile_touch_probe"
+    welcome_message = MOBILE_PROBE_WELCOME
+
+    def handleCommand(self, cmd, t):
+        if cmd == 'd':
+            self.reply("%d\r\n" % self.sim.isProbeTriggered(self, t), t)
+
+
+class stationary_probe_emulator(emulated_device):
+    """
+    Stationary touch probe. Answers "1" to "d" if the attached tool touches it.
+    """
+    name = "stationary_probe"
+    welcome_message = STATIONARY_PROBE_WELCOME
+
+    def __init__(self, obstacle, name=None, welcome_message=None):
+        super().__init__(name=name, welcome_message=welcome_message)
+        self.box = obstacle
+
+    def handleCommand(self, cmd, t):
+        if cmd == 'd':
+            self.reply("%d\r\n" % self.sim.isProbeTriggered(self, t), t)
+
+
+class pipettor_emulator(tool_emulator):
+    """
+    GRBL-driven pipettor. Plunger moves along X axis.
+    """
+    name = "pipettor"
+    welcome_message = GRBL_WELCOME
+    ignore_empty_lines = False
+
+    def __init__(self, dock_position, tip_offset=(0, 0, 0), name=None, welcome_message=None):
+        super().__init__(dock_position, tip_offset=tip_offset,
+                         name=name, welcome_message=welcome_message)
+        self.max_rate = GRBL_MAX_RATE
+        self.position = [0.0, 0.0, 0.0]
+        self.segments = []
+        self.homing_until = 0.0
+        self.state = 'Alarm'
+        self.servo_on = False
+
+    def onOpen(self, now):
+        # GRBL restarts, and is locked until homed or unlocked
+        self.state = 'Alarm'
+        super().onOpen(now)
+
+    def motionEnd(self):
+        if self.segments:
+            return self.segments[-1].end_time
+        return 0.0
+
+    def statusAt(self, t):
+        if t < self.homing_until:
+            return 'Home'
+        if t < self.motionEnd():
+            return 'Run'
+        return self.state
+
+    def feed(self, data, now):
+        # Status requests are answered at once, wherever they are in the stream
+        for i in range(data.count(b'?')):
+            self.commands_received += 1
+            self._reportStatus(now)
+        self.bytes_received += data.count(b'?')
+        super().feed(data.replace(b'?', b''), now)
+
+    def _reportStatus(self, t):
+        x = self.position[0]
+        for segment in self.segments:
+            if t < segment.end_time:
+                x = segment.positionAt(t)[0]
+                break
+        self.reply("<%s|MPos:%.3f,0.000,0.000|FS:0,0>\r\n" % (self.statusAt(t), x), t)
+
+    def handleCommand(self, cmd, t):
+        self.segments = [s for s in self.segments if s.end_time > t]
+        words = cmd.upper().split()
+        if not words:
+            self.reply("ok\r\n", t)
+        elif words[0] == '$X':
+            self.state = 'Idle'
+            self.reply("[MSG:Caution: Unlocked]\r\nok\r\n", t)
+        elif words[0] == '$H':
+            t = max(t, self.motionEnd())
+            duration = moveDuration(self.position[0], GRBL_HOMING_RATE / 60.0, GRBL_ACCELERATION)
+            self.homing_until = t + self.scaled(duration + HOMING_BUMP_TIME)
+            self.busy_until = self.homing_until
+            self.position = [0.0, 0.0, 0.0]
+            self.state = 'Idle'
+            self.reply("ok\r\n", self.busy_until)
+        elif words[0].startswith('$110='):
+            self.max_rate = float(words[0][5:])
+            self.reply("ok\r\n", t)
+        elif words[0] in ('G0', 'G1'):
+            if self.state == 'Alarm':
+                self.reply("error:9\r\n", t)
+                return
+            target = list(self.position)
+            for word in words[1:]:
+                if word[0] == 'X':
+                    target[0] = float(word[1:])
+            segment = move_segment(max(t, self.motionEnd()), self.position, target,
+                                   self.max_rate / 60.0, GRBL_ACCELERATION, self.sim.time_scale)
+            self.segments.append(segment)
+            self.position = target
+            self.reply("ok\r\n", t)
+        elif words[0] == 'G4':
+            if self.state == 'Alarm':
+                self.reply("error:9\r\n", t)
+                return
+            # Dwell starts after the movements finish, so "G4 P0" acknowledges their end
+            dwell = 0.0
+            for word in words[1:]:
+                if word[0] == 'P':
+                    dwell = float(word[1:])
+            self.busy_until = max(t, self.motionEnd()) + self.scaled(dwell)
+            self.reply("ok\r\n", self.busy_until)
+        elif words[0] in ('M3', 'M5'):
+            # Spindle (servo) commands wait for the movements to finish
+            self.busy_until = max(t, self.motionEnd())
+            self.servo_on = words[0] == 'M3'
+            self.reply("ok\r\n", self.busy_until)
+        else:
+            self.reply("ok\r\n", t)
+
+
+class gripper_emulator(tool_emulator):
+    """
+    Mobile gripper. Commands come without end of line.
+    """
+    name = "mobile_gripper"
+    welcome_message = GRIPPER_WELCOME
+    powered = False
+    angle = None
+
+    def handleCommand(self, cmd, t):
+        words = cmd.split()
+        if words[:2] == ['P', 'on']:
+            self.powered = True
+        elif words[:2] == ['P', 'off']:
+            self.powered = False
+        elif words[0] == 'G0' and len(words) > 1:
+            self.angle = float(words[1])
+        self.reply("ok\r\n", t)
+
+
+class simulator():
+    """
+    Runs emulated devices of the deck in a background thread.
+
+    Inputs:
+        deck
+            deck_model object; empty deck if not provided.
+        time_scale
+            Durations of all physical movements are multiplied by this number.
+            Communication delays are not.
+    """
+    def __init__(self, deck=None, time_scale=1.0):
+        if not hasattr(os, 'openpty'):
+            raise EnvironmentError('Simulator needs pseudo-terminals; unsupported platform')
+        if deck is None:
+            deck = deck_model()
+        self.deck = deck
+        self.time_scale = time_scale
+        self.marlin = marlin_emulator()
+        self.docker = docker_emulator()
+        self.attached_tool = None
+        self.events = []
+        self._event_counter = itertools.count()
+        self._stop_requested = threading.Event()
+        self.thread = None
+
+    @property
+    def devices(self):
+        return [self.marlin, self.docker] + self.deck.stationary_probes + self.deck.tools
+
+    @property
+    def cartesian_port(self):
+        return self.marlin.port_name
+
+    @property
+    def docker_port(self):
+        return self.docker.port_name
+
+    def start(self):
+        for device in self.devices:
+            device.sim = self
+            device.createPort()
+        # Tools appear only after docking
+        for device in [self.marlin, self.docker] + self.deck.stationary_probes:
+            llc.registerVirtualPort(device.port_name)
+        self._stop_requested.clear()
+        self.thread = threading.Thread(target=self._run, name="arnie simulator", daemon=True)
+        self.thread.start()
+        logging.info("Simulator started; cartesian port %s, docker port %s",
+                     self.cartesian_port, self.docker_port)
+
+    def stop(self):
+        self._stop_requested.set()
+        if self.thread is not None:
+            self.thread.join()
+        for device in self.devices:
+            llc.unregisterVirtualPort(device.port_name)
+            device.closePort()
+        self.attached_tool = None
+        logging.info("Simulator stopped.")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def stats(self):
+        """
+        Returns dictionary with number of commands each device received, etc.
+        round_trips is the total number of commands received.
+        """
+        devices = {device.name: device.stats() for device in self.devices}
+        return {'round_trips': sum(d['commands'] for d in devices.values()),
+                'devices': devices}
+
+    def resetStats(self):
+        for device in self.devices:
+            device.resetStats()
+
+    def schedule(self, device, t, text):
+        heapq.heappush(self.events, (t, next(self._event_counter), device, text.encode()))
+
+    # Deck interactions
+    # ===============================
+
+    def dockTool(self, t):
+        if self.attached_tool is not None:
+            return
+        position = self.marlin.positionAt(t)
+        for tool in self.deck.tools:
+            if math.dist(position, tool.dock_position) <= DOCK_TOLERANCE:
+                self.attached_tool = tool
+                llc.registerVirtualPort(tool.port_name)
+                logging.info("Simulator: tool %s docked at %s", tool.name, position)
+                return
+
+    def undockTool(self, t):
+        tool = self.attached_tool
+        if tool is None:
+            return
+        tool.dock_position = self.marlin.positionAt(t)
+        llc.unregisterVirtualPort(tool.port_name)
+        self.attached_tool = None
+        logging.info("Simulator: tool %s released at %s", tool.name, tool.dock_position)
+
+    def tipPosition(self, gantry_position):
+        if self.attached_tool is None:
+            return None
+        return [a + b for a, b in zip(gantry_position, self.attached_tool.tip_offset)]
+
+    def isProbeTriggered(self, probe, t, gantry_position=None):
+        """
+        Whether the touch probe (mobile or stationary) touches something.
+        """
+        if gantry_position is None:
+            gantry_position = self.marlin.positionAt(t)
+        tip = self.tipPosition(gantry_position)
+        if tip is None:
+            return False
+        if isinstance(probe, stationary_probe_emulator):
+            return probe.box.distance(tip) <= PROBE_TIP_RADIUS
+        return probe is self.attached_tool and self.deck.isTouchingAnything(tip)
+
+    def isFirmwareProbeTriggered(self, gantry_position):
+        """
+        Probe state for G38 moves: any of the probes touches something.
+        """
+        probes = self.deck.stationary_probes
+        if isinstance(self.attached_tool, touch_probe_emulator):
+            probes = probes + [self.attached_tool]
+        return any(self.isProbeTriggered(probe, None, gantry_position) for probe in probes)
+
+    # Main loop
+    # ===============================
+
+    def _run(self):
+        poller = select.poll()
+        fd_devices = {}
+        for device in self.devices:
+            poller.register(device.master_fd, select.POLLIN)
+            fd_devices[device.master_fd] = device
+
+        while not self._stop_requested.is_set():
+            now = time.monotonic()
+            # Port is closed by the host when its master end reports hang up
+            ready = dict(poller.poll(0))
+            for fd, device in fd_devices.items():
+                event = ready.get(fd, 0)
+                if event & select.POLLHUP:
+                    if device.is_open:
+                        device.is_open = False
+                        device.onClose(now)
+                    continue
+                if not device.is_open:
+                    device.is_open = True
+                    device.onOpen(now)
+                if event & select.POLLIN:
+                    try:
+                        data = os.read(fd, 4096)
+                    except OSError:
+                        continue
+                    device.feed(data, now)
+                device.flushIdleInput(now)
+
+            self._sendDueEvents(time.monotonic())
+            self._wait(fd_devices)
+
+    def _sendDueEvents(self, now):
+        while self.events and self.events[0][0] <= now:
+            t, counter, device, data = heapq.heappop(self.events)
+            # Output of a device is lost if nobody listens
+            if not device.is_open:
+                continue
+            try:
+                os.write(device.master_fd, data)
+                device.bytes_sent += len(data)
+            except OSError:
+                pass
+
+    def _wait(self, fd_devices):
+        now = time.monotonic()
+        timeout = MAX_SLEEP
+        if self.events:
+            timeout = min(timeout, self.events[0][0] - now)
+        open_fds = [fd for fd, device in fd_devices.items() if device.is_open]
+        if len(open_fds) < len(fd_devices):
+            timeout = min(timeout, OPEN_CHECK_INTERVAL)
+        if any(device.input_buffer for device in fd_devices.values()):
+            timeout = min(timeout, INPUT_IDLE_GAP)
+        timeout = max(timeout, 0)
+        if open_fds:
+            select.select(open_fds, [], [], timeout)
+        else:
+            time.sleep(timeout)
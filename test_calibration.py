@@ -8,10 +8,16 @@ import tools
 import racks
 import cartesian
 import calibration
+import test_utils
 
 
 class tool_test_case(unittest.TestCase):
     
+    def setUp(self):
+        # Every test starts with an empty deck store
+        test_utils.useMemoryDeckStore(self)
+
+
     @mock.patch('tools.stationary_touch_probe')
     @mock.patch('tools.mobile_touch_probe')
     @mock.patch('cartesian.arnie')
@@ -286,7 +292,10 @@ class tool_test_case(unittest.TestCase):
         x, y, z = calibration.calibrateToolCustomPoints(tool, stp)
         
         stp.findCenterOuter.assert_called_with(axis='y', 
-            raise_height=42, dist_through_obstruct=106.0, step_back_length=-3)
+            raise_height=42, dist_through_obstruct=106.0, step_back_length=-3, strategy=None)
+
+        calibration.calibrateToolCustomPoints(tool, stp, strategy='bisection')
+        stp.findWall.assert_called_with(axis='z', direction=1, strategy='bisection')
 
             
             
@@ -0,0 +1,123 @@
+import unittest
+import mock
+
+import cartesian
+
+# Other test modules replace cartesian.arnie with mocks
+arnie = cartesian.arnie
+
+
+class arnie_test_case(unittest.TestCase):
+
+    @mock.patch('cartesian.time.sleep')
+    @mock.patch('cartesian.llc.serial_device.readAll')
+    @mock.patch('cartesian.llc.serial.Serial')
+    def setUp(self, mock_serial, mock_readAll, mock_sleep):
+        mock_readAll.return_value = "Marlin"
+        self.ar = arnie('COM1', 'COM2')
+        self.ar.write = mock.MagicMock()
+        self.ar.readBufferUntilMatch = mock.MagicMock(return_value='ok\n')
+        self.ar.docker = mock.MagicMock()
+
+
+    def test_moveAxis__noStreaming__waitsForEveryMove(self):
+        self.ar.moveAxis('x', 10)
+        self.ar.moveAxis('x', 20)
+        self.assertEqual(self.ar.write.call_count, 2)
+        self.assertEqual(self.ar.readBufferUntilMatch.call_count, 2)
+
+
+    def test_moveAxis__streaming__keepsCommandsInFlight(self):
+        self.ar.setStreaming(2)
+        self.ar.moveAxis('x', 10)
+        self.ar.moveAxis('x', 20)
+        self.ar.readBufferUntilMatch.assert_not_called()
+        # Third command has to wait for "ok" of the first one
+        self.ar.moveAxis('x', 30)
+        self.assertEqual(self.ar.readBufferUntilMatch.call_count, 1)
+        self.assertEqual(self.ar.cmds_in_flight, 2)
+        self.ar.write.assert_called_with('G0 X30 F8000', flush=False)
+
+
+    def test_synchronize__waitsForAcksAndFinishedMoves(self):
+        self.ar.setStreaming(4)
+        self.ar.moveXY(10, 20)
+        self.ar.moveAxis('z', 30)
+        self.ar.synchronize()
+        self.assertEqual(self.ar.cmds_in_flight, 0)
+        # 2 streamed commands and M400
+        self.assertEqual(self.ar.readBufferUntilMatch.call_count, 3)
+        self.ar.write.assert_called_with('M400', None)
+        # Nothing new was streamed; no need to wait again
+        self.ar.synchronize()
+        self.assertEqual(self.ar.readBufferUntilMatch.call_count, 3)
+
+
+    @mock.patch('cartesian.time.sleep')
+    def test_closeTool__synchronizesFirst(self, mock_sleep):
+        with self.ar.streaming():
+            self.ar.moveAxis('z', 30)
+            self.ar.closeTool()
+            self.assertFalse(self.ar.moves_not_synchronized)
+        self.assertEqual(self.ar.max_cmds_in_flight, 0)
+
+
+    def test_getPosition__unknown__asksFirmware(self):
+        self.ar.readBufferUntilMatch.return_value = 'X:1.00 Y:2.00 Z:3.00 E:0.00 Count X:0 Y:0 Z:0\nok\n'
+        self.assertEqual(self.ar.getPosition(), (1.0, 2.0, 3.0))
+        self.ar.write.assert_called_with('M114', None)
+
+
+    def test_getPosition__afterMoves__noFirmwareRequest(self):
+        self.ar.readBufferUntilMatch.return_value = 'X:0.00 Y:0.00 Z:0.00 E:0.00\nok\n'
+        self.ar.home('ZXY')
+        self.ar.move(x=10, y=20, z=30)
+        self.ar.moveAxisDelta('x', 5)
+        self.ar.write.reset_mock()
+        self.assertEqual(self.ar.getPosition(), (15.0, 20.0, 30.0))
+        self.assertEqual(self.ar.getAxisPosition('y'), 20.0)
+        self.ar.write.assert_not_called()
+
+
+    def test_move_delta__usesTrackedPosition(self):
+        self.ar.tracked_position = [10.0, 20.0, 30.0]
+        self.ar.move_delta(dz=-5)
+        self.ar.write.assert_any_call('G0 Z25.0 F2500', None)
+        self.assertNotIn(mock.call('M114', None), self.ar.write.call_args_list)
+
+
+    def test_getPosition__checkInterval__verifiesWithFirmware(self):
+        self.ar.readBufferUntilMatch.return_value = 'X:10.50 Y:20.00 Z:30.00 E:0.00\nok\n'
+        self.ar.tracked_position = [10.0, 20.0, 30.0]
+        self.ar.position_check_interval = 2
+        self.assertEqual(self.ar.getPosition(), (10.0, 20.0, 30.0))
+        self.ar.write.assert_not_called()
+        self.assertEqual(self.ar.getPosition(), (10.5, 20.0, 30.0))
+        self.ar.write.assert_called_with('M114', None)
+
+
+    def test_verifyPosition__returnsDrift(self):
+        self.ar.readBufferUntilMatch.return_value = 'X:10.50 Y:20.00 Z:29.00 E:0.00\nok\n'
+        self.ar.tracked_position = [10.0, 20.0, 30.0]
+        self.assertEqual(self.ar.verifyPosition(), [0.5, 0.0, -1.0])
+        self.assertEqual(self.ar.tracked_position, [10.5, 20.0, 29.0])
+
+
+    def test_quickStop__readsStoppedPosition(self):
+        self.ar.moveAxis('x', 100, wait=False)
+        self.ar.readBufferUntilMatch.assert_not_called()
+        self.ar.readBufferUntilMatch.return_value = 'X:42.00 Y:20.00 Z:30.00 E:0.00\nok\n'
+        self.assertEqual(self.ar.quickStop(), (42.0, 20.0, 30.0))
+        self.ar.write.assert_any_call('M410', flush=False)
+        self.assertEqual(self.ar.cmds_in_flight, 0)
+        self.assertFalse(self.ar.moves_not_synchronized)
+
+
+    def test_probeMove__sendsG38(self):
+        self.ar.readBufferUntilMatch.return_value = 'X:10.00 Y:20.00 Z:31.20 E:0.00\nok\n'
+        self.assertEqual(self.ar.probeMove('z', 80, speed=500), 31.2)
+        self.ar.write.assert_any_call('G38.2 Z80 F500', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+
+import frames
+
+
+class frames_test_case(unittest.TestCase):
+
+    def test_pointToDeck__chainedFrames(self):
+        slot = frames.frame('slot', offset=(100, 200, 600))
+        rack = frames.frame('rack', offset=(5, -5, -50), parent=slot)
+        self.assertEqual(rack.pointToDeck(1, 2, 3), (106.0, 197.0, 553.0))
+
+
+    def test_toDeck__cachedUntilParentMoves(self):
+        slot = frames.frame('slot', offset=(100, 200, 600))
+        rack = frames.frame('rack', offset=(5, -5, -50), parent=slot)
+        matrix = rack.toDeck()
+        self.assertIs(rack.toDeck(), matrix)
+        # Same offset does not invalidate anything
+        slot.setOffset(100, 200, 600)
+        self.assertIs(rack.toDeck(), matrix)
+        slot.setOffset(110, 200, 600)
+        self.assertEqual(rack.pointToDeck(0, 0, 0), (115.0, 195.0, 550.0))
+
+
+    def test_relativeTo__movesBetweenFrames(self):
+        probe = frames.frame('probe', offset=(90, 66, 500))
+        tool = frames.frame('tool', offset=(91, 65, 400))
+        matrix = tool.relativeTo(probe)
+        self.assertIs(tool.relativeTo(probe), matrix)
+        points = frames.transformPoints(matrix, [[10, 10, 10], [20, 20, 20]])
+        np.testing.assert_allclose(points, [[11, 9, -90], [21, 19, -80]])
+        probe.setOffset(90, 66, 400)
+        np.testing.assert_allclose(frames.transformPoints(tool.relativeTo(probe), [0, 0, 0]), [[1, -1, 0]])
+
+
+    def test_toolFrame__followsToolCalibration(self):
+        class tool():
+            coord = [1, 2, 3]
+            def getStalagmyteCoord(self):
+                return self.coord
+        t = tool()
+        tool_frame = frames.toolFrame(t)
+        self.assertEqual(tool_frame.offset, (1, 2, 3))
+        t.coord = [1, 2, 13]
+        self.assertIs(frames.toolFrame(t), tool_frame)
+        self.assertEqual(tool_frame.offset, (1, 2, 13))
+        self.assertIsNone(frames.toolFrame(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
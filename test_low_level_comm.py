@@ -1,8 +1,14 @@
+import os
+import time
+import threading
 import unittest
 import mock
 from mock import patch
 import low_level_comm
 
+# Other test modules replace it with mocks
+readAll = low_level_comm.serial_device.readAll
+
 class tool_test_case(unittest.TestCase):
     
     @patch('low_level_comm.serial_device.readAll')
@@ -30,6 +36,126 @@ class tool_test_case(unittest.TestCase):
         mock_readAll.assert_called()
         self.assertEqual(dev.actual_welcome_message, 'Message')
 
+    def test_port_reader__splitsLines(self):
+        reader = low_level_comm.port_reader(mock.MagicMock())
+        reader._feed(b"ok\nX:10.00 Y:")
+        self.assertEqual(reader.lines.get_nowait(), "ok\n")
+        self.assertTrue(reader.lines.empty())
+        reader._feed(b"20.00\n")
+        self.assertEqual(reader.lines.get_nowait(), "X:10.00 Y:20.00\n")
+        # Read timeout passes incomplete line as it is
+        reader._feed(b"1")
+        reader._feed(b"")
+        self.assertEqual(reader.lines.get_nowait(), "1")
+
+    @patch('low_level_comm.serial.Serial')
+    def test_readAll__returnsReceivedLines(self, mock_serial):
+        with patch.object(low_level_comm.serial_device, 'readAll', return_value='Message'):
+            dev = low_level_comm.serial_device(port_name='COM1')
+        dev.reader.lines.put("1\r\n")
+        dev.reader.lines.put("ok\n")
+        self.assertEqual(dev.readAll(), "1\r\nok\n")
+        self.assertEqual(dev.readAll(delay=0), "")
+
+    @patch('low_level_comm.serial.Serial')
+    def test_readBufferUntilMatch(self, mock_serial):
+        with patch.object(low_level_comm.serial_device, 'readAll', return_value='Message'):
+            dev = low_level_comm.serial_device(port_name='COM1')
+        dev.reader.lines.put("X:1.00 Y:2.00 Z:3.00\n")
+        dev.reader.lines.put("ok\n")
+        self.assertEqual(dev.readBufferUntilMatch('ok\n'), "X:1.00 Y:2.00 Z:3.00\nok\n")
+
+    def test_trace__recordsWritesAndReads(self):
+        path = 'test_trace.arnietrace'
+        self.addCleanup(os.remove, path)
+        low_level_comm.startRecording(path)
+        try:
+            with patch('low_level_comm.serial.Serial'), \
+                    patch.object(low_level_comm.serial_device, 'readAll', return_value='Message'):
+                dev = low_level_comm.serial_device(port_name='COM1')
+            dev.write('M114')
+            low_level_comm.recordTraffic(low_level_comm.TRACE_READ, 'COM1', b'ok\n')
+            dev.close()
+        finally:
+            low_level_comm.stopRecording()
+        events = low_level_comm.readTrace(path)
+        self.assertEqual([(e[0], e[1], e[3]) for e in events], 
+                         [(low_level_comm.TRACE_OPEN, 'COM1', b''),
+                          (low_level_comm.TRACE_WRITE, 'COM1', b'M114\r'),
+                          (low_level_comm.TRACE_READ, 'COM1', b'ok\n'),
+                          (low_level_comm.TRACE_CLOSE, 'COM1', b'')])
+        summary = low_level_comm.summarizeTrace(path)
+        self.assertEqual(summary['COM1']['writes'], 1)
+        self.assertEqual(summary['COM1']['reads'], 1)
+
+    def test_replay__answersRecordedTraffic(self):
+        path = 'test_replay.arnietrace'
+        self.addCleanup(os.remove, path)
+        rec = low_level_comm.trace_recorder(path)
+        rec.record(low_level_comm.TRACE_PORTS_LIST, '', b'COM1\nCOM2')
+        rec.record(low_level_comm.TRACE_OPEN, 'COM1')
+        rec.record(low_level_comm.TRACE_READ, 'COM1', b'Marlin\n')
+        rec.record(low_level_comm.TRACE_WRITE, 'COM1', b'M114\r')
+        rec.record(low_level_comm.TRACE_READ, 'COM1', b'X:1.00 Y:2.00 Z:3.00\nok\n')
+        rec.record(low_level_comm.TRACE_CLOSE, 'COM1')
+        rec.close()
+        
+        replay = low_level_comm.startReplay(path, time_compression=10)
+        try:
+            self.assertEqual(low_level_comm.listSerialPorts(), ['COM1', 'COM2'])
+            with patch.object(low_level_comm.serial_device, 'readAll', readAll):
+                dev = low_level_comm.serial_device(port_name='COM1')
+            self.assertEqual(dev.actual_welcome_message, 'Marlin\n')
+            self.assertEqual(dev.writeAndWait('M114'), 'X:1.00 Y:2.00 Z:3.00\nok\n')
+            dev.close()
+        finally:
+            low_level_comm.stopReplay()
+        self.assertEqual(replay.mismatches(), 0)
+
+    def _comports(self):
+        usb = mock.MagicMock(device='/dev/ttyUSB0', vid=0x1A86, pid=0x7523, serial_number='A1')
+        acm = mock.MagicMock(device='/dev/ttyACM0', vid=0x2341, pid=0x0043, serial_number='B2')
+        builtin = mock.MagicMock(device='/dev/ttyS0', vid=None, pid=None, serial_number=None)
+        return [usb, acm, builtin]
+
+    def test_listSerialPorts__usbOnly(self):
+        with patch('low_level_comm.serial.tools.list_ports.comports', return_value=self._comports()):
+            self.assertEqual(low_level_comm.listSerialPorts(), ['/dev/ttyUSB0', '/dev/ttyACM0'])
+            self.assertEqual(len(low_level_comm.listSerialPorts(usb_only=False)), 3)
+            self.assertEqual(low_level_comm.usbIdentities()['/dev/ttyUSB0'], '1A86:7523:A1')
+
+    @patch('low_level_comm.readWelcomeMessage')
+    def test_matchPortsWithDevices__knownDevicesNotOpened(self, mock_readWelcomeMessage):
+        path = 'test_serial_ports.json'
+        self.addCleanup(low_level_comm.clearPortCache, path)
+        low_level_comm.savePortCache({'1A86:7523:A1': 'Marlin 1.1.9\n'}, path)
+        mock_readWelcomeMessage.return_value = 'Pipettor p200\n'
+        ports = ['/dev/ttyUSB0', '/dev/ttyACM0']
+        with patch('low_level_comm.serial.tools.list_ports.comports', return_value=self._comports()), \
+                patch('low_level_comm.PORT_CACHE_FILE', path):
+            result = low_level_comm.matchPortsWithDevices(ports, {'arnie': 'Marlin', 'p200': 'p200'})
+            self.assertEqual(result, {'arnie': '/dev/ttyUSB0', 'p200': '/dev/ttyACM0'})
+            mock_readWelcomeMessage.assert_called_once_with('/dev/ttyACM0')
+            # Now both devices are known
+            mock_readWelcomeMessage.reset_mock()
+            result = low_level_comm.matchPortsWithDevices(ports, {'arnie': 'Marlin', 'p200': 'p200'})
+            self.assertEqual(len(result), 2)
+            mock_readWelcomeMessage.assert_not_called()
+
+    @patch('low_level_comm.serial.tools.list_ports.comports', return_value=[])
+    def test_port_watcher__reportsAppearedPort(self, mock_comports):
+        low_level_comm.registerVirtualPort('/dev/pts/101')
+        self.addCleanup(low_level_comm.unregisterVirtualPort, '/dev/pts/101')
+        self.addCleanup(low_level_comm.unregisterVirtualPort, '/dev/pts/102')
+        with low_level_comm.port_watcher(poll_interval=10) as watcher:
+            self.assertIsNone(watcher.waitForNewPort(timeout=0.05))
+            timer = threading.Timer(0.05, low_level_comm.registerVirtualPort, ['/dev/pts/102'])
+            timer.start()
+            start = time.monotonic()
+            self.assertEqual(watcher.waitForNewPort(timeout=5), '/dev/pts/102')
+            # Woken up by the port registration, not by polling
+            self.assertLess(time.monotonic() - start, 1)
+
     
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import mock
+
+import param
+import test_utils
+
+
+def slotData(x, y, z):
+    return {'LT': [x - 10, y - 10], 'RB': [x + 10, y + 10],
+            'LB': [x - 10, y + 10], 'RT': [x + 10, y - 10], 'floor_z': z}
+
+
+class floor_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.path = 'test_floor.json'
+        self.writeFloor(600)
+        self.addCleanup(os.remove, self.path)
+        self.addCleanup(param.floors.clear)
+
+
+    def writeFloor(self, z):
+        slots = [[slotData(100 * n_x, 100 * n_y, z) for n_y in range(4)] for n_x in range(6)]
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({'slots': slots}))
+
+
+    def test_getSlotCenter(self):
+        self.assertEqual(param.getSlotCenter(2, 3, floor_calibr_file=self.path), [200, 300, 600])
+        self.assertEqual(param.calcSquareSlotCenterFromVertices(2, 3, floor_calibr_file=self.path), [200, 300])
+        self.assertEqual(param.getSlotZ(2, 3, floor_calibr_file=self.path), 600)
+
+
+    def test_getSlotCenter__fileReadOnce(self):
+        with mock.patch('param.loadData', wraps=param.loadData) as mock_loadData:
+            for i in range(5):
+                param.getSlotCenter(1, 1, floor_calibr_file=self.path)
+                param.getSlotZ(1, 1, floor_calibr_file=self.path)
+        self.assertEqual(mock_loadData.call_count, 1)
+
+
+    def test_getSlotCenter__fileModified__reloads(self):
+        self.assertEqual(param.getSlotZ(0, 0, floor_calibr_file=self.path), 600)
+        self.writeFloor(610.5)
+        self.assertEqual(param.getSlotZ(0, 0, floor_calibr_file=self.path), 610.5)
+
+
+    def test_getSlotCalibrationData__customData(self):
+        slots = [[slotData(10, 20, 30)]]
+        self.assertEqual(param.getSlotCenter(0, 0, slots_data=slots), [10, 20, 30])
+
+
+class config_registry_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.writeConfig(50)
+        with open(os.path.join(self.dir, 'tube_params.json'), 'w') as f:
+            f.write(json.dumps({'volume_vs_z': {'0': 40, '1000': 5}, 'list': [1, 2]}))
+
+
+    def writeConfig(self, height):
+        with open(os.path.join(self.dir, 'tube.ini'), 'w') as f:
+            f.write("[geometry]\nlength = %s\n[properties]\nparams = tube_params.json\n" % height)
+
+
+    def test_getConfig__parsedOnceAndShared(self):
+        registry = param.config_registry(self.dir)
+        config = registry.getConfig('tube')
+        self.assertIs(registry.getConfig('tube'), config)
+        self.assertEqual(config['geometry']['length'], '50')
+        self.assertEqual(config.getFloat('geometry', 'length'), 50.0)
+        self.assertEqual(config.getFloat('geometry', 'width', default=3), 3)
+        self.assertRaises(KeyError, config.getFloat, 'geometry', 'width')
+        self.assertRaises(KeyError, lambda: config['wells'])
+        with self.assertRaises(TypeError):
+            config['geometry']['length'] = '10'
+
+
+    def test_getConfig__mixedCaseOptions(self):
+        with open(os.path.join(self.dir, 'gripper.ini'), 'w') as f:
+            f.write("[calibration]\nx_position_for_X_axis_calibration_frontal = -30\n")
+        config = param.config_registry(self.dir).getConfig('gripper')
+        self.assertEqual(config['calibration']['x_position_for_X_axis_calibration_frontal'], '-30')
+        self.assertEqual(config['calibration']['x_position_for_x_axis_calibration_frontal'], '-30')
+        self.assertIn('x_position_for_X_axis_calibration_frontal', config['calibration'])
+        self.assertEqual(config.getFloat('calibration', 'X_position_for_X_axis_calibration_frontal'), -30)
+
+
+    def test_getConfig__checkModified__reloads(self):
+        registry = param.config_registry(self.dir)
+        self.assertEqual(registry.getConfig('tube').getFloat('geometry', 'length'), 50)
+        self.writeConfig(60)
+        os.utime(os.path.join(self.dir, 'tube.ini'), ns=(0, 10**9))
+        # Not checked by default
+        self.assertEqual(registry.getConfig('tube').getFloat('geometry', 'length'), 50)
+        registry.check_modified = True
+        self.assertEqual(registry.getConfig('tube').getFloat('geometry', 'length'), 60)
+
+
+    def test_getParams__readOnly(self):
+        registry = param.config_registry(self.dir)
+        params = registry.getParams('tube_params.json')
+        self.assertIs(registry.getParams('tube_params.json'), params)
+        self.assertEqual(params['volume_vs_z']['1000'], 5)
+        self.assertEqual(params['list'], (1, 2))
+        with self.assertRaises(TypeError):
+            params['volume_vs_z']['0'] = 10
+
+
+class deck_store_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.store = test_utils.useMemoryDeckStore(self)
+
+
+    def test_find__byTypeAndSlot(self):
+        self.store.save(param.STORE_RACK, 'tips_1', {'name': 'tips_1', 'type': 'p200_tips', 'n_x': 1, 'n_y': 2})
+        self.store.save(param.STORE_RACK, 'tips_2', {'name': 'tips_2', 'type': 'p200_tips', 'n_x': 3, 'n_y': 0})
+        self.store.save(param.STORE_TOOL, 'p200', {'name': 'p200', 'type': 'p200_tips'})
+        self.assertEqual([d['name'] for d in self.store.find(param.STORE_RACK, item_type='p200_tips')], 
+                         ['tips_1', 'tips_2'])
+        self.assertEqual([d['name'] for d in self.store.find(slot=(3, 0))], ['tips_2'])
+        self.assertEqual(self.store.load(param.STORE_TOOL, 'p200'), {'name': 'p200', 'type': 'p200_tips'})
+        self.assertIsNone(self.store.load(param.STORE_RACK, 'p200'))
+
+
+    def test_batch__rolledBackOnError(self):
+        self.store.save(param.STORE_RACK, 'r', {'position': [1, 2, 3]})
+        with self.assertRaises(RuntimeError):
+            with self.store.batch():
+                self.store.save(param.STORE_RACK, 'r', {'position': [4, 5, 6]})
+                self.store.save(param.STORE_RACK, 'r2', {})
+                raise RuntimeError()
+        self.assertEqual(self.store.load(param.STORE_RACK, 'r'), {'position': [1, 2, 3]})
+        self.assertIsNone(self.store.load(param.STORE_RACK, 'r2'))
+        self.assertEqual(len(self.store.history(param.STORE_RACK, 'r')), 1)
+
+
+    def test_saveTool__legacyFileImported(self):
+        path = 'test_tools_legacy.json'
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as f:
+            f.write(json.dumps([{'type': 'p200', 'n_x': 0, 'n_y': 1, 'position': [1, 2, 3]},
+                                {'type': 'gripper', 'n_x': 2, 'n_y': 1, 'position': [4, 5, 6]}]))
+        self.assertEqual(param.getToolDockingPoint(toolname='gripper', tool_file=path), [4, 5, 6])
+        param.saveTool({'type': 'p1000', 'n_x': 0, 'n_y': 1, 'position': [7, 8, 9]}, slot=(0, 1), tool_file=path)
+        param.saveToolEndPoint(10, 11, 12, toolname='gripper', tool_file=path)
+        
+        self.assertEqual([tool['type'] for tool in self.store.find(path)], ['p1000', 'gripper'])
+        self.assertEqual(param.getToolDockingPoint(slot=(0, 1), tool_file=path), [7, 8, 9])
+        self.assertEqual(param.getToolEndPoint(toolname='gripper', tool_file=path), [10, 11, 12])
+        # The file itself is left untouched, without backups
+        with open(path) as f:
+            self.assertEqual(len(json.loads(f.read())), 2)
+        self.assertEqual([f for f in os.listdir('.') if f.endswith('test_tools_legacy.json')], [path])
+
+
+    def test_toolRegistry__loadedOnceAndKeptCoherent(self):
+        tools_data = [{'type': 'p200', 'n_x': 0, 'n_y': 1, 'position': [1, 2, 3], 'tip': [0, 0, 0]}]
+        param.saveTool(tools_data[0], toolname='p200')
+        with mock.patch('param.loadData') as mock_loadData, \
+             mock.patch.object(self.store, 'find', wraps=self.store.find) as mock_find:
+            for i in range(5):
+                self.assertEqual(param.getToolDockingPoint(toolname='p200'), [1, 2, 3])
+                self.assertEqual(param.getToolBySlot(0, 1)['type'], 'p200')
+        mock_loadData.assert_not_called()
+        mock_find.assert_not_called()
+        
+        # Tool moved to another slot
+        param.saveTool({'type': 'p200', 'n_x': 2, 'n_y': 3, 'position': [4, 5, 6]}, toolname='p200')
+        self.assertIsNone(param.getToolBySlot(0, 1))
+        self.assertEqual(param.getToolDockingPoint(slot=(2, 3)), [4, 5, 6])
+        param.saveToolEndPoint(7, 8, 9, slot=(2, 3))
+        self.assertEqual(param.getToolEndPoint(toolname='p200'), [7, 8, 9])
+        # Reloaded from the store
+        param.tool_registries.clear()
+        self.assertEqual(param.getToolByName('p200'), {'type': 'p200', 'n_x': 2, 'n_y': 3, 
+                                                       'position': [4, 5, 6], 'tip': [7, 8, 9]})
+
+
+
+    def test_saveToolsData__keyedByTypeOrSlot(self):
+        tools_data = [{'type': 'p200', 'n_x': 0, 'n_y': 1, 'position': [1, 2, 3]},
+                      {'n_x': 2, 'n_y': 1, 'position': [4, 5, 6]}]
+        param.saveToolsData(tools_data)
+        self.assertEqual(self.store.load(param.DEFAULT_TOOL_CALIBR_FILE, 'slot 2, 1'), tools_data[1])
+        self.assertEqual(param.getToolDockingPoint(slot=(2, 1)), [4, 5, 6])
+        
+        # Changes are found without reading the store back
+        tools_data[1]['position'] = [7, 8, 9]
+        with mock.patch.object(self.store, 'find') as mock_find, \
+             mock.patch.object(self.store, 'save', wraps=self.store.save) as mock_save:
+            param.saveToolsData(tools_data)
+        mock_find.assert_not_called()
+        mock_save.assert_called_once_with(param.DEFAULT_TOOL_CALIBR_FILE, 'slot 2, 1', tools_data[1])
+        
+        # Duplicates are rejected and nothing is saved
+        duplicated = tools_data + [{'type': 'p200', 'n_x': 3, 'n_y': 1, 'position': [0, 0, 0]}]
+        self.assertRaises(ValueError, param.saveToolsData, duplicated)
+        self.assertRaises(ValueError, param.saveToolsData, [{'position': [0, 0, 0]}])
+        param.tool_registries.clear()
+        self.assertEqual(param.loadToolsData(), tools_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import numpy as np
+
+import planning
+
+
+class planning_test_case(unittest.TestCase):
+
+    def test_refillGroups__sameAsDistributeLiquid(self):
+        self.assertEqual(planning.refillGroups([60, 30, 20, 50, 40], 100), [[0, 1], [2, 3], [4]])
+        # The last refill takes only the remaining volume
+        self.assertEqual(planning.refillGroups([50, 50, 30, 30], 100), [[0, 1], [2, 3]])
+        self.assertRaises(ValueError, planning.refillGroups, [150], 100)
+
+
+    def test_twoOpt__removesCrossing(self):
+        points = [[0, 0], [10, 10], [10, 0], [0, 10]]
+        distances = planning.distanceMatrix(points)
+        # 0 -> 1 -> 2 -> 3 -> 0 crosses itself
+        self.assertEqual(planning.twoOpt([1, 2, 3], distances, 0, end=0), [2, 1, 3])
+        self.assertEqual(planning.twoOpt([2, 1], distances, 0), [2, 1])
+        self.assertEqual(planning.nearestNeighbourOrder(distances, 0, [1, 2, 3]), [2, 1, 3])
+
+
+    def test_planDistribution__rasterPlate(self):
+        # 384 well plate, column by column, as plate.samples_list
+        points = [[51.75 + 4.5 * col, 33.75 + 4.5 * row] for col in range(24) for row in range(16)]
+        rng = np.random.RandomState(0)
+        volumes = list(rng.choice([5, 10, 20], size=len(points)))
+        plan = planning.planDistribution([0, 150], points, volumes, 200)
+        self.assertEqual(sorted(plan.order), list(range(384)))
+        self.assertGreater(plan.savings, 0)
+        self.assertLess(plan.length, plan.original_length)
+        # Trips are the ones distributeLiquid() will do
+        ordered_volumes = [volumes[i] for i in plan.order]
+        trips = planning.refillGroups(ordered_volumes, 200)
+        self.assertEqual([[plan.order[k] for k in trip] for trip in trips], plan.groups)
+        self.assertTrue(all(sum(volumes[i] for i in group) <= 200 for group in plan.groups))
+
+
+    def test_planDistribution__keepsOrderIfNotShorter(self):
+        plan = planning.planDistribution([0, 0], [[1, 0], [2, 0], [3, 0]], [10, 10, 10], 100)
+        self.assertEqual(plan.order, [0, 1, 2])
+        self.assertEqual(plan.savings, 0)
+        self.assertEqual(plan.length, 3)
+        self.assertRaises(ValueError, planning.planDistribution, [0, 0], [[1, 0]], [10, 10], 100)
+
+
+    def test_splitRoute__shortestTravel(self):
+        points = [[1, 0], [2, 0], [3, 0], [4, 0]]
+        distances = planning.distanceMatrix(points + [[0, 0]])
+        # Filling the tip in order gives [60], [50, 30], [60], 12 mm of travel;
+        # the farthest destinations together save the way back
+        trips = planning.splitRoute([0, 1, 2, 3], [60, 50, 30, 60], 100, distances, 4, refill_cost=0)
+        self.assertEqual(trips, [[0], [1], [2, 3]])
+        # Refills are expensive: fewest trips
+        trips = planning.splitRoute([0, 1, 2, 3], [30, 30, 30, 30], 100, distances, 4, refill_cost=100)
+        self.assertEqual(trips, [[0], [1, 2, 3]])
+        self.assertEqual(planning.splitRoute([], [], 100, distances, 4, 0), [])
+
+
+    def test_planRefills__mixedVolumes(self):
+        points = [[51.75 + 4.5 * col, 33.75 + 4.5 * row] for col in range(12) for row in range(8)]
+        rng = np.random.RandomState(1)
+        volumes = list(rng.choice([10, 40, 70, 120], size=len(points)))
+        plan = planning.planRefills([0, 100], points, volumes, 190, original_capacity=200)
+        self.assertEqual(sorted(sum(plan.batches, [])), list(range(96)))
+        self.assertTrue(all(volume <= 190 for volume in plan.batch_volumes))
+        self.assertEqual(plan.batch_volumes[0], sum(volumes[i] for i in plan.batches[0]))
+        self.assertGreaterEqual(plan.refills, int(np.ceil(sum(volumes) / 190.)))
+        self.assertLess(plan.refills, plan.original_refills)
+        self.assertLess(plan.duration, plan.original_duration)
+        self.assertIn("Refills: %d" % plan.refills, plan.report())
+        self.assertRaises(ValueError, planning.planRefills, [0, 0], [[1, 0]], [200], 190)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import time
+import unittest
+import mock
+
+import protocol
+
+
+def sleeper(duration, log=None, label=None):
+    def function(*args, **kwargs):
+        if log is not None:
+            log.append(('start', label))
+        time.sleep(duration)
+        if log is not None:
+            log.append(('finish', label))
+    return function
+
+
+class protocol_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.robot = mock.MagicMock()
+        self.pipettor = mock.MagicMock()
+        self.pipettor.tool_name = 'p1000'
+        self.gripper = mock.MagicMock()
+        self.gripper.tool_name = 'gripper'
+        self.prot = protocol.protocol(self.robot)
+
+
+    def test_add__dependsOnPreviousActionOfSameResource(self):
+        travel = self.prot.move(x=100, y=100)
+        home = self.prot.homePipettor(self.pipettor)
+        uptake = self.prot.uptakeLiquid(self.pipettor, 'tube', 500)
+        grip = self.prot.operateGripper(self.gripper, 30, after=[home])
+        self.assertEqual(home.depends_on, [])
+        self.assertEqual(set(uptake.depends_on), {travel, home})
+        self.assertEqual(grip.depends_on, [home])
+        self.assertRaises(ValueError, self.prot.add, print, after=[protocol.action('x', print)])
+
+
+    def test_run__devicesOverlap(self):
+        log = []
+        self.robot.move.side_effect = sleeper(0.2, log, 'travel')
+        self.pipettor.home.side_effect = sleeper(0.2, log, 'home')
+        self.pipettor.uptakeLiquid.side_effect = sleeper(0.05, log, 'uptake')
+        self.prot.move(x=100, y=100)
+        self.prot.homePipettor(self.pipettor)
+        self.prot.uptakeLiquid(self.pipettor, 'tube', 500, uptake_delay=1)
+
+        run_time = self.prot.run()
+        self.assertLess(run_time, 0.4)
+        self.assertEqual(set(log[:2]), {('start', 'travel'), ('start', 'home')})
+        self.assertEqual(log[-2:], [('start', 'uptake'), ('finish', 'uptake')])
+        self.pipettor.uptakeLiquid.assert_called_once_with('tube', 500, uptake_delay=1)
+        # Tool-only actions do not wait for the gantry, but the tool is restored afterwards
+        self.assertIs(self.pipettor.synchronize_gantry, True)
+        self.robot.docker = mock.MagicMock()
+        self.prot.openTool()
+        self.prot.run()
+        self.robot.openTool.assert_called_once_with(delay=None, synchronize=False)
+
+
+    def test_run__failureStopsDependentActions(self):
+        self.robot.move.side_effect = RuntimeError("stuck")
+        self.prot.move(z=0)
+        grab = self.prot.grabSample(self.gripper, 'tube')
+        home = self.prot.homePipettor(self.pipettor)
+        self.assertRaises(RuntimeError, self.prot.run)
+        self.gripper.grabSample.assert_not_called()
+        self.assertTrue(home.finished)
+        self.assertFalse(grab.finished)
+
+        # Continues from the failed action
+        self.robot.move.side_effect = None
+        self.prot.run()
+        self.gripper.grabSample.assert_called_once_with('tube')
+        self.assertEqual(self.pipettor.home.call_count, 1)
+
+
+    def test_criticalPath(self):
+        travel = self.prot.add(print, resources=[self.robot], estimate=5)
+        home = self.prot.homePipettor(self.pipettor)
+        home.estimate = 2
+        grip = self.prot.add(print, resources=[self.gripper], after=[home], estimate=4)
+        uptake = self.prot.add(print, resources=[self.robot, self.pipettor], estimate=1)
+        self.assertEqual(self.prot.criticalPath(), [home, grip])
+        uptake.estimate = 3
+        self.assertEqual(self.prot.criticalPath(), [travel, uptake])
+        report = self.prot.report()
+        self.assertIn("  homePipettor", report)
+        self.assertIn("gantry, p1000", report)
+        self.assertIn("critical path: 8.00 s; sequential: 14.00 s", report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import mock
+import numpy as np
 import racks
 import os
 import json
@@ -8,9 +9,16 @@ import samples
 import cartesian
 import tools
 import low_level_comm as llc
+import param
+import test_utils
 
 class racks_test_case(unittest.TestCase):
     
+    def setUp(self):
+        # Every test starts with an empty deck store
+        test_utils.useMemoryDeckStore(self)
+
+
     def test_no_rack_data_file(self):
         path = 'p1000_tips.json'
         new_path = 'p1000_tips_temp.json'
@@ -193,6 +201,35 @@ class racks_test_case(unittest.TestCase):
         self.assertAlmostEqual(y2-y1, 7*8.89, 1)
 
 
+    def test_calcWellsGrid__cachedUntilCenterChanges(self):
+        p1000 = racks.rack(rack_name="p1000_1", 
+            rack_data={'n_x':0, 'n_y':2, 'type': 'p1000_tips', 'position': [100, 200, 600]})
+        grid = p1000.calcWellsGrid()
+        self.assertEqual(grid.shape, (12, 8, 2))
+        self.assertIs(p1000.calcWellsGrid(), grid)
+        x, y = p1000.calcWellXY(11, 7)
+        p1000.updateCalibratedRackCenter(110, 200, 600)
+        self.assertIsNot(p1000.calcWellsGrid(), grid)
+        self.assertAlmostEqual(p1000.calcWellXY(11, 7)[0], x + 10)
+
+
+    def test_calcWorkingPositions__sameAsSingleWell(self):
+        p1000 = racks.rack(rack_name="p1000_1", rack_data={'n_x':0, 'n_y':2, 'type': 'p1000_tips'})
+        p1000.updateCenter(x=100, y=200, z=600, x_btm_touch=90, y_btm_touch=66, z_btm_touch=500)
+        class tool():
+            def getStalagmyteCoord(self):
+                return [91, 65, 400]
+        wells = [(0, 0), (3, 5), (11, 7)]
+        positions = p1000.calcWorkingPositions(wells, tool=tool())
+        self.assertEqual(positions.shape, (3, 3))
+        all_positions = p1000.calcWorkingPositions(tool=tool())
+        self.assertEqual(all_positions.shape, (96, 3))
+        np.testing.assert_allclose(all_positions[8 * 3 + 5], positions[1])
+        for (col, row), position in zip(wells, positions):
+            for expected, value in zip(p1000.calcWorkingPosition(col, row, tool=tool()), position):
+                self.assertAlmostEqual(expected, value)
+
+
     def test_calcAbsoluteTopZ(self):
         p1000 = racks.rack(rack_name="p1000_1", rack_data={'n_x':0, 'n_y':2, 'type': 'p1000_tips'})
         p1000.max_height = 200
@@ -316,27 +353,25 @@ class racks_test_case(unittest.TestCase):
         self.assertEqual(p1000.rack_data['pos_stalagmyte'], [90, 66, 500])
 
     def test_saveTool(self):
-        path = 'p1000_1.json'
-        new_path = 'p1000_1_temp.json'
-        if os.path.exists(path):
-            os.rename(path, new_path)
-        
-        self.assertFalse(os.path.exists(path))
+        store = param.getDeckStore()
+        self.assertIsNone(store.load(param.STORE_RACK, 'p1000_1'))
         
         p1000 = racks.rack(rack_name="p1000_1", 
             rack_data={'n_x':0, 'n_y':2, 'type': 'p1000_tips', 'position': [100, 200, 600]})
         p1000.save()
         
-        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists('p1000_1.json'))
         
         p1000 = racks.rack(rack_name="p1000_1")
         self.assertEqual(p1000.rack_data, 
             {'name': "p1000_1", 'n_x':0, 'n_y':2, 'type': 'p1000_tips', 'position': [100, 200, 600]})
+        self.assertEqual(store.find(param.STORE_RACK, item_type='p1000_tips', slot=(0, 2)), [p1000.rack_data])
         
-        os.remove(path)
-        self.assertFalse(os.path.exists(path))
-        if os.path.exists(new_path):
-            os.rename(new_path, path)
+        # Previous calibration is kept in history
+        p1000.updateCalibratedRackCenter(101, 201, 601)
+        p1000.save()
+        history = store.history(param.STORE_RACK, 'p1000_1')
+        self.assertEqual([data['position'] for (t, data) in history], [[101, 201, 601], [100, 200, 600]])
         
 
     def test__getRelativeZCalibrationPoint(self):
@@ -809,6 +844,125 @@ class racks_test_case(unittest.TestCase):
             os.remove('BottomRackThatCannotBeNamed.json')
         except:
             pass
+
+class consumables_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.store = test_utils.useMemoryDeckStore(self)
+        self.name = 'ConsumablesThatCannotBeNamed'
+        self.addCleanup(self.remove, self.name + '.journal')
+
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def test_getNextConsumable__columnByColumn(self):
+        r = racks.consumables(rack_name=self.name, rack_type='test_rack')
+        r.replaceConsumables()
+        self.assertEqual(r.countReadyItems(), 384)
+        r.removeConsumableItems([(0, 0), [0, 2]])
+        self.assertEqual(r.getNextConsumable(), (0, 1))
+        self.assertEqual(r.getNextConsumable(), (0, 3))
+        self.assertFalse(r.isReady(0, 3))
+        self.assertEqual(r.reserveConsumables(3), [(0, 4), (0, 5), (0, 6)])
+        # Column 0 has no 16 ready tips any more
+        self.assertEqual(r.reserveConsumables(16, whole_column=True), [(1, row) for row in range(16)])
+        self.assertEqual(r.reserveConsumables(8, whole_column=True), [(0, row) for row in range(7, 15)])
+        self.assertEqual(r.countReadyItems(), 384 - 16 - 16 + 1)
+
+
+    def test_getNextConsumable__emptyRack(self):
+        r = racks.consumables(rack_name=self.name, rack_type='test_rack')
+        r.setItemsAsReady([(3, 4)])
+        self.assertEqual(r.getNextConsumable(), (3, 4))
+        self.assertIsNone(r.getNextConsumable())
+
+
+    def test_journal__restoredWithoutRewritingRackFile(self):
+        r = racks.consumables(rack_name=self.name, rack_type='test_rack')
+        r.replaceConsumables()
+        r.save()
+        with mock.patch.object(racks.rack, 'save') as mock_save:
+            for i in range(10):
+                r.getNextConsumable()
+        mock_save.assert_not_called()
+        self.assertTrue(os.path.exists(self.name + '.journal'))
+
+        r2 = racks.consumables(rack_name=self.name, rack_type='test_rack')
+        self.assertEqual(r2.getNextConsumable(), (0, 10))
+        r2.checkpoint()
+        self.assertFalse(os.path.exists(self.name + '.journal'))
+        self.assertEqual(len(self.store.load(param.STORE_RACK, self.name)['ready_items_list']), 384 - 11)
+        r3 = racks.consumables(rack_name=self.name, rack_type='test_rack')
+        self.assertEqual(r3.getNextConsumable(), (0, 11))
+
+
+    @mock.patch('racks.JOURNAL_CHECKPOINT_ENTRIES', 3)
+    def test_journal__checkpointAfterManyEntries(self):
+        r = racks.consumables(rack_name=self.name, rack_type='test_rack')
+        r.replaceConsumables()
+        with mock.patch.object(racks.rack, 'save') as mock_save:
+            for i in range(4):
+                r.getNextConsumable()
+        self.assertEqual(mock_save.call_count, 1)
+
+class tip_pool_test_case(unittest.TestCase):
+
+    def setUp(self):
+        test_utils.useMemoryDeckStore(self)
+        self.racks = []
+        for i, center in enumerate([(100, 100), (300, 100)]):
+            name = 'TipPoolRackThatCannotBeNamed-%d' % i
+            r = racks.consumables(rack_name=name, rack_type='test_rack')
+            r.updateCalibratedRackCenter(center[0], center[1], 500)
+            r.replaceConsumables()
+            self.racks.append(r)
+            self.addCleanup(self.remove, name + '.journal')
+        self.pool = racks.tip_pool('test_rack', self.racks)
+
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def test_getNextTip__nearestToPosition(self):
+        self.assertEqual(self.pool.countRemaining(), 768)
+        r, col, row = self.pool.getNextTip((400, 0))
+        self.assertIs(r, self.racks[1])
+        self.assertEqual((col, row), (23, 0))
+        self.assertFalse(r.isReady(23, 0))
+        self.assertEqual(self.pool.getNextTip(), (self.racks[0], 0, 0))
+        self.assertEqual(self.pool.countRemainingByRack(), 
+                         {'TipPoolRackThatCannotBeNamed-0': 383, 'TipPoolRackThatCannotBeNamed-1': 383})
+
+
+    def test_reserveTips__acrossRacks(self):
+        self.racks[0].removeConsumableItems(self.racks[0].getReadyItemsList()[2:])
+        items = self.pool.reserveTips([None, None, None, (100, 100)])
+        self.assertEqual(items[:3], [(self.racks[0], 0, 0), (self.racks[0], 0, 1), (self.racks[1], 0, 0)])
+        # Nearest remaining to the center of the first rack is at the left edge of the second one
+        self.assertEqual(items[3][:2], (self.racks[1], 0))
+        self.assertEqual(self.pool.countRemaining(), 382)
+        self.assertEqual(self.pool.reserveTips([None] * 383), [])
+        self.assertEqual(self.pool.countRemaining(), 382)
+        self.pool.releaseTips(items)
+        self.assertEqual(self.pool.countRemaining(), 386)
+
+
+    def test_pickUpNextTip__fromCurrentPosition(self):
+        tool = mock.MagicMock()
+        tool.robot.getPosition.return_value = (290, 100, 0)
+        self.assertIs(self.pool.pickUpNextTip(tool, raise_z=300)[0], self.racks[1])
+        args = tool.pickUpTip.call_args
+        self.assertIs(args[0][0], self.racks[1])
+        self.assertEqual(args[1], {'raise_z': 300})
         
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,163 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import mock
+import numpy as np
+
+import param
+import samples
+
+
+PLATE_CONFIG = """[wells]
+columns = 24
+rows = 16
+distance_between_columns = 4.5
+distance_between_rows = 4.5
+distance_center_to_1st_column = 51.75
+distance_center_to_1st_row = 33.75
+"""
+
+WELL_CONFIG = """[geometry]
+length = 11.5
+inner_diameter = 3.6
+[properties]
+params = test_plate_well_params.json
+"""
+
+
+class plate_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        with open(os.path.join(self.dir, 'test_plate.ini'), 'w') as f:
+            f.write(PLATE_CONFIG)
+        with open(os.path.join(self.dir, 'test_plate_well.ini'), 'w') as f:
+            f.write(WELL_CONFIG)
+        with open(os.path.join(self.dir, 'test_plate_well_params.json'), 'w') as f:
+            f.write(json.dumps({'volume_vs_z': {'0': 11, '120': 1}, 'sample_top_dz': {'test_rack': 2}}))
+        patcher = mock.patch('param.configs', param.config_registry(self.dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.plate = samples.plate('p', 'test_plate')
+
+
+    def test_getSample__wellsShareStateWithPlate(self):
+        s = self.plate.getSample(3, 5)
+        self.assertIs(self.plate.getSample(3, 5), s)
+        self.assertIsNone(self.plate.getSample(24, 0))
+        self.assertIsNone(self.plate.getSample(-1, 0))
+        self.assertEqual(s.sample_data['sample_name'], 'p_col_3_row_5')
+        self.assertEqual((s.sample_data['x_well'], s.sample_data['y_well']), (3, 5))
+        self.assertIs(s.params, self.plate.getSample(0, 0).params)
+        self.assertEqual(s.length, 11.5)
+        self.assertEqual(s.getMaxVolume(), 120)
+
+        s.setVolume(50)
+        s.addCap()
+        s.setSampleEngagedPosition(4)
+        self.assertEqual(self.plate.volumes[3, 5], 50)
+        self.assertTrue(self.plate.capped[3, 5])
+        self.assertEqual(self.plate.engaged_dz[3, 5], 4)
+        self.assertEqual(s.getVolume(), 50)
+        self.assertTrue(s.isCapped())
+        s.disengage()
+        self.assertIsNone(s.sample_engaged_dz)
+        self.assertEqual(self.plate.getSample(3, 4).getVolume(), 0)
+
+
+    def test_place__wellsFollowPlate(self):
+        rack = mock.MagicMock()
+        self.plate.place(rack)
+        self.assertIs(self.plate.getSample(10, 10).sample_data['rack'], rack)
+        self.assertEqual(len(self.plate.getAllSamples()), 384)
+        self.assertEqual([(s.column, s.row) for s in self.plate.samples_list[:3]], [(0, 0), (0, 1), (0, 2)])
+
+
+    def test_getSamplesByMask(self):
+        mask = np.zeros((16, 24), dtype=int)
+        mask[2, 7] = 1
+        mask[1, 12] = 1
+        selected = self.plate.getSamplesByMask(mask)
+        self.assertEqual([(s.column, s.row) for s in selected], [(12, 1), (7, 2)])
+        self.assertRaises(ValueError, self.plate.getSamplesByMask, mask.T)
+
+
+    def test_setVolumes(self):
+        mask = np.zeros((16, 24), dtype=bool)
+        mask[0, :] = True
+        self.plate.setVolumes(30)
+        self.plate.setVolumes(100, mask=mask)
+        self.assertEqual(self.plate.getSample(5, 0).getVolume(), 100)
+        self.assertEqual(self.plate.getSample(5, 1).getVolume(), 30)
+
+        volumes = np.arange(16 * 24, dtype=float).reshape(16, 24)
+        self.plate.setVolumes(volumes, mask=mask)
+        self.assertEqual(self.plate.getSample(5, 0).getVolume(), 5)
+        self.assertEqual(self.plate.getSample(5, 1).getVolume(), 30)
+        self.assertEqual(self.plate.getVolumes()[0, 5], 5)
+
+
+    def test_volumesToZ__wholePlate(self):
+        rack = mock.MagicMock()
+        rack.rack_data = {'type': 'test_rack'}
+        positions = np.zeros((384, 3))
+        positions[:, 2] = 500 + np.arange(384)
+        rack.calcWorkingPositions.return_value = positions
+        rack.calcWorkingPosition.return_value = positions[18]
+        self.plate.place(rack)
+        self.plate.setVolumes(60)
+        z = self.plate.volumesToZ(tool=None)
+        self.assertEqual(z.shape, (16, 24))
+        # Well column 1, row 2 is the 16 + 2 = 18th well of the rack
+        self.assertEqual(z[2, 1], 518 - 2 + 6)
+        self.assertEqual(self.plate.getSample(1, 2).sampleVolToZ(60, tool=None), z[2, 1])
+        self.assertEqual(self.plate.volumesToZ(None, volumes=np.full((16, 24), 120))[0, 0], 500 - 2 + 1)
+
+
+class volume_curve_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.vol_vs_z = {'0': 40, '10': 35, '100': 20, '1000': 5}
+
+
+    def test_depth__interpolatesBetweenNeighbours(self):
+        curve = samples.volume_curve(self.vol_vs_z)
+        self.assertEqual(curve.depth(10), 35)
+        self.assertEqual(curve.depth(55), 27.5)
+        # Extrapolated using the end points
+        self.assertAlmostEqual(curve.depth(1100), 5 - 15 / 9.)
+        self.assertEqual(curve.depth(-2), 41)
+        self.assertEqual(curve.max_volume, 1000)
+        np.testing.assert_allclose(curve.depth(np.array([[0, 10], [100, 550]])), [[40, 35], [20, 12.5]])
+
+
+    def test_volume__inverseOfDepth(self):
+        curve = samples.volume_curve(self.vol_vs_z)
+        volumes = np.array([0, 5, 10, 55, 100, 400, 1000])
+        np.testing.assert_allclose(curve.volume(curve.depth(volumes)), volumes)
+        self.assertEqual(curve.volume(27.5), 55)
+
+
+    def test_monotone__keepsCurveMonotone(self):
+        curve = samples.volume_curve(self.vol_vs_z, method=samples.INTERPOLATION_MONOTONE)
+        volumes = np.linspace(0, 1000, 2001)
+        depths = curve.depth(volumes)
+        self.assertTrue(np.all(np.diff(depths) <= 0))
+        self.assertEqual(curve.depth(100), 20)
+        self.assertAlmostEqual(curve.volume(curve.depth(300)), 300, delta=0.5)
+
+
+    def test_getVolumeCurve__compiledOnce(self):
+        params = {'volume_vs_z': self.vol_vs_z}
+        curve = samples.getVolumeCurve(params)
+        self.assertIs(samples.getVolumeCurve(params), curve)
+        self.assertIsNot(samples.getVolumeCurve(params, samples.INTERPOLATION_MONOTONE), curve)
+        params['volume_interpolation'] = samples.INTERPOLATION_MONOTONE
+        self.assertEqual(samples.getVolumeCurve(params).depth.method, samples.INTERPOLATION_MONOTONE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import unittest
+import mock
+
+import simulator
+import cartesian
+import tools
+import low_level_comm as llc
+import test_utils
+
+# Other test modules replace those with mocks
+arnie = cartesian.arnie
+Serial = llc.serial.Serial
+readAll = llc.serial_device.readAll
+pipettor_home = tools.pipettor.home
+
+
+class motion_test_case(unittest.TestCase):
+
+    def test_moveDuration__trapezoidAndTriangle(self):
+        # 100 mm at 100 mm/s with 1000 mm/s^2: 0.1 s accelerating, 0.9 s cruising, 0.1 s braking
+        self.assertAlmostEqual(simulator.moveDuration(100, 100, 1000), 1.1)
+        # Too short to reach full speed
+        self.assertAlmostEqual(simulator.moveDuration(1, 100, 1000), 2 * (0.001 ** 0.5))
+        self.assertEqual(simulator.moveDuration(0, 100, 1000), 0)
+
+
+    def test_travelledDistance(self):
+        self.assertAlmostEqual(simulator.travelledDistance(100, 100, 1000, 0.1), 5)
+        self.assertAlmostEqual(simulator.travelledDistance(100, 100, 1000, 0.55), 50)
+        self.assertAlmostEqual(simulator.travelledDistance(100, 100, 1000, 2), 100)
+
+
+    def test_box_distance(self):
+        b = simulator.box('rack', x=100, y=100, z=300, size_x=80, size_y=120, height=50)
+        self.assertEqual(b.distance([100, 100, 320]), 0)
+        self.assertEqual(b.distance([100, 35, 320]), 5)
+        self.assertEqual(b.distance([100, 100, 290]), 10)
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), "Simulator needs pseudo-terminals")
+@mock.patch('cartesian.OPEN_TOOL_DELAY', 0.05)
+@mock.patch('cartesian.CLOSE_TOOL_DELAY', 0.05)
+@mock.patch('cartesian.TOOL_CLAMP_DELAY', 0.05)
+@mock.patch.object(llc.serial_device, 'readAll', readAll)
+@mock.patch.object(llc.serial, 'Serial', Serial)
+@mock.patch.object(tools.pipettor, 'home', pipettor_home)
+class simulator_test_case(unittest.TestCase):
+
+    def setUp(self):
+        test_utils.useMemoryDeckStore(self)
+        self.deck = simulator.deck_model()
+        self.deck.addBox('rack', x=100, y=100, z=300, size_x=80, size_y=120, height=50)
+        self.probe = self.deck.addTool(simulator.touch_probe_emulator(dock_position=[20, 30, 250]))
+        self.deck.addTool(simulator.pipettor_emulator(dock_position=[200, 30, 250]))
+        self.sim = simulator.simulator(self.deck, time_scale=0.01)
+        self.sim.start()
+
+
+    def tearDown(self):
+        self.sim.stop()
+
+
+    def test_arnie__movesAndReportsPosition(self):
+        ar = arnie(self.sim.cartesian_port, self.sim.docker_port)
+        ar.home()
+        ar.move(x=50, y=60, z=10)
+        self.assertEqual(ar.getPosition(from_firmware=True), (50.0, 60.0, 10.0))
+        stats = self.sim.stats()
+        self.assertEqual(stats['devices']['marlin']['moves'], 2)
+        self.assertGreater(stats['round_trips'], 5)
+        ar.close()
+
+
+    def test_getToolAtCoord__probePortAppears(self):
+        ar = arnie(self.sim.cartesian_port, self.sim.docker_port)
+        self.assertNotIn(self.probe.port_name, llc.listSerialPorts())
+        device = ar.getToolAtCoord(20, 30, 250)
+        self.assertEqual(device.port_name, self.probe.port_name)
+        self.assertIn(self.probe.port_name, llc.listSerialPorts())
+
+        device.write('d')
+        self.assertEqual(device.readAll().strip(), '0')
+        # Moving probe into the rack
+        ar.move(x=100, y=100, z=300)
+        ar.synchronize()
+        device.write('d')
+        self.assertEqual(device.readAll().strip(), '1')
+        device.close()
+        ar.close()
+
+
+    @mock.patch('cartesian.TOOL_CONNECT_TIMEOUT', 0.2)
+    def test_getToolAtCoord__noTool__raisesAtSafeHeight(self):
+        ar = arnie(self.sim.cartesian_port, self.sim.docker_port)
+        self.assertRaises(RuntimeError, ar.getToolAtCoord, 100, 200, 250, z_init=5)
+        ar.synchronize()
+        self.assertEqual(ar.getPosition(from_firmware=True), (100.0, 200.0, 5.0))
+        ar.close()
+
+
+    def test_pipettor__movesAtDeviceSpeed(self):
+        ar = arnie(self.sim.cartesian_port, self.sim.docker_port)
+        device = ar.getToolAtCoord(200, 30, 250)
+        p = tools.pipettor(robot=ar, tool_name='p1000_tool', device=device)
+        p.movePlunger(-10)
+        # Movement is finished when the function returns
+        self.assertEqual(p.grbl.requestStatus(), {'state': 'Idle', 'position': (-10.0, 0.0, 0.0)})
+        future = p.sendCmdToPipette('G0 X-2', wait=False)
+        self.assertTrue(future.result(timeout=5).endswith('ok'))
+        self.assertEqual(p.grbl.requestStatus()['position'], (-2.0, 0.0, 0.0))
+        device.close()
+        ar.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
 import unittest
+import queue
+import threading
 import tools
 import os
 import json
@@ -8,10 +10,19 @@ import low_level_comm as llc
 import configparser
 import racks
 import calibration
+import test_utils
+
+# Some tests replace module functions with mocks
+approachUntilTouchContinuous = tools.approachUntilTouchContinuous
+findWall = tools.findWall
 
 
 class tool_test_case(unittest.TestCase):
     
+    def setUp(self):
+        # Every test starts with an empty deck store
+        test_utils.useMemoryDeckStore(self)
+
 
     @mock.patch('cartesian.arnie')
     @mock.patch('tools.llc.serial_device.readAll')
@@ -177,6 +188,35 @@ class tool_test_case(unittest.TestCase):
         self.assertEqual(tool_data, {'name': 'generic_tool', 'welcome_message': 'welcome'})
 
     
+    @mock.patch('cartesian.arnie')
+    @mock.patch('tools.llc.serial_device.readAll')
+    @mock.patch('tools.llc.serial.Serial') 
+    def test_mobile_tool_getToolFromSerialDev__returnedToolReattached(self, 
+                mock_serialdev, mock_readAll, mock_cartesian):
+        mock_readAll.return_value = "Welcome returned from the device"
+        ar = cartesian.arnie('COM1', 'COM2')
+        generic_tool = tools.mobile_tool.getToolFromSerialDev(robot=ar, 
+                device=llc.serial_device('COM3'), welcome_message='welcome', tool_name='generic_tool')
+        # Port opened at docking is not opened again
+        self.assertEqual(mock_serialdev.call_count, 1)
+        generic_tool.returnToolToCoord(50, 66, 450, z_init=0)
+        
+        with mock.patch('tools.racks.rack') as mock_rack:
+            same_tool = tools.mobile_tool.getToolFromSerialDev(robot=ar, 
+                    device=llc.serial_device('COM4'), welcome_message='welcome', tool_name='generic_tool')
+        self.assertIs(same_tool, generic_tool)
+        self.assertEqual(same_tool.port_name, 'COM4')
+        mock_rack.assert_not_called()
+        self.assertEqual(mock_serialdev.call_count, 2)
+        
+        # Other robot does not get tools of this one
+        generic_tool.returnToolToCoord(50, 66, 450, z_init=0)
+        other_tool = tools.mobile_tool.getToolFromSerialDev(robot=mock.MagicMock(), 
+                device=llc.serial_device('COM3'), welcome_message='welcome', tool_name='generic_tool')
+        self.assertIsNot(other_tool, generic_tool)
+        tools.connection_pool.clear()
+
+
     @mock.patch('cartesian.arnie')
     @mock.patch('tools.llc.serial_device.readAll')
     @mock.patch('tools.llc.serial.Serial') 
@@ -635,7 +675,85 @@ class tool_test_case(unittest.TestCase):
         self.assertEqual(x2, 51)
         self.assertEqual(y2, 69)
         self.assertEqual(z2, 420)
-        
+
+
+    @mock.patch('tools.llc.serial_device.readAll')
+    @mock.patch('tools.llc.serial.Serial')
+    @mock.patch('tools.pipettor.home')
+    def test__pipettor__overlapping__plungerMovesWhileTravelling(self, mock_home, mock_serialdev, mock_readAll):
+        mock_readAll.return_value = "Servo"
+        devices = mock.MagicMock()
+        p1000 = tools.pipettor(robot=devices.robot, com_port_number='COM3', tool_name='p1000_tool')
+        p1000.grbl = devices.grbl
+        devices.grbl.send.return_value.result.return_value = 'ok'
+        p1000.tip_attached = True
+        p1000.tool_data['volume_to_position_slope'] = -0.02
+        p1000.tool_data['volume_to_position_intercept'] = 0
+        devices.robot.getAxisPosition.return_value = 250
+        sample = mock.MagicMock()
+        sample.getSampleTopZ.return_value = 300
+        sample.getSampleCenterXY.return_value = (10, 20)
+        sample.getVolume.return_value = 1000
+        sample.getMaxVolume.return_value = 1500
+        sample.sampleVolToZ.return_value = 400
+
+        with p1000.overlapping():
+            p1000.uptakeLiquid(sample, 500)
+        calls = devices.mock_calls
+        plunger_down = calls.index(mock.call.grbl.send('G0 X-10.0', None))
+        travel = calls.index(mock.call.robot.move(x=10, y=20))
+        plunger_stopped = calls.index(mock.call.grbl.sync().result(None))
+        immerse = calls.index(mock.call.robot.move(z=400))
+        self.assertLess(plunger_down, travel)
+        self.assertLess(travel, plunger_stopped)
+        self.assertLess(plunger_stopped, immerse)
+        # Uptake starts when the gantry stops
+        self.assertEqual(calls[immerse + 1], mock.call.robot.synchronize())
+        self.assertEqual(calls[immerse + 2], mock.call.grbl.send('G0 X0.0', None))
+        self.assertFalse(p1000.overlap_plunger)
+
+
+    @mock.patch('tools.llc.serial_device.readAll')
+    @mock.patch('tools.llc.serial.Serial')
+    @mock.patch('tools.pipettor.home')
+    def test__pipettor__distributeLiquid__refillPlan(self, mock_home, mock_serialdev, mock_readAll):
+        mock_readAll.return_value = "Servo"
+        p1000 = tools.pipettor(robot=mock.MagicMock(), com_port_number='COM3', tool_name='p1000_tool')
+        p1000.max_allowed_vol = 100
+        p1000.plunger_slack_compensation_volume = 10
+        origin = mock.MagicMock()
+        origin.getSampleCenterXY.return_value = (0, 0)
+        destinations = [mock.MagicMock() for i in range(4)]
+        for i, sample in enumerate(destinations):
+            sample.getSampleCenterXY.return_value = (10 * (i + 1), 0)
+        volumes = [60, 50, 30, 60]
+
+        with mock.patch.object(p1000, 'uptakeLiquid') as mock_uptake, \
+             mock.patch.object(p1000, 'dispenseLiquid') as mock_dispense, \
+             mock.patch.object(p1000, 'touchWall'), mock.patch.object(p1000, 'movePlunger'), \
+             mock.patch.object(p1000, 'getToSample'):
+            # Filling the tip up to 100 whenever needed: 60 | 50, 30 | 60
+            p1000.distributeLiquid(origin, destinations, volumes)
+            self.assertEqual([c[1]['volume'] for c in mock_uptake.call_args_list], [110, 110, 70])
+            mock_uptake.reset_mock()
+            mock_dispense.reset_mock()
+
+            plan = p1000.planRefills(origin, destinations, volumes)
+            self.assertEqual(plan.original_refills, 3)
+            self.assertEqual(plan.refills, 3)
+            p1000.distributeLiquid(origin, destinations, volumes, refill_plan=plan)
+        self.assertEqual([c[1]['volume'] for c in mock_uptake.call_args_list],
+                         [v + 10 for v in plan.batch_volumes])
+        dispensed = [(c[1]['sample'], c[1]['volume']) for c in mock_dispense.call_args_list
+                     if c[1]['sample'] is not origin]
+        expected = []
+        for batch in plan.batches:
+            plunger = 10
+            for i in batch:
+                plunger += volumes[i]
+                expected.append((destinations[i], plunger))
+        self.assertEqual(dispensed, expected)
+
 
 # ======================================================================================
 # Mobile gripper tool
@@ -952,5 +1070,238 @@ class tool_test_case(unittest.TestCase):
         tp.robot.axisToCoordinates.assert_called_with(axis='x', value=3)
 
 
+    def test__approachUntilTouchContinuous__stopsOnTouch(self):
+        robot = mock.MagicMock()
+        robot.getAxisPosition.side_effect = [10, 10, 12.5]
+        robot.estimateMoveTime.return_value = 60
+        touch_function = mock.MagicMock(side_effect=[True, True, True, False, False])
+        
+        coord = approachUntilTouchContinuous(robot, touch_function, 'x', direction=-1, speed_xy=100)
+        
+        self.assertEqual(coord, 12.5)
+        robot.moveAxis.assert_called_once_with('x', 10 - tools.PROBE_MAX_TRAVEL, speed=100, wait=False)
+        robot.quickStop.assert_called_once_with()
+
+
+    def test__approachUntilTouchContinuous__limitExhausted(self):
+        robot = mock.MagicMock()
+        robot.getAxisPosition.return_value = 10
+        robot.estimateMoveTime.return_value = 0
+        touch_function = mock.MagicMock(return_value=True)
+        
+        # Approaching a wall which is not there: one move, then giving up
+        with mock.patch('tools.logging') as mock_logging:
+            approachUntilTouchContinuous(robot, touch_function, 'x', direction=1, 
+                                         speed_xy=100, max_travel_dist=6)
+        mock_logging.error.assert_called_once()
+        robot.moveAxis.assert_called_once_with('x', 16, speed=100, wait=False)
+        
+        # Retracting from a sticky wall: moving back, then trying again
+        robot.moveAxis.reset_mock()
+        # Probe is released by the second retraction
+        touch_function.side_effect = lambda: robot.moveAxis.call_count < 3
+        approachUntilTouchContinuous(robot, touch_function, 'x', direction=-1, 
+                                     speed_xy=100, max_travel_dist=6, unstick=True)
+        self.assertEqual(robot.moveAxis.call_args_list, 
+                         [mock.call('x', 4, speed=100, wait=False), mock.call('x', 10), 
+                          mock.call('x', 4, speed=100, wait=False)])
+
+
+    def test__approachUntilTouchFirmware__probeNeverTriggers(self):
+        position = {'x': 10.0}
+        robot = mock.MagicMock()
+        robot.getAxisPosition.side_effect = lambda axis: position[axis]
+        def move(axis, destination, **kwargs):
+            position[axis] = destination
+        robot.probeMove.side_effect = move
+        robot.moveAxis.side_effect = move
+        touch_function = mock.MagicMock(return_value=True)
+        
+        # Approach: a single movement within the limit
+        with mock.patch('tools.logging') as mock_logging:
+            coord = tools.approachUntilTouchFirmware(robot, touch_function, 'x', direction=1, 
+                                                     speed_xy=100, max_travel_dist=2)
+        mock_logging.error.assert_called_once()
+        self.assertEqual(coord, 12)
+        robot.probeMove.assert_called_once_with('x', 12, speed=100, away=False)
+        
+        # Retraction of a stuck probe: moving back and retrying a limited number of times
+        robot.probeMove.reset_mock()
+        position['x'] = 10.0
+        with mock.patch('tools.logging') as mock_logging:
+            coord = tools.approachUntilTouchFirmware(robot, touch_function, 'x', direction=-1, 
+                                                     speed_xy=100, max_travel_dist=2, 
+                                                     away=True, unstick=True)
+        mock_logging.error.assert_called_once()
+        self.assertEqual(coord, 8)
+        self.assertEqual(robot.probeMove.call_count, tools.PROBE_UNSTICK_ATTEMPTS + 1)
+        self.assertEqual(robot.moveAxis.call_count, tools.PROBE_UNSTICK_ATTEMPTS)
+        self.assertTrue(all(c == mock.call('x', 8, speed=100, away=True) 
+                            for c in robot.probeMove.call_args_list))
+        
+        # Retraction in continuous mode gives up as well
+        robot.moveAxis.reset_mock()
+        robot.estimateMoveTime.return_value = 0
+        with mock.patch('tools.PROBE_TIME_MARGIN', 0), mock.patch('tools.logging') as mock_logging:
+            tools.approachUntilTouchContinuous(robot, touch_function, 'x', direction=-1, 
+                                               speed_xy=100, max_travel_dist=2, unstick=True)
+        mock_logging.error.assert_called_once()
+        self.assertEqual(robot.moveAxis.call_count, 2 * tools.PROBE_UNSTICK_ATTEMPTS + 1)
+
+
+    @mock.patch('tools.approachUntilTouch')
+    @mock.patch('tools.approachUntilTouchContinuous')
+    def test__findWall__continuous__oneMovePerApproach(self, mock_continuous, mock_step):
+        tp = mock.MagicMock()
+        tp.robot.axisToCoordinates.return_value = [-3, 0, 0]
+        tp.step_dict = {
+                0: {'step_fwd': 3, 'speed_xy_fwd': 1000, 'speed_z_fwd':2000,
+                    'step_back': 3, 'speed_xy_back': 1000, 'speed_z_back':2000},
+                1: {'step_fwd': 0.2, 'speed_xy_fwd': 200, 'speed_z_fwd':1000,
+                    'step_back': 1, 'speed_xy_back': 500, 'speed_z_back':1000},
+            }
+        mock_continuous.return_value = 42
+        
+        coord = findWall(probe=tp, axis='x', direction=1, probing_mode='continuous')
+        
+        self.assertEqual(coord, 42)
+        mock_step.assert_not_called()
+        self.assertEqual(mock_continuous.call_count, 4)
+        # Last approach only has to cover the previous retraction
+        self.assertEqual(mock_continuous.call_args[1]['max_travel_dist'], 6)
+        self.assertEqual(mock_continuous.call_args[1]['direction'], 1)
+        self.assertFalse(mock_continuous.call_args[1].get('unstick', False))
+        self.assertTrue(mock_continuous.call_args_list[-2][1]['unstick'])
+        # Probe is asked while the gantry moves
+        tp.isTouched.return_value = True
+        mock_continuous.call_args_list[0][1]['touch_function']()
+        tp.isTouched.assert_called_with(synchronize=False)
+
+
+    def test__findWall__bisection__stopsAtResolution(self):
+        # Wall at x=7.3; probe touches it when gantry is at or beyond that coordinate
+        wall = 7.3
+        position = {'x': 0.0}
+        tp = mock.MagicMock()
+        tp.robot.getAxisPosition.side_effect = lambda axis: position[axis]
+        def moveAxis(axis, destination, speed=None):
+            position[axis] = destination
+        tp.robot.moveAxis.side_effect = moveAxis
+        tp.robot.axisToCoordinates.return_value = [-3, 0, 0]
+        tp.isTouched.side_effect = lambda synchronize=True: position['x'] >= wall
+        tp.isNotTouched.side_effect = lambda synchronize=True: position['x'] < wall
+        tp.search_dict = {'initial_step': 0.25, 'max_step': 1, 'resolution': 0.02, 
+                          'speed_xy': 250, 'speed_z': 1000}
+        
+        coord = findWall(probe=tp, axis='x', direction=1, strategy='bisection')
+        
+        self.assertGreaterEqual(coord, wall)
+        self.assertLessEqual(coord - wall, 0.02)
+        # Steps of 0.25, 0.5, then 1 mm bracket the wall between 6.75 and 7.75; then 6 halvings
+        self.assertEqual(tp.last_search_stats['probe_reads'], 1 + 9 + 6)
+        self.assertEqual(tp.robot.moveAxis.call_count, tp.last_search_stats['moves'] - 1)
+        
+        coord = findWall(probe=tp, axis='x', direction=1, strategy='bisection', resolution=0.2)
+        self.assertLessEqual(coord - wall, 0.2)
+
+
+class fake_grbl_port():
+    """
+    Stands for a serial_device connected to GRBL: records written commands,
+    answers are put into reader.lines by the test.
+    """
+    def __init__(self):
+        self.port_name = 'fake'
+        self.eol = '\r'
+        self.timeout = 0.01
+        self.reader = mock.MagicMock()
+        self.reader.lines = queue.Queue()
+        self.reader.is_alive.return_value = True
+        self.written = []
+    
+    def write(self, expression, eol=None, flush=True):
+        self.written.append(expression)
+    
+    def writeBytes(self, data):
+        self.written.append(data)
+        self.reader.lines.put('<Run|MPos:-5.000,0.000,0.000|FS:0,0>\r\n')
+
+
+class grbl_controller_test_case(unittest.TestCase):
+
+    def setUp(self):
+        self.port = fake_grbl_port()
+        self.grbl = tools.grbl_controller(self.port, rx_buffer_size=20)
+        self.addCleanup(self.grbl.stop)
+
+
+    def test_send__characterCounting(self):
+        # 9 characters with end of line each; third one does not fit into 20 bytes
+        futures = [self.grbl.send('G0 X-10'), self.grbl.send('G0 X-20')]
+        sender = threading.Thread(target=lambda: futures.append(self.grbl.send('G0 X-30')))
+        sender.start()
+        sender.join(0.1)
+        self.assertTrue(sender.is_alive())
+        self.assertEqual(self.port.written, ['G0 X-10', 'G0 X-20'])
+        
+        self.port.reader.lines.put('ok\r\n')
+        sender.join(1)
+        self.assertEqual(self.port.written, ['G0 X-10', 'G0 X-20', 'G0 X-30'])
+        self.assertEqual(futures[0].result(timeout=1), 'ok')
+        self.assertFalse(futures[1].done())
+        
+        self.port.reader.lines.put('[MSG:Check Door]\r\n')
+        self.port.reader.lines.put('error:9\r\n')
+        self.assertEqual(futures[1].result(timeout=1), '[MSG:Check Door]\nerror:9')
+
+
+    def pipettor(self):
+        # Pipettor talking to the fake port, without connecting to a device
+        p = tools.pipettor.__new__(tools.pipettor)
+        p.grbl = self.grbl
+        p.plunger_commands = []
+        p.waitForGantry = mock.MagicMock()
+        return p
+
+
+    def test_sendCmdToPipette__errorRaises(self):
+        p = self.pipettor()
+        self.port.reader.lines.put('error:2\r\n')
+        self.port.reader.lines.put('ok\r\n')
+        self.assertRaises(RuntimeError, p.sendCmdToPipette, 'G0 Xz')
+        self.assertEqual(self.port.written, ['G0 Xz', tools.GRBL_SYNC_CMD])
+        
+        self.port.reader.lines.put('ok\r\n')
+        self.port.reader.lines.put('ok\r\n')
+        future = p.sendCmdToPipette('G0 X-2', wait=False)
+        self.assertEqual(future.result(timeout=1), 'ok')
+        self.assertEqual(p.plunger_commands, [future])
+
+
+    def test_waitPlunger__errorOfEarlierCommandRaises(self):
+        p = self.pipettor()
+        for answer in ['error:2', 'ok', 'ok', 'ok']:
+            self.port.reader.lines.put(answer + '\r\n')
+        p.sendCmdToPipette('G0 Xbad', wait=False)
+        p.sendCmdToPipette('G0 X-2', wait=False)
+        self.assertRaises(RuntimeError, p.waitPlunger)
+        self.assertEqual(p.plunger_commands, [])
+        
+        # Waiting command checks the overlapped ones first
+        for answer in ['error:2', 'ok']:
+            self.port.reader.lines.put(answer + '\r\n')
+        p.sendCmdToPipette('G0 Xbad', wait=False)
+        self.assertRaises(RuntimeError, p.sendCmdToPipette, 'G0 X0')
+        self.assertNotIn('G0 X0', self.port.written)
+
+
+    def test_requestStatus(self):
+        status = self.grbl.requestStatus()
+        self.assertEqual(status, {'state': 'Run', 'position': (-5.0, 0.0, 0.0)})
+        self.assertEqual(self.port.written, [b'?'])
+        self.assertEqual(tools.parseGrblStatus('<Idle,MPos:1.000,2.000,3.000,WPos:0.000,0.000,0.000>'),
+                         {'state': 'Idle', 'position': (1.0, 2.0, 3.0)})
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
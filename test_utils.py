@@ -0,0 +1,25 @@
+"""
+Helpers shared by the test modules.
+"""
+import mock
+
+import param
+
+
+def useMemoryDeckStore(test_case):
+    """
+    Replaces the default deck store with an empty one kept in memory 
+    until the end of the test.
+    
+    Inputs:
+        test_case
+            unittest.TestCase instance, usually called from its setUp()
+    
+    Returns:
+        The deck_store used instead.
+    """
+    store = param.deck_store(':memory:')
+    patcher = mock.patch.dict(param.deck_stores, {param.DEFAULT_DECK_STORE_FILE: store})
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    return store
@@ -3,20 +3,48 @@ Module handling tools for the robot, both mobile and floor-based
 """
 
 import logging
+import collections
+import contextlib
+from concurrent.futures import Future
 from copy import deepcopy
+import queue
 import re
+import threading
 import cartesian as cart    # TODO: Remove it when finishing refactoring.
 import json
-import configparser
 import time
 
 # Internal arnielib modules
 import low_level_comm as llc
 import param
+import planning
 import racks
 
 SPEED_Z_MOVING_DOWN = 4000 # Robot can move down much faster than up.
 
+# Probing modes for findWall and related functions:
+# 'step' - move by small steps, asking the probe after every step;
+# 'continuous' - one long move, stopped by the host as soon as the probe changes state;
+# 'firmware' - one long Marlin probe move (G38.2), needs the probe wired to the firmware.
+PROBING_MODES = ('step', 'continuous', 'firmware')
+# Longest distance (mm) to travel during one continuous approach, before 
+# asking the probe again.
+PROBE_MAX_TRAVEL = 100
+# Extra time (s) given to the continuous approach on top of the estimated movement time
+PROBE_TIME_MARGIN = 0.5
+# Times a stuck probe is moved back to the wall and retracted again, before giving up
+PROBE_UNSTICK_ATTEMPTS = 3
+# Ways to search for the wall coordinate; see findWall.
+SEARCH_STRATEGIES = ('staged', 'bisection')
+
+# GRBL (pipettor firmware) receive buffer, bytes. Commands are sent while 
+# the commands not yet acknowledged fit into it.
+GRBL_RX_BUFFER_SIZE = 128
+# Dwell of zero length; GRBL acknowledges it only after all previous movements are finished.
+GRBL_SYNC_CMD = "G4 P0"
+# Real time status request; answered with a status report, not acknowledged.
+GRBL_STATUS_REQUEST = b"?"
+
 default_slot = {
     "LT": [-1, -1], 
     "LB": [-1, -1], 
@@ -44,7 +72,7 @@ class tool(llc.serial_device):
     
     def __init__(self, robot, com_port_number=None, 
                  tool_name=None, tool_type=None, rack_name=None, rack_type=None,
-                 welcome_message=None, tool_data=None):
+                 welcome_message=None, tool_data=None, device=None):
         """
         Handles any general tool properties; that any tool will have.
         This class will rarely be used by itself, instead, it is
@@ -60,6 +88,8 @@ class tool(llc.serial_device):
                 It must contain this unique string, so the tool is identified.
             z_init
                 Safe height at which robot won't hit anything. Default is 0.
+            device
+                Already connected serial_device of this tool; the tool takes over its connection.
         """
         
         self.tool_data = tool_data
@@ -71,6 +101,9 @@ class tool(llc.serial_device):
 
         # Attempting to read data from HD
         if self.tool_data is None:
+            self.tool_data = param.getDeckStore().load(param.STORE_TOOL, tool_name)
+        if self.tool_data is None:
+            # Saved before the deck store was introduced
             self.tool_data = self.openFileWithToolParameters(tool_name+'.json')
 
         # Populating dictionary with current rack properties
@@ -88,9 +121,7 @@ class tool(llc.serial_device):
         # such as tool rack geometry and pickup instructions.
         # Tool only has information which relates to the tool itself, 
         # such as tool geometry.
-        self.config = configparser.ConfigParser()
-        config_path = 'configs/' + tool_type + '.ini'
-        self.config.read(config_path)
+        self.config = param.getConfig(tool_type)
         
         # How much longer the tool is compared to the mobile touch probe.
         # This setting to be used only for calibration purposes, 
@@ -147,6 +178,9 @@ class tool(llc.serial_device):
             self.tool_data['welcome_message'] = welcome_message
             
         
+        if device is not None:
+            com_port_number = device.port_name
+        
         # Trying to find proper port from the list of existing ports,
         # Using device name and welcome message
         if com_port_number is None:
@@ -159,7 +193,7 @@ class tool(llc.serial_device):
                 logging.error("Tool initialization: No serial port name provided.")
                 return
         
-        super().__init__(com_port_number, welcome_message=self.welcome_message)
+        super().__init__(com_port_number, welcome_message=self.welcome_message, device=device)
 
         
     def _populateNames(self, rack_type=None, rack_name=None, tool_type=None, tool_name=None):
@@ -213,12 +247,73 @@ class tool(llc.serial_device):
         return result
         
     def save(self):
-        tool_name = self.tool_data['name']
-        f = open(tool_name+'.json', 'w')
-        f.write(json.dumps(self.tool_data))
-        f.close()
+        """
+        Saves tool data into the deck store, see param.deck_store
+        """
+        param.getDeckStore().save(param.STORE_TOOL, self.tool_data['name'], self.tool_data)
+
+
+
+class tool_pool():
+    """
+    Keeps mobile tools of the session between returning a tool to its rack and 
+    picking it up again. A re-attached tool keeps its loaded configs, rack data 
+    and state, and takes over the connection opened at docking, so it is not 
+    initialized again.
+    
+    Tools are recognized by USB identity of the device (see llc.usbIdentities()),
+    or by the welcome message if the device has no serial number, and by the tool name.
+    Only tools used with the same robot are re-attached.
+    """
+    
+    def __init__(self):
+        self.tools = []
+    
+    
+    def deviceIdentity(self, device):
+        identity = llc.usbIdentities().get(device.port_name)
+        if identity is None:
+            identity = str(device.actual_welcome_message).strip()
+        return identity
+    
+    
+    def release(self, tool):
+        """
+        Keeps tool, which is about to be returned, for re-use.
+        """
+        identity = self.deviceIdentity(tool)
+        self.tools = [(i, t) for i, t in self.tools if t is not tool]
+        self.tools.append((identity, tool))
+    
+    
+    def attach(self, cls, robot, device, tool_name=None):
+        """
+        Finds returned tool of class cls connected as device, and gives it the connection.
+        
+        Returns:
+            Re-attached tool, or None if this tool was not used before.
+        """
+        identity = self.deviceIdentity(device)
+        for entry in self.tools:
+            pooled_identity, pooled_tool = entry
+            if (pooled_identity == identity and isinstance(pooled_tool, cls) 
+                    and pooled_tool.robot is robot
+                    and (tool_name is None or pooled_tool.tool_name == tool_name)):
+                self.tools.remove(entry)
+                pooled_tool.attachDevice(device)
+                logging.info("Tool %s re-attached at port %s.", pooled_tool.tool_name, device.port_name)
+                pooled_tool.initializeDevice()
+                return pooled_tool
+        return None
+    
+    
+    def clear(self):
+        self.tools = []
 
 
+# Tools of the current session, returned to their racks.
+connection_pool = tool_pool()
+
     
 class mobile_tool(tool):
     """
@@ -226,7 +321,7 @@ class mobile_tool(tool):
     """
     def __init__(self, robot, com_port_number=None, 
                  tool_name=None, tool_type=None, rack_name=None, rack_type=None,
-                 welcome_message=None):
+                 welcome_message=None, device=None):
         """
         Handles any general tool properties; that any tool will have.
         This class will rarely be used by itself, instead, it is
@@ -263,10 +358,20 @@ class mobile_tool(tool):
             # If variable is not there, I'm just assinging zero
             # If necessary, it can be chagned later.
             self.z_safe = 0
+        # False while the caller orders tool and gantry movements itself, see waitForGantry()
+        self.synchronize_gantry = True
         
         super().__init__(robot=robot, com_port_number=com_port_number, 
                  tool_name=tool_name, tool_type=tool_type, rack_name=rack_name, rack_type=rack_type,
-                 welcome_message=welcome_message)
+                 welcome_message=welcome_message, device=device)
+
+
+    def initializeDevice(self):
+        """
+        Brings the tool hardware into working state. Called every time the tool is 
+        connected, as the tool is powered off while sitting in its rack.
+        """
+        pass
 
     @classmethod
     def getToolAtCoord(cls, 
@@ -299,11 +404,14 @@ class mobile_tool(tool):
             tool_name=None, tool_type=None, rack_name=None, rack_type=None,
             welcome_message=None):
         """
-        Initializa tool instance from already existing serial_device instance
+        Initializa tool instance from already existing serial_device instance.
+        If this tool was used and returned before, the same object is re-attached
+        to the device; otherwise a new one takes over the device connection.
         """
         
-        port_name = device.port_name
-        device.close()
+        pooled_tool = connection_pool.attach(cls, robot, device, tool_name=tool_name)
+        if pooled_tool is not None:
+            return pooled_tool
         
         # Defining variables for compatibility
         #cls.x_dock = None
@@ -311,7 +419,7 @@ class mobile_tool(tool):
         #cls.z_dock = None
         #cls.z_safe = None
         
-        return cls(robot=robot, com_port_number=port_name,
+        return cls(robot=robot, device=device,
                    tool_name=tool_name, tool_type=tool_type, rack_name=rack_name, rack_type=rack_type,
                    welcome_message=welcome_message)
 
@@ -431,6 +539,8 @@ class mobile_tool(tool):
         where there is a connection with it or whether it is initilized.
         User is responsible for prepping the tool for return, if applicable.
         """
+        # Keeping the tool object for the next pickup
+        connection_pool.release(self)
         try:
             # Attempting to close the serial connection with a tool before returning it.
             self.close()
@@ -439,6 +549,16 @@ class mobile_tool(tool):
         self.robot.returnToolToCoord(x, y, z, z_init=z_init, speed_xy=speed_xy, speed_z=speed_z)
     
     
+    def waitForGantry(self):
+        """
+        Waits until the gantry physically stops, before the tool moves anything.
+        Does nothing when synchronize_gantry is False, e.g. when the protocol
+        scheduler runs a tool action concurrently with gantry movements.
+        """
+        if self.synchronize_gantry:
+            self.robot.synchronize()
+
+
     def _protectiveZMove(self, z_current, z_safe, movement_allowed):
         if z_current > z_safe and movement_allowed:
             self.robot.move(z=z_safe)
@@ -460,6 +580,13 @@ class mobile_tool(tool):
                 If False, will not perform height check, and will not move Z axis at all.
                 
         """
+        self._raiseAboveSample(sample, z_above_the_top, move_z)
+        # Moving to the sample position
+        x, y = sample.getSampleCenterXY(self)
+        self.robot.move(x=x, y=y)
+
+
+    def _raiseAboveSample(self, sample, z_above_the_top, move_z):
         # Current Z position
         z = self.robot.getAxisPosition(axis='z')
         # Z coordinate of the top of the sample
@@ -469,9 +596,6 @@ class mobile_tool(tool):
         # If the end of the tool is lower than safe Z coordinate, raise Z gantry
         # Higher z value, lower the gantry is.
         self._protectiveZMove(z, z_safe, move_z)
-        # Moving to the sample position
-        x, y = sample.getSampleCenterXY(self)
-        self.robot.move(x=x, y=y)
 
     def getToPosition(self, rack, column, row, z_above_the_top=10):
         """
@@ -501,15 +625,193 @@ class mobile_tool(tool):
         self.robot.move(x=x, y=y)
         
     
+class grbl_controller():
+    """
+    Talks to GRBL firmware of a pipettor.
+    
+    Commands are streamed with character counting: a command is sent as soon
+    as it fits into the firmware receive buffer together with the commands 
+    not acknowledged yet. Every command gets a Future, which is resolved
+    by a background thread the moment the firmware answers "ok" or "error".
+    Physical completion of the movements is awaited with GRBL_SYNC_CMD,
+    which GRBL acknowledges only when the plunger stops, instead of polling the status.
+    Status reports (answers to "?") are parsed into self.status.
+    """
+    
+    def __init__(self, device, rx_buffer_size=GRBL_RX_BUFFER_SIZE):
+        """
+        Inputs:
+            device
+                serial_device connected to the firmware. Nothing else should read its answers.
+            rx_buffer_size
+                Size of the firmware receive buffer, bytes
+        """
+        self.device = device
+        self.rx_buffer_size = rx_buffer_size
+        self.condition = threading.Condition()
+        # Commands waiting for acknowledgement: [length, future, message received so far]
+        self.pending = collections.deque()
+        self.buffered = 0
+        # Last status report: {'state': 'Idle', 'position': (x, y, z)}
+        self.status = None
+        self.status_count = 0
+        self.thread = None
+        self._stop_event = threading.Event()
+    
+    
+    def start(self):
+        """
+        Starts thread dispatching the firmware answers. Called automatically when sending.
+        """
+        with self.condition:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self._stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True, 
+                                           name="grbl " + str(self.device.port_name))
+            self.thread.start()
+    
+    
+    def stop(self, timeout=1):
+        self._stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+    
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            reader = self.device.reader
+            if reader is None:
+                break
+            try:
+                line = reader.lines.get(timeout=self.device.timeout)
+            except queue.Empty:
+                if not reader.is_alive() and reader is self.device.reader:
+                    # Port closed
+                    break
+                continue
+            self._dispatch(line)
+        with self.condition:
+            self.condition.notify_all()
+    
+    
+    def _dispatch(self, line):
+        line = line.strip()
+        if not line:
+            return
+        with self.condition:
+            if line.startswith('<'):
+                self.status = parseGrblStatus(line)
+                self.status_count += 1
+            elif line == 'ok' or line.startswith('error'):
+                if not self.pending:
+                    logging.warning("grbl_controller: unexpected answer %s.", line)
+                    return
+                length, future, message = self.pending.popleft()
+                self.buffered -= length
+                if line != 'ok':
+                    logging.error("grbl_controller: command failed: %s", line)
+                future.set_result(message + line)
+            else:
+                if line.startswith('ALARM') or line.startswith('Grbl'):
+                    logging.error("grbl_controller: %s", line)
+                if self.pending:
+                    self.pending[0][2] += line + '\n'
+            self.condition.notify_all()
+    
+    
+    def send(self, expression, eol=None):
+        """
+        Sends a command, waiting only while the firmware buffer is full.
+        Returns Future resolved with the firmware answer, which ends with "ok" or "error:N".
+        """
+        self.start()
+        if eol is None:
+            eol = self.device.eol
+        length = len(expression.strip()) + len(eol)
+        future = Future()
+        with self.condition:
+            while self.pending and self.buffered + length > self.rx_buffer_size:
+                if not self.thread.is_alive():
+                    logging.error("grbl_controller: port %s is no longer read.", self.device.port_name)
+                    break
+                self.condition.wait(self.device.timeout)
+            self.pending.append([length, future, ""])
+            self.buffered += length
+            self.device.write(expression, eol, flush=False)
+        return future
+    
+    
+    def sync(self):
+        """
+        Returns Future resolved when all the movements sent before are physically finished.
+        """
+        return self.send(GRBL_SYNC_CMD)
+    
+    
+    def requestStatus(self, timeout=1):
+        """
+        Asks the firmware for its status.
+        Returns status dictionary, see parseGrblStatus(); None if there was no answer.
+        """
+        self.start()
+        with self.condition:
+            count = self.status_count
+            self.device.writeBytes(GRBL_STATUS_REQUEST)
+            if not self.condition.wait_for(lambda: self.status_count > count, timeout):
+                return None
+            return self.status
+
+
+def parseGrblStatus(line):
+    """
+    Parses GRBL status report, such as <Idle|MPos:-10.000,0.000,0.000|FS:0,0>
+    (GRBL 0.9: <Idle,MPos:-10.000,0.000,0.000,WPos:...>)
+    
+    Returns:
+        Dictionary {'state': 'Idle', 'position': (x, y, z)}; position is None if not reported.
+    """
+    state = re.match(r'<(\w+)', line)
+    position = re.search(r'MPos:([-\d.]+),([-\d.]+),([-\d.]+)', line)
+    return {'state': state.group(1) if state else None,
+            'position': tuple(float(v) for v in position.groups()) if position else None}
+
+
+class grbl_command():
+    """
+    Future-like result of a pipettor command: resolved with the answer to the confirmation 
+    command (GRBL_SYNC_CMD, or the command itself), but raises RuntimeError 
+    if the firmware answered the command with "error:N".
+    """
+    
+    def __init__(self, expression, command_future, confirm_future):
+        self.expression = expression
+        self.command_future = command_future
+        self.confirm_future = confirm_future
+    
+    
+    def done(self):
+        return self.confirm_future.done()
+    
+    
+    def result(self, timeout=None):
+        answer = self.confirm_future.result(timeout)
+        # GRBL answers commands in order, so the command is answered by now
+        command_answer = self.command_future.result(timeout).strip()
+        if command_answer.splitlines()[-1].startswith('error'):
+            raise RuntimeError("GRBL rejected command %s: %s" % (self.expression, command_answer))
+        return answer
+
+
 class pipettor(mobile_tool):
 
     def __init__ (self, robot, tool_name, 
                   rack_name=None, rack_type=None, 
                   tool_type=None, com_port_number=None, 
-                  welcome_message=None):
+                  welcome_message=None, device=None):
         super().__init__(robot=robot, com_port_number=com_port_number,
                          tool_name=tool_name, welcome_message='Servo', 
-                         rack_type='pipette_rack', rack_name=tool_name+'_rack')
+                         rack_type='pipette_rack', rack_name=tool_name+'_rack', device=device)
         
         # Loading parameters specific to pipettors from config file
         self.tip_added_z_length = float(self.config['geometry']['tip_added_length'])
@@ -525,6 +827,16 @@ class pipettor(mobile_tool):
         # Switch indicating whether tip is attached or not.
         self.tip_attached = False
         
+        # Firmware communication
+        self.grbl = grbl_controller(self)
+        # See setOverlapping()
+        self.overlap_plunger = False
+        # Plunger commands (grbl_command) sent without waiting, not awaited yet
+        self.plunger_commands = []
+        self.initializeDevice()
+        
+        
+    def initializeDevice(self):
         # Homing pipettor
         if self.tool_name == 'p20':
             self.home(pipettor_speed=300)
@@ -544,28 +856,101 @@ class pipettor(mobile_tool):
         return super().getTool(robot, 
             tool_name=tool_name, welcome_message="Servo", rack_type='pipette_rack', rack_name=tool_name+'_rack')        
     
-    # TODO: Factor this function out into serial_device.
-    def sendCmdToPipette(self, expression, confirm_message="Idle", eol=None):
+    def sendCmdToPipette(self, expression, confirm_message="Idle", eol=None, wait=True, 
+                         after_gantry=True):
         """
         Function will write an expression to the device and wait for the proper response.
         
         Use this function to make the devise perform a physical operation and
         make sure program continues after the operation is physically completed.
         
-        Function will return an output message
+        Inputs:
+            confirm_message
+                "Idle" waits until the plunger physically stops; with any other value
+                the function waits only for the command to be accepted.
+            wait
+                If False, returns grbl_command instead of waiting; see grbl_controller.
+                The command is kept until waitPlunger() is called, so its error is not lost.
+                If True, the commands sent without waiting before are awaited first.
+            after_gantry
+                If False, the command is sent while the gantry may still be moving.
+        
+        Function will return an output message.
+        Raises RuntimeError if the firmware answers the command with "error:N".
+        """
+        if after_gantry:
+            # Plunger must not move before the gantry physically arrives
+            self.waitForGantry()
+        if wait:
+            self.waitPlunger()
+        command_future = self.grbl.send(expression, eol)
+        if confirm_message == "Idle":
+            future = self.grbl.sync()
+        else:
+            future = command_future
+        future = grbl_command(expression, command_future, future)
+        if not wait:
+            self.plunger_commands.append(future)
+            return future
+        return future.result()
+    
+    
+    def setOverlapping(self, enabled=True):
+        """
+        Enables or disables overlapping of plunger and gantry movements.
+        
+        Normally every plunger movement starts when the gantry stops, and the program
+        waits until the plunger stops. In overlapping mode, plunger movements that 
+        do not need the gantry at its destination go on while the gantry moves:
+        the plunger is lowered for uptake while travelling to the sample,
+        and returned to 0 while travelling away after dispensing.
+        Such movements are awaited with waitPlunger() before the tip is lowered 
+        into a sample, so the plunger never moves in the liquid except for pipetting.
+        """
+        if not enabled:
+            self.waitPlunger()
+        logging.info("Pipettor setOverlapping: %s", enabled)
+        self.overlap_plunger = enabled
+    
+    
+    @contextlib.contextmanager
+    def overlapping(self):
         """
-        self.write(expression, eol)
-        
-        full_message = ""
-        while True:
-            message = self.readAll()
-#            if message_level == "verbose":
-#                print(message)
-            if message != "":
-                full_message += message
-                if re.search(pattern=confirm_message, string=full_message):
-                    break
-            self.write("?")
+        Overlaps plunger and gantry movements inside "with" block; see setOverlapping().
+        Waits for the plunger to stop when exiting.
+        Example:
+            with p1000.overlapping():
+                p1000.moveLiquid(tube1, tube2, 500)
+        """
+        previous_overlap = self.overlap_plunger
+        self.setOverlapping(True)
+        try:
+            yield self
+        finally:
+            self.waitPlunger()
+            self.overlap_plunger = previous_overlap
+    
+    
+    def waitPlunger(self):
+        """
+        Waits until plunger movements sent without waiting are physically finished.
+        Raises RuntimeError if the firmware rejected any of them.
+        Returns answer to the last of them; None if there were none.
+        """
+        commands = self.plunger_commands
+        self.plunger_commands = []
+        answer = None
+        error = None
+        for command in commands:
+            try:
+                answer = command.result()
+            except RuntimeError as e:
+                # Waiting for the rest anyway, so none of them is left behind
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        return answer
 
     def home(self, pipettor_speed=400):
         self.setPipettorSpeed(pipettor_speed)
@@ -679,13 +1064,14 @@ class pipettor(mobile_tool):
     def switchModeToDropTip(self):
         self.sendCmdToPipette("M5")
         
-    def movePlunger(self, level):
-        self.sendCmdToPipette("G0 X"+str(level))
+    def movePlunger(self, level, wait=True, after_gantry=True):
+        return self.sendCmdToPipette("G0 X"+str(level), wait=wait, after_gantry=after_gantry)
 
 
-    def movePlungerToVol(self, volume):
+    def movePlungerToVol(self, volume, wait=True, after_gantry=True):
         """
         Moves plunger according to the desired volume position.
+        wait and after_gantry are passed to sendCmdToPipette().
         """
         # Calculating plunger position from desired volume
         # k - slope, b - intercept
@@ -695,7 +1081,7 @@ class pipettor(mobile_tool):
         # Minus is because movement scale is currently from 0 (close to home) to -40
         # farthest from home. The model calibration was done using positive values
         # TODO: add minus to the calibration raw data; remove this minus.
-        self.movePlunger(position)
+        return self.movePlunger(position, wait=wait, after_gantry=after_gantry)
 
     def setPlungerToVolConstants(self, slope, intercept):
         """
@@ -707,6 +1093,27 @@ class pipettor(mobile_tool):
         self.save()
 
     
+    def getToSample(self, sample, z_above_the_top=10, move_z=True, plunger_volume=None):
+        """
+        Moves robot towards the sample; see mobile_tool.getToSample().
+        
+        Inputs:
+            plunger_volume
+                If specified, plunger is moved to this volume position as well.
+                In overlapping mode (see setOverlapping()), the plunger moves while
+                the gantry travels, as soon as the tip is raised above the samples.
+        """
+        if plunger_volume is None or not self.overlap_plunger:
+            super().getToSample(sample, z_above_the_top=z_above_the_top, move_z=move_z)
+            if plunger_volume is not None:
+                self.movePlungerToVol(plunger_volume)
+            return
+        self._raiseAboveSample(sample, z_above_the_top, move_z)
+        self.movePlungerToVol(plunger_volume, wait=False)
+        x, y = sample.getSampleCenterXY(self)
+        self.robot.move(x=x, y=y)
+
+    
     def uptakeLiquid(self, sample, volume, uptake_delay=0, immerse_volume=None, tip_ignore=False,
                      move_z_before_and_after_uptake=True, bottom_gap=10, retract_z_speed=100):
         """
@@ -739,12 +1146,8 @@ class pipettor(mobile_tool):
         if (not self.tip_attached) and (not tip_ignore):
             print("ERROR: pipette tip was not attached.")
             return
-        # Moving robot towards the sample
-        self.getToSample(sample=sample, move_z=move_z_before_and_after_uptake)
-        
-        
-        # Moving plunger down
-        self.movePlungerToVol(volume)
+        # Moving robot towards the sample, and plunger down
+        self.getToSample(sample=sample, move_z=move_z_before_and_after_uptake, plunger_volume=volume)
         
         # Checking whether custom immerse depth is provided; if not, 
         # immerse depth will be calculated from volume that will be left in the sample
@@ -764,6 +1167,8 @@ class pipettor(mobile_tool):
             if immerse_volume < 0:
                 immerse_volume = 0
         
+        # Plunger must be down before the tip enters the liquid
+        self.waitPlunger()
         # Pipetting procedure will differ on whether the tip is fully immersed into the tube
         if immerse_volume == 0:
             # Tip should be fully immersed,
@@ -906,6 +1311,7 @@ class pipettor(mobile_tool):
             immerse_volume = max_vol - immerse_vol_fraction
         # Actually lowering tip
         z_immerse = sample.sampleVolToZ(volume=immerse_volume, tool=self)
+        self.waitPlunger()
         self.robot.move(z=z_immerse)
         # Actually dispensing the liquid
         self.movePlungerToVol(volume)
@@ -924,7 +1330,8 @@ class pipettor(mobile_tool):
             # Now lifting the tip, if plunger retraction was chosen
             z_retract = sample.sampleVolToZ(volume=max_vol + max_vol * 0.2, tool=self)
             self.robot.move(z=z_retract)
-            self.movePlungerToVol(0)
+            # Starts when the tip is out of the liquid
+            self.movePlungerToVol(0, wait=not self.overlap_plunger)
     
     
     def touchWall(self, sample, volume=None, movement=None):
@@ -942,6 +1349,7 @@ class pipettor(mobile_tool):
         # Calculating absolute Z value for given sample, at volume with given tool
         z = sample.sampleVolToZ(volume=volume, tool=self)
         # Moving to the level at which wall will be touched
+        self.waitPlunger()
         self.robot.move(z=z)
         # Calculating touch wall coordinates
         x, y, z = self.robot.getPosition()
@@ -1051,11 +1459,41 @@ class pipettor(mobile_tool):
     def distributeLiquid(self, sample_origin, sample_destination_list, vol_list, raise_z=None,
                          raise_z_between_wells = None,
                          uptake_delay=0, release_delay=0, immerse_vol_origin=None,
-                         immerse_volume_destination=None, touch_wall=False):
+                         immerse_volume_destination=None, touch_wall=False, optimize_route=False,
+                         refill_plan=None):
         """
         Takes liquid from one place and pipettes it into several samples sequentially, 
         according to the provided instructions
-        """
+        
+        Inputs:
+            optimize_route
+                If True, destinations are visited in the order found by planDistribution(),
+                instead of the order given.
+            refill_plan
+                planning.refill_plan, obtained with planRefills() for the same destinations
+                and volumes. If given, the tip is filled once for every batch of the plan, 
+                and the batches are dispensed in the order of the plan. 
+                Otherwise the tip is refilled whenever it does not hold enough for the next destination.
+        """
+        if refill_plan is not None:
+            for batch, batch_volume in zip(refill_plan.batches, refill_plan.batch_volumes):
+                self._refillTip(sample_origin, batch_volume, raise_z=raise_z, 
+                                uptake_delay=uptake_delay, release_delay=release_delay)
+                # Moving towards destination sample
+                self.getToSample(sample=sample_destination_list[batch[0]])
+                # Absolute plunger position, as in the loop below
+                vol_to_move_plunger = self.plunger_slack_compensation_volume
+                for i in batch:
+                    vol_to_move_plunger = vol_to_move_plunger + vol_list[i]
+                    self._dispenseToDestination(sample_destination_list[i], vol_to_move_plunger,
+                                                raise_z_between_wells, release_delay, touch_wall)
+            return
+        if optimize_route:
+            plan = self.planDistribution(sample_origin, sample_destination_list, vol_list)
+            logging.info("distributeLiquid: optimized route, predicted travel %.0f mm instead of %.0f mm.",
+                         plan.length, plan.original_length)
+            sample_destination_list = [sample_destination_list[i] for i in plan.order]
+            vol_list = [vol_list[i] for i in plan.order]
         # Represents current volume of liquit inside pipettor's tip
         vol_in_tip = 0
         # This is how much total volume needs to be moved (to all samples)
@@ -1070,58 +1508,101 @@ class pipettor(mobile_tool):
             # Checking if tip has enough liquid in it
             # If not, taking liquid from sample of origin
             if vol_in_tip < volume:
-                # Raising Z axis before moving to the origin sample
-                if raise_z is not None:
-                    self.robot.move(z=raise_z)
-                # Moving to the sample origin
-                self.getToSample(sample=sample_origin)
-                # Plunger all the way down, to remove all liquid that may remain in 
-                # the tip from previous pipetting
-                self.movePlunger(-40)
-                # Touch wall to remove a possible droplet
-                self.touchWall(sample=sample_origin)
-                vol_in_tip = 0 # Now tip is empty
-                # Moving back up to make sure no liquid is taken when moving plunger up
-                self.getToSample(sample=sample_origin)
                 # Figuring out how much liquid to uptake
                 if remaining_vol_to_move > self.max_allowed_vol:
-                    vol_to_uptake = self.max_allowed_vol + self.plunger_slack_compensation_volume
+                    vol_in_tip = self.max_allowed_vol
                 else:
-                    vol_to_uptake = remaining_vol_to_move + self.plunger_slack_compensation_volume
-                # Actually uptaking liquid
-                self.uptakeLiquid(sample=sample_origin, volume=vol_to_uptake,
-                                  uptake_delay=uptake_delay)
-                vol_in_tip = vol_to_uptake
-                # Dispensing a little of liquid back to the origin tube to 
-                # compensate for the plunger movement slack
-                self.dispenseLiquid(sample=sample_origin, volume=self.plunger_slack_compensation_volume,
-                    release_delay=release_delay, plunger_retract=False)
-                vol_in_tip = vol_in_tip - self.plunger_slack_compensation_volume
+                    vol_in_tip = remaining_vol_to_move
+                self._refillTip(sample_origin, vol_in_tip, raise_z=raise_z, 
+                                uptake_delay=uptake_delay, release_delay=release_delay)
                 # Resetting absolute position every time tip is refilled
                 vol_to_move_plunger = volume + self.plunger_slack_compensation_volume
-                # Touching the liquid to remove droplet
-                curr_sample_vol = sample_origin.getVolume()
-                z_immerse = sample_origin.sampleVolToZ(volume=curr_sample_vol, tool=self)
-                self.robot.move(z=z_immerse)
-                # Raising Z axis after uptaking liquid, to move towards destination sample
-                if raise_z is not None:
-                    self.robot.move(z=raise_z)
                 # Moving towards destination sample
                 self.getToSample(sample=sample_destination)
-            # Adjusting Z level between destination samples
-            if raise_z_between_wells is not None:
-                self.robot.move(z=raise_z_between_wells)
-            # Now pipetting liquid into the next destination
-            # Take care not to retract plunger
-            self.dispenseLiquid(sample=sample_destination, volume=vol_to_move_plunger, 
-                                release_delay=release_delay, plunger_retract=False)
+            self._dispenseToDestination(sample_destination, vol_to_move_plunger, 
+                                        raise_z_between_wells, release_delay, touch_wall)
             vol_in_tip = vol_in_tip - volume
-            # Touching wall to remove stuck groplet, if necessary
-            if touch_wall:
-                self.touchWall(sample=sample_destination)
             # Decreasing total remaining volume to move
             remaining_vol_to_move = remaining_vol_to_move - volume
-            
+    
+    
+    def _refillTip(self, sample_origin, volume, raise_z=None, uptake_delay=0, release_delay=0):
+        """
+        Returns the liquid remaining in the tip into the origin sample, and uptakes
+        volume from it; plunger slack compensation volume is uptaken on top and dispensed back.
+        Used by distributeLiquid().
+        """
+        # Raising Z axis before moving to the origin sample
+        if raise_z is not None:
+            self.robot.move(z=raise_z)
+        # Moving to the sample origin
+        self.getToSample(sample=sample_origin)
+        # Plunger all the way down, to remove all liquid that may remain in 
+        # the tip from previous pipetting
+        self.movePlunger(-40)
+        # Touch wall to remove a possible droplet
+        self.touchWall(sample=sample_origin)
+        # Moving back up to make sure no liquid is taken when moving plunger up
+        self.getToSample(sample=sample_origin)
+        # Actually uptaking liquid
+        self.uptakeLiquid(sample=sample_origin, volume=volume + self.plunger_slack_compensation_volume,
+                          uptake_delay=uptake_delay)
+        # Dispensing a little of liquid back to the origin tube to 
+        # compensate for the plunger movement slack
+        self.dispenseLiquid(sample=sample_origin, volume=self.plunger_slack_compensation_volume,
+            release_delay=release_delay, plunger_retract=False)
+        # Touching the liquid to remove droplet
+        curr_sample_vol = sample_origin.getVolume()
+        z_immerse = sample_origin.sampleVolToZ(volume=curr_sample_vol, tool=self)
+        self.robot.move(z=z_immerse)
+        # Raising Z axis after uptaking liquid, to move towards destination sample
+        if raise_z is not None:
+            self.robot.move(z=raise_z)
+    
+    
+    def _dispenseToDestination(self, sample_destination, vol_to_move_plunger, 
+                               raise_z_between_wells, release_delay, touch_wall):
+        # Adjusting Z level between destination samples
+        if raise_z_between_wells is not None:
+            self.robot.move(z=raise_z_between_wells)
+        # Now pipetting liquid into the next destination
+        # Take care not to retract plunger
+        self.dispenseLiquid(sample=sample_destination, volume=vol_to_move_plunger, 
+                            release_delay=release_delay, plunger_retract=False)
+        # Touching wall to remove stuck groplet, if necessary
+        if touch_wall:
+            self.touchWall(sample=sample_destination)
+    
+
+    def planDistribution(self, sample_origin, sample_destination_list, vol_list):
+        """
+        Finds order of visiting the destination samples by distributeLiquid() with shorter 
+        gantry travel; refills of the tip happen as in distributeLiquid().
+        
+        Returns:
+            planning.distribution_plan; plan.order are indices in sample_destination_list,
+            plan.savings is the predicted travel saved, mm.
+        """
+        origin = sample_origin.getSampleCenterXY(self)
+        points = [sample.getSampleCenterXY(self) for sample in sample_destination_list]
+        return planning.planDistribution(origin, points, vol_list, self.max_allowed_vol)
+    
+
+    def planRefills(self, sample_origin, sample_destination_list, vol_list):
+        """
+        Splits destinations of distributeLiquid() into batches dispensed from one uptake,
+        with as few refills and as short travel as found. No movement is done.
+        Batches fit max_allowed_vol less plunger slack compensation volume.
+        
+        Returns:
+            planning.refill_plan; pass it to distributeLiquid() as refill_plan.
+            plan.report() describes the batches and estimated duration.
+        """
+        origin = sample_origin.getSampleCenterXY(self)
+        points = [sample.getSampleCenterXY(self) for sample in sample_destination_list]
+        capacity = self.max_allowed_vol - self.plunger_slack_compensation_volume
+        return planning.planRefills(origin, points, vol_list, capacity, 
+                                    original_capacity=self.max_allowed_vol)
     
 
     def getHowMuchLongerIsTheToolRelativeToTouchProbe(self):
@@ -1197,7 +1678,272 @@ def approachUntilTouch(robot, touch_function, axis, step, speed_xy=None, speed_z
     return robot.getAxisPosition(axis)
 
 
-def findWall(probe, axis, direction, second_probe=None, step_dict=None, step_back_length=3):
+def approachUntilTouchContinuous(robot, touch_function, axis, direction, 
+                                 speed_xy=None, speed_z=None, max_travel_dist=-1, unstick=False):
+    """
+    Arnie will move along specified "axis" in a single long movement, 
+    which is stopped as soon as touch_function returns False.
+    Stopping coordinate is then read from the firmware.
+    
+        Inputs
+            robot
+                Arnie instance
+            touch_function
+                Function used to evaluate whether probe is touching anything. 
+                Same as in approachUntilTouch, but it must not wait for the 
+                gantry to stop, e.g. lambda: p.isNotTouched(synchronize=False)
+            axis
+                string, "x", "y" or "z"
+            direction
+                +1 or -1
+            speed_xy, speed_z
+                axis moving speed. Using robot defaults at cartesian.py
+            max_travel_dist
+                maximum distance allowed to travel. 
+                -1 means no limit. Default is -1
+            unstick
+                If True (retraction from a touched wall), after travelling max_travel_dist 
+                robot moves back to the initial position to unstuck the probe, and tries again,
+                up to PROBE_UNSTICK_ATTEMPTS times.
+                Otherwise movement ends there, with an error logged. Default is False
+    """
+    if speed_xy is None:
+        speed_xy = robot.speed_x
+    if speed_z is None:
+        speed_z = robot.speed_z
+    speed = speed_z if axis.lower() == 'z' else speed_xy
+    
+    starting_coord = robot.getAxisPosition(axis)
+    if max_travel_dist >= 0:
+        travel = max_travel_dist
+    else:
+        travel = PROBE_MAX_TRAVEL
+    unstick_attempts = 0
+    
+    while touch_function():
+        robot.moveAxis(axis, robot.getAxisPosition(axis) + direction * travel, 
+                       speed=speed, wait=False)
+        deadline = time.monotonic() + robot.estimateMoveTime(travel, speed) + PROBE_TIME_MARGIN
+        while time.monotonic() < deadline and touch_function():
+            pass
+        robot.quickStop()
+        if max_travel_dist >= 0 and touch_function():
+            # Travelled all the allowed distance without the probe changing state.
+            if not unstick or unstick_attempts >= PROBE_UNSTICK_ATTEMPTS:
+                logging.error("approachUntilTouchContinuous: probe state did not change "
+                              "within %s mm along %s axis.", max_travel_dist, axis)
+                break
+            # Moving back to initial position to unstuck it, as approachUntilTouch does.
+            unstick_attempts += 1
+            robot.moveAxis(axis, starting_coord)
+    
+    return robot.getAxisPosition(axis)
+
+
+def approachUntilTouchFirmware(robot, touch_function, axis, direction, 
+                               speed_xy=None, speed_z=None, max_travel_dist=-1, away=False, 
+                               unstick=False):
+    """
+    Same as approachUntilTouchContinuous, but movement is stopped by Marlin itself 
+    (G38.2, or G38.4 if away is True), so stopping does not depend on host response time.
+    Only works if touch probe signal is wired to the firmware probe pin.
+    touch_function is used to check whether movement is needed at all, 
+    and whether the probe changed state by the end of the movement.
+    A single movement covers at most max_travel_dist (PROBE_MAX_TRAVEL if there is no limit);
+    see approachUntilTouchContinuous for unstick.
+    """
+    if speed_xy is None:
+        speed_xy = robot.speed_x
+    if speed_z is None:
+        speed_z = robot.speed_z
+    speed = speed_z if axis.lower() == 'z' else speed_xy
+    
+    starting_coord = robot.getAxisPosition(axis)
+    if max_travel_dist >= 0:
+        travel = max_travel_dist
+    else:
+        travel = PROBE_MAX_TRAVEL
+    unstick_attempts = 0
+    
+    while touch_function():
+        robot.probeMove(axis, starting_coord + direction * travel, speed=speed, away=away)
+        if not touch_function():
+            break
+        # Travelled all the allowed distance without the probe changing state.
+        if not unstick or unstick_attempts >= PROBE_UNSTICK_ATTEMPTS:
+            logging.error("approachUntilTouchFirmware: probe state did not change "
+                          "within %s mm along %s axis.", travel, axis)
+            break
+        # Moving back to initial position to unstuck it, as approachUntilTouch does.
+        unstick_attempts += 1
+        robot.moveAxis(axis, starting_coord)
+    
+    return robot.getAxisPosition(axis)
+
+
+class search_counter():
+    """
+    Wraps arnie instance, counting movements made through it.
+    Also counts probe reads made through the functions wrapped by countReads.
+    """
+    MOVE_METHODS = ('move', 'move_delta', 'moveAxis', 'moveAxisDelta', 'moveXY', 'probeMove')
+    
+    def __init__(self, robot):
+        self.robot = robot
+        self.moves = 0
+        self.probe_reads = 0
+    
+    def __getattr__(self, name):
+        attr = getattr(self.robot, name)
+        if name not in self.MOVE_METHODS:
+            return attr
+        def counted_move(*args, **kwargs):
+            self.moves += 1
+            return attr(*args, **kwargs)
+        return counted_move
+    
+    def countReads(self, touch_function):
+        def counted_touch_function():
+            self.probe_reads += 1
+            return touch_function()
+        return counted_touch_function
+    
+    def stats(self):
+        return {'moves': self.moves, 'probe_reads': self.probe_reads}
+
+
+def _touchFunctions(probe, second_probe=None, synchronize=True):
+    """
+    Returns functions used to retract from the wall and to approach it.
+    With second_probe, retraction continues while any of the probes touches, 
+    and approach - until any of them touches.
+    """
+    if second_probe is not None:
+        def retract_touch_function():
+            return (probe.isTouched(synchronize=synchronize) or 
+                    second_probe.isTouched(synchronize=synchronize))
+        def forward_touch_function():
+            return (probe.isNotTouched(synchronize=synchronize) and 
+                    second_probe.isNotTouched(synchronize=synchronize))
+    else:
+        def retract_touch_function():
+            return probe.isTouched(synchronize=synchronize)
+        def forward_touch_function():
+            return probe.isNotTouched(synchronize=synchronize)
+    return retract_touch_function, forward_touch_function
+
+
+def _findWallStaged(robot, retract_touch_function, forward_touch_function, axis, direction, 
+                    step_dict, probing_mode):
+    """
+    Approaches the wall and retracts from it according to step_dict stages; see findWall.
+    """
+    # Iterating through dictionary keys in the right order; i.e. starting from smallest
+    for key in range(0, len(step_dict)):
+        current_step_dict = step_dict[key]
+        
+        # Determining max travel distance for retraction
+        # To fix probe sticktion
+        if key == 0:
+            max_travel_dist = current_step_dict['step_back'] * 2
+        else:
+            max_travel_dist = step_dict[key-1]['step_back'] * 2
+        
+        if probing_mode == 'step':
+            # Going backwards until touch probe no longer touches anything
+            approachUntilTouch(robot=robot, touch_function=retract_touch_function,
+                axis=axis,
+                step=(-direction * current_step_dict['step_back']),
+                speed_xy=current_step_dict['speed_xy_back'], 
+                speed_z=current_step_dict['speed_z_back'],
+                max_travel_dist=max_travel_dist)
+            
+            # Going forward until hitting the wall
+            coord = approachUntilTouch(robot=robot, touch_function=forward_touch_function,
+                axis=axis, 
+                step=(direction * current_step_dict['step_fwd']), 
+                speed_xy=current_step_dict['speed_xy_fwd'], 
+                speed_z=current_step_dict['speed_z_fwd'])
+            continue
+        
+        if probing_mode == 'continuous':
+            approach = approachUntilTouchContinuous
+            retract_kwargs = {'unstick': True}
+        else:
+            approach = approachUntilTouchFirmware
+            retract_kwargs = {'away': True, 'unstick': True}
+        # Wall is expected within previous retraction distance; 
+        # on the first stage there is no estimate yet.
+        if key == 0:
+            fwd_travel_dist = -1
+        else:
+            fwd_travel_dist = max_travel_dist
+        
+        approach(robot=robot, touch_function=retract_touch_function,
+            axis=axis, direction=-direction,
+            speed_xy=current_step_dict['speed_xy_back'], 
+            speed_z=current_step_dict['speed_z_back'],
+            max_travel_dist=max_travel_dist, **retract_kwargs)
+        
+        coord = approach(robot=robot, touch_function=forward_touch_function,
+            axis=axis, direction=direction,
+            speed_xy=current_step_dict['speed_xy_fwd'], 
+            speed_z=current_step_dict['speed_z_fwd'],
+            max_travel_dist=fwd_travel_dist)
+    
+    return coord
+
+
+def _findWallBisection(robot, retract_touch_function, forward_touch_function, axis, direction, 
+                       search_dict):
+    """
+    Brackets the wall and bisects the bracket; see findWall.
+    Probe is read only while gantry stands still, and tested points are always 
+    approached from the free side, so probe release hysteresis does not matter.
+    """
+    if axis.lower() == 'z':
+        speed = search_dict['speed_z']
+    else:
+        speed = search_dict['speed_xy']
+    
+    # Getting away from the wall, if touching it already
+    step = search_dict['initial_step']
+    free_coord = robot.getAxisPosition(axis)
+    while retract_touch_function():
+        free_coord = free_coord - direction * step
+        robot.moveAxis(axis, free_coord, speed=speed)
+        step = min(step * 2, search_dict['max_step'])
+    
+    # Approaching with growing steps, until the wall is bracketed
+    step = search_dict['initial_step']
+    touch_coord = None
+    while touch_coord is None:
+        coord = free_coord + direction * step
+        robot.moveAxis(axis, coord, speed=speed)
+        if forward_touch_function():
+            free_coord = coord
+            step = min(step * 2, search_dict['max_step'])
+        else:
+            touch_coord = coord
+    
+    # Halving the bracket
+    at_free_coord = False
+    while abs(touch_coord - free_coord) > search_dict['resolution']:
+        middle = (free_coord + touch_coord) / 2.0
+        if not at_free_coord:
+            robot.moveAxis(axis, free_coord, speed=speed)
+        robot.moveAxis(axis, middle, speed=speed)
+        at_free_coord = forward_touch_function()
+        if at_free_coord:
+            free_coord = middle
+        else:
+            touch_coord = middle
+    
+    return touch_coord
+
+
+def findWall(probe, axis, direction, second_probe=None, step_dict=None, step_back_length=3, 
+             probing_mode='step', strategy='staged', search_dict=None, resolution=None):
     """
     Find coordinate of the wall on given "axis".
     Will move on "axis" into "direction", until touch probe detects collision. Then it 
@@ -1229,8 +1975,25 @@ def findWall(probe, axis, direction, second_probe=None, step_dict=None, step_bac
             }
         step_back_length
             distance to retract after finishing calibration; default is 5.
+        probing_mode
+            'step', 'continuous' or 'firmware'; see PROBING_MODES. 
+            With 'continuous' and 'firmware', every approach and retraction is 
+            a single movement; step_dict steps are only used to limit travel distance.
+        strategy
+            'staged' or 'bisection'; see SEARCH_STRATEGIES.
+            'staged' approaches and retracts according to step_dict.
+            'bisection' approaches with steps growing twice every time, until collision 
+            is detected; then the interval between the last free and the touching 
+            coordinates is halved until it is not longer than the resolution.
+            Bisection reads the probe only when gantry stands still, so probing_mode is ignored.
+        search_dict
+            Settings for 'bisection' strategy; probe.search_dict if not provided.
+            {'initial_step': 0.25, 'max_step': 1, 'resolution': 0.02, 'speed_xy': 250, 'speed_z': 1000}
+        resolution
+            Overrides search_dict['resolution'], mm.
     
     Returns coordinate at which collision was detected during finest approach.
+    Number of movements and probe reads used is saved in probe.last_search_stats.
     """
     # Sanity checks --------------------------------------------------------------------------------------------------------
     # direction should be either 1 or -1
@@ -1238,6 +2001,14 @@ def findWall(probe, axis, direction, second_probe=None, step_dict=None, step_bac
         logging.error("Mobile touch probe, findWall(): wrong direction provided.")
         logging.error("Possible values are 1 or -1; provided value: %s", direction)
         return
+    if probing_mode not in PROBING_MODES:
+        logging.error("Mobile touch probe, findWall(): wrong probing mode provided.")
+        logging.error("Possible values are %s; provided value: %s", PROBING_MODES, probing_mode)
+        return
+    if strategy not in SEARCH_STRATEGIES:
+        logging.error("Mobile touch probe, findWall(): wrong search strategy provided.")
+        logging.error("Possible values are %s; provided value: %s", SEARCH_STRATEGIES, strategy)
+        return
     #  --------------------------------------------------------------------------------------------
     
     # If settings dictionary is not provided, the following ones will be used.
@@ -1245,50 +2016,40 @@ def findWall(probe, axis, direction, second_probe=None, step_dict=None, step_bac
     if step_dict is None:
         step_dict = probe.step_dict
         
-    # Iterating through dictionary keys in the right order; i.e. starting from smallest
-    for key in range(0, len(step_dict)):
-        current_step_dict = step_dict[key]
-        
-        if second_probe is not None:
-            def retract_touch_function():
-                return (probe.isTouched() or second_probe.isTouched())
-            def forward_touch_function():
-                return (probe.isNotTouched() and second_probe.isNotTouched())
-        else:
-            retract_touch_function = probe.isTouched
-            forward_touch_function = probe.isNotTouched
-        
-        # Determining max travel distance for retraction
-        # To fix probe sticktion
-        if key == 0:
-            max_travel_dist = current_step_dict['step_back'] * 2
-        else:
-            max_travel_dist = step_dict[key-1]['step_back'] * 2
-        
-        # Going backwards until touch probe no longer touches anything
-        approachUntilTouch(robot=probe.robot, touch_function=retract_touch_function,
-            axis=axis,
-            step=(-direction * current_step_dict['step_back']),
-            speed_xy=current_step_dict['speed_xy_back'], 
-            speed_z=current_step_dict['speed_z_back'],
-            max_travel_dist=max_travel_dist)
-        
-        # Going forward until hitting the wall
-        coord = approachUntilTouch(robot=probe.robot, touch_function=forward_touch_function,
-            axis=axis, 
-            step=(direction * current_step_dict['step_fwd']), 
-            speed_xy=current_step_dict['speed_xy_fwd'], 
-            speed_z=current_step_dict['speed_z_fwd'])
-            
+    # Movements and probe reads are counted, to compare strategies.
+    robot = search_counter(probe.robot)
+    # Continuous movements are stopped by the probe state, which is asked 
+    # while the gantry is still moving.
+    retract_touch_function, forward_touch_function = _touchFunctions(
+        probe, second_probe, synchronize=(probing_mode == 'step' or strategy == 'bisection'))
+    retract_touch_function = robot.countReads(retract_touch_function)
+    forward_touch_function = robot.countReads(forward_touch_function)
+    
+    if strategy == 'bisection':
+        if search_dict is None:
+            search_dict = probe.search_dict
+        search_dict = dict(search_dict)
+        if resolution is not None:
+            search_dict['resolution'] = resolution
+        coord = _findWallBisection(robot, retract_touch_function, forward_touch_function, 
+                                   axis, direction, search_dict)
+    else:
+        coord = _findWallStaged(robot, retract_touch_function, forward_touch_function, 
+                                axis, direction, step_dict, probing_mode)
+    
     # Retracting after calibration is finished
-    [dx, dy, dz] = probe.robot.axisToCoordinates(axis=axis, value=(-direction * step_back_length))
-    probe.robot.move_delta(dx=dx, dy=dy, dz=dz)
+    [dx, dy, dz] = robot.axisToCoordinates(axis=axis, value=(-direction * step_back_length))
+    robot.move_delta(dx=dx, dy=dy, dz=dz)
     
+    probe.last_search_stats = robot.stats()
+    logging.info("findWall: wall found at %s=%s with %s moves and %s probe reads.", 
+                 axis, coord, robot.moves, robot.probe_reads)
     return coord
 
 
 def findWallManyPoints(probe, axis, direction, touch_coord_list, 
-        second_probe=None, step_dict=None, step_back_length=3):
+        second_probe=None, step_dict=None, step_back_length=3, probing_mode='step',
+        strategy='staged'):
     """
     Probe wall against many points.
     
@@ -1305,13 +2066,16 @@ def findWallManyPoints(probe, axis, direction, touch_coord_list,
         wall_coord = findWall(probe=probe, axis=axis, direction=direction,
                                    second_probe=second_probe,
                                    step_dict=step_dict,
-                                   step_back_length=step_back_length)
+                                   step_back_length=step_back_length,
+                                   probing_mode=probing_mode,
+                                   strategy=strategy)
         points_list.append(wall_coord)
     return points_list
     
     
 def findCenterOuterTwoProbes(probe1, probe2, axis, raise_height=None, dist_through_obstruct=None,
-                        step_dict=None, step_back_length=3, opposite_side_dist=0, direction=1):
+                        step_dict=None, step_back_length=3, opposite_side_dist=0, direction=1,
+                        probing_mode='step', strategy='staged'):
     # TODO: Remove raise_height and dist_through_obstruct completely, 
     # for now only left them for possible back compatibility
     # Assuming probe1 is a mobile probe; and probe2 is a stationary probe
@@ -1326,7 +2090,9 @@ def findCenterOuterTwoProbes(probe1, probe2, axis, raise_height=None, dist_throu
                      axis=axis, 
                      direction=direction, 
                      step_dict=step_dict, 
-                     second_probe=probe2)
+                     second_probe=probe2,
+                     probing_mode=probing_mode,
+                     strategy=strategy)
     # Raise gantry
     probe1.robot.move_delta(dz=-raise_z)
     # Move through obstruction
@@ -1338,7 +2104,9 @@ def findCenterOuterTwoProbes(probe1, probe2, axis, raise_height=None, dist_throu
                      axis=axis, 
                      direction=-direction, 
                      step_dict=step_dict,
-                     second_probe=probe2)
+                     second_probe=probe2,
+                     probing_mode=probing_mode,
+                     strategy=strategy)
     # Calculateing center
     center = (front_wall + rear_wall) / 2.0
     return center
@@ -1370,16 +2138,29 @@ class touch_probe():
                 2: {'step_fwd': 0.05, 'speed_xy_fwd': 25, 'speed_z_fwd':500,
                     'step_back': 0.2, 'speed_xy_back': 50, 'speed_z_back':500},
             }
+    
+    # Default probing mode for findWall and findCenter methods; see PROBING_MODES
+    probing_mode = 'step'
+    # Default wall search strategy and settings for 'bisection' strategy; see findWall
+    search_strategy = 'staged'
+    search_dict = {'initial_step': 0.25, 'max_step': 1, 'resolution': 0.02, 
+                   'speed_xy': 250, 'speed_z': 1000}
+    # Number of movements and probe reads used by the last findWall
+    last_search_stats = None
 
     
-    def isTouched(self):
+    def isTouched(self, synchronize=True):
+        # Probe state is only meaningful when the gantry stands still,
+        # unless it is watched during continuous approach.
+        if synchronize:
+            self.robot.synchronize()
         self.write('d')
         response = self.readAll()
         logging.info("Touch probe response: %s", response)
         return bool(int(re.split(pattern='/r/n', string=response)[0]))
     
-    def isNotTouched(self):
-        return not self.isTouched()    
+    def isNotTouched(self, synchronize=True):
+        return not self.isTouched(synchronize=synchronize)    
     
 
     def approachUntilTouch(self, axis, step, retract=False, speed_xy=None, speed_z=None):
@@ -1396,23 +2177,34 @@ class touch_probe():
         return approachUntilTouch(self.robot, touch_function, axis, step, speed_xy=None, speed_z=None)
 
 
-    def findWall(self, axis, direction, step_dict=None, step_back_length=3):
+    def findWall(self, axis, direction, step_dict=None, step_back_length=3, probing_mode=None,
+                 strategy=None, resolution=None):
         if step_dict is None:
             step_dict = self.step_dict
+        if probing_mode is None:
+            probing_mode = self.probing_mode
+        if strategy is None:
+            strategy = self.search_strategy
         return findWall(self, axis, direction, 
                    step_dict=step_dict, 
-                   step_back_length=step_back_length)
+                   step_back_length=step_back_length,
+                   probing_mode=probing_mode,
+                   strategy=strategy,
+                   resolution=resolution)
         
     
-    def findCenterInner(self, axis, step_dict=None, opposite_side_dist=0, direction=1, step_back_length=3):
+    def findCenterInner(self, axis, step_dict=None, opposite_side_dist=0, direction=1, step_back_length=3,
+                        probing_mode=None, strategy=None):
         # Finding first wall
         front_wall = self.findWall(axis=axis, direction=direction, step_dict=step_dict,
-                                   step_back_length=step_back_length)
+                                   step_back_length=step_back_length, probing_mode=probing_mode,
+                                  strategy=strategy)
         # Moving to the other wall
         self.robot.moveAxisDelta(axis=axis, value=-direction*opposite_side_dist)
         # Finding second wall
         rear_wall = self.findWall(axis=axis, direction=-direction, step_dict=step_dict, 
-                                  step_back_length=step_back_length)
+                                  step_back_length=step_back_length, probing_mode=probing_mode,
+                                  strategy=strategy)
         # Calculating center
         center = (front_wall + rear_wall) / 2.0
         return center
@@ -1420,7 +2212,7 @@ class touch_probe():
     
     def findCenterOuter(self, axis, raise_height, dist_through_obstruct,
                         step_dict=None, opposite_side_dist=0, direction=1, 
-                        step_back_length=3):
+                        step_back_length=3, probing_mode=None, strategy=None):
         """
         Performs "Pi-type" calibtation: from one side of the wall, then go through the wall,
         then from the other side of the wall.
@@ -1432,11 +2224,16 @@ class touch_probe():
                 height at which to raise gantry, so the probe can go through the obstruction
             dist_through_obstruct
                 distance to travel to get through the obstruction
+            probing_mode
+                'step', 'continuous' or 'firmware'; probe default if not specified.
+            strategy
+                'staged' or 'bisection'; probe default if not specified.
             ...
         """
         # Find first wall
         front_wall = self.findWall(axis=axis, direction=direction, step_dict=step_dict, 
-                                   step_back_length=step_back_length)
+                                   step_back_length=step_back_length, probing_mode=probing_mode,
+                                  strategy=strategy)
         # Raise gantry
         self.robot.move_delta(dz=-raise_height)
         # Move through obstruction
@@ -1445,7 +2242,8 @@ class touch_probe():
         self.robot.moveAxisDelta(axis='z', value=raise_height)
         # Find opposite side of the wall
         rear_wall = self.findWall(axis=axis, direction=-direction, step_dict=step_dict, 
-                                  step_back_length=step_back_length)
+                                  step_back_length=step_back_length, probing_mode=probing_mode,
+                                  strategy=strategy)
         # Calculateing center
         center = (front_wall + rear_wall) / 2.0
         return center
@@ -1456,11 +2254,11 @@ class mobile_touch_probe(mobile_tool, touch_probe):
 
     def __init__(self, robot, com_port_number=None, 
                  tool_name='mobile_touch_probe', tool_type=None, rack_name=None, rack_type=None, 
-                 welcome_message='mobile touch probe'):
+                 welcome_message='mobile touch probe', device=None):
         self.step_dict = touch_probe.step_dict
         super().__init__(robot, com_port_number=com_port_number, 
                  tool_name=tool_name,
-                 welcome_message=welcome_message)
+                 welcome_message=welcome_message, device=device)
 
 
     @classmethod
@@ -1493,10 +2291,10 @@ class mobile_gripper(mobile_tool):
 
     def __init__(self, robot, com_port_number=None, 
                  tool_name='mobile_gripper', tool_type=None, rack_name=None, rack_type='mobile_gripper_rack', 
-                 welcome_message='mobile gripper'):
+                 welcome_message='mobile gripper', device=None):
         super().__init__(robot, com_port_number=com_port_number, 
                  tool_name=tool_name,
-                 welcome_message=welcome_message)
+                 welcome_message=welcome_message, device=device)
         self.eol = ''
         self.gripper_has_something = False
         self.added_z_length = 0
@@ -1523,6 +2321,8 @@ class mobile_gripper(mobile_tool):
         self.writeAndWait("G0 "+str(angle), confirm_message='\r\n')
         
     def operateGripper(self, angle, powerdown=True):
+        # Jaws must not move before the gantry physically arrives
+        self.waitForGantry()
         self.powerUp()
         self.moveServo(angle)
         time.sleep(1.5)